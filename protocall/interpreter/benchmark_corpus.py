@@ -0,0 +1,112 @@
+# Copyright 2016 Google Inc. All Rights Reserved.
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Representative SeeThruP0 programs for benchmark_suite.py.  Each generator
+# takes a size and returns the source of a program whose work, and for
+# straight_line and deep_expression whose text, grows linearly with it,
+# together with the value the program returns.
+#
+# Except for deep_expression, the programs stay within what grammar.py can
+# parse: no chains of operators on one precedence level, no parenthesized
+# expressions, no calls nested in arithmetic and no nested proto literals.
+
+def loop(n):
+  return """{
+  i = %d;
+  s = 0;
+  while (i > 0) {
+    s = s + i;
+    i = i - 1;
+  };
+  return s;
+}""" % n, n * (n + 1) // 2
+
+# Calls f about n times in total.
+def recursion(n):
+  depth = 1
+  while fibonacci_calls(depth) < n:
+    depth += 1
+  return """{
+  define f {
+    if (x < 2) {
+      return x;
+    };
+    a = f(x=x - 1);
+    b = f(x=x - 2);
+    return a + b;
+  };
+  return f(x=%d);
+}""" % depth, fibonacci(depth)
+
+def fibonacci(n):
+  a, b = 0, 1
+  for i in range(n):
+    a, b = b, a + b
+  return a
+
+def fibonacci_calls(n):
+  if n < 2:
+    return 1
+  return fibonacci_calls(n - 1) + fibonacci_calls(n - 2) + 1
+
+def array(n):
+  return """{
+  a = {0, 1, 2};
+  i = 0;
+  while (i < %d) {
+    append(a=a, v=i);
+    a[0] = i;
+    i = i + 1;
+  };
+  return a[0];
+}""" % n, n - 1
+
+def proto(n):
+  return """{
+  p = Person<id: 0 name: "Ann" email: "ann@example.com">;
+  while (p.id < %d) {
+    q = Person<id: 7 name: "Bob">;
+    p.person = q;
+    p.id = p.id + 1;
+  };
+  return p.id;
+}""" % n, n
+
+# n statements with the deepest flat expressions grammar.py accepts.
+def straight_line(n):
+  lines = ["{", "  x = 1;"]
+  for i in range(n):
+    lines.append("  x = %d + x * 2 / 2;" % (i % 7))
+  lines.append("  return x;")
+  lines.append("}")
+  return "\n".join(lines), 1 + sum(i % 7 for i in range(n))
+
+# One expression nested n parentheses deep.  grammar.py's time grows
+# exponentially with parenthesis depth, so this program is only parsed by
+# pratt_parser.
+def deep_expression(n):
+  e = "x"
+  for i in range(n):
+    e = "(%s + 1)" % e
+  return "{\n  x = 0;\n  return %s;\n}" % e, n
+
+# name: (generator, parsed by grammar.py)
+programs = [
+  ("loop", loop, True),
+  ("recursion", recursion, True),
+  ("array", array, True),
+  ("proto", proto, True),
+  ("straight_line", straight_line, True),
+  ("deep_expression", deep_expression, False),
+]
@@ -0,0 +1,154 @@
+# Copyright 2016 Google Inc. All Rights Reserved.
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Usage: benchmark_suite.py [--sizes=10,100] [--programs=loop,...]
+#                           [--repeat=3] [--engine=interpreted] [output.json]
+#
+# Runs every benchmark_corpus program at every size and times its three
+# stages separately: grammar.scope.parseString, parser_converter.convert_scope
+# and Protocall.execute.  Each program and size runs in a fresh Python
+# process, so the peak memory reported for it is its own.  With an output
+# file, the results are also written there as JSON, together with the git
+# revision they were measured at, for comparing revisions.
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import time
+
+from protocall.interpreter import benchmark_corpus
+
+STAGES = ("parse", "convert", "execute")
+
+# Kilobytes on Linux.
+def peak_rss():
+  return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+def measure(fn, repeat):
+  best = None
+  for i in range(repeat):
+    start = time.time()
+    value = fn()
+    elapsed = time.time() - start
+    if best is None or elapsed < best:
+      best = elapsed
+  return best, value
+
+def run_benchmark(name, size, repeat, engine):
+  from protocall.interpreter import grammar, parser_converter, pratt_parser
+  from protocall.runtime.vm import Protocall
+  from protocall.runtime.value import unbox
+  generator, pyparsing = dict((n, (g, p)) for n, g, p in benchmark_corpus.programs)[name]
+  text, expected = generator(size)
+  # The parsers and the runtime recurse once or more per nesting level.
+  sys.setrecursionlimit(max(sys.getrecursionlimit(), 20 * size))
+  result = {
+    "program": name,
+    "size": size,
+    "bytes": len(text),
+    "baseline_rss_kb": peak_rss(),
+    "stages": {},
+  }
+  stages = result["stages"]
+  if pyparsing:
+    seconds, parsed = measure(lambda: grammar.scope.parseString(text)[0].scope, repeat)
+    stages["parse"] = {"seconds": seconds, "peak_rss_kb": peak_rss()}
+    seconds, scope = measure(lambda: parser_converter.convert_scope(parsed), repeat)
+    stages["convert"] = {"seconds": seconds, "peak_rss_kb": peak_rss()}
+  else:
+    scope = pratt_parser.parse_scope(text)
+  seconds, value = measure(lambda: Protocall(engine=engine).execute(scope.block), repeat)
+  stages["execute"] = {"seconds": seconds, "peak_rss_kb": peak_rss()}
+  result["peak_rss_kb"] = peak_rss()
+  result["correct"] = value is not None and unbox(value) == expected
+  return result
+
+def revision():
+  try:
+    with open(os.devnull, "w") as null:
+      return subprocess.check_output(["git", "rev-parse", "HEAD"], stderr=null,
+                                     cwd=os.path.dirname(os.path.abspath(__file__))).strip()
+  except (OSError, subprocess.CalledProcessError):
+    return None
+
+def run_suite(names, sizes, repeat, engine):
+  results = []
+  for name in names:
+    for size in sizes:
+      # No stdin, so that a failing statement cannot stop in pdb.
+      with open(os.devnull) as null:
+        output = subprocess.check_output([sys.executable, os.path.abspath(__file__), "--run",
+                                          name, str(size), str(repeat), engine], stdin=null)
+      result = json.loads(output.splitlines()[-1])
+      results.append(result)
+      print_result(result)
+  return results
+
+def print_header():
+  print "%-16s %6s %8s %10s %10s %10s %10s %s" % (
+    "program", "size", "bytes", "parse s", "convert s", "execute s", "peak KB", "")
+
+def print_result(result):
+  times = []
+  for stage in STAGES:
+    if stage in result["stages"]:
+      times.append("%10.4f" % result["stages"][stage]["seconds"])
+    else:
+      times.append("%10s" % "-")
+  print "%-16s %6d %8d %s %10d %s" % (
+    result["program"], result["size"], result["bytes"], " ".join(times),
+    result["peak_rss_kb"], "" if result["correct"] else "WRONG RESULT")
+  sys.stdout.flush()
+
+def main(argv):
+  if len(argv) == 6 and argv[1] == "--run":
+    print json.dumps(run_benchmark(argv[2], int(argv[3]), int(argv[4]), argv[5]))
+    return
+  names = [name for name, generator, pyparsing in benchmark_corpus.programs]
+  sizes = [10, 100]
+  repeat = 3
+  engine = "interpreted"
+  output = None
+  for arg in argv[1:]:
+    if arg.startswith("--sizes="):
+      sizes = [int(size) for size in arg[len("--sizes="):].split(",")]
+    elif arg.startswith("--programs="):
+      names = arg[len("--programs="):].split(",")
+    elif arg.startswith("--repeat="):
+      repeat = int(arg[len("--repeat="):])
+    elif arg.startswith("--engine="):
+      engine = arg[len("--engine="):]
+    elif not arg.startswith("--"):
+      output = arg
+    else:
+      print >>sys.stderr, "unknown flag", arg
+      sys.exit(2)
+  print_header()
+  results = run_suite(names, sizes, repeat, engine)
+  if output is not None:
+    with open(output, "w") as f:
+      json.dump({
+        "revision": revision(),
+        "time": time.time(),
+        "python": platform.python_version(),
+        "engine": engine,
+        "repeat": repeat,
+        "results": results,
+      }, f, indent=2, sort_keys=True)
+      f.write("\n")
+
+if __name__ == '__main__':
+  main(sys.argv)
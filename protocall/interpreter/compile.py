@@ -0,0 +1,35 @@
+# Copyright 2016 Google Inc. All Rights Reserved.
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Usage: compile.py source...
+#
+# Parses each SeeThruP0 source and writes its compiled cache next to it, for
+# interpreter.py to load instead of parsing.
+import sys
+
+from protocall.interpreter import compile_cache
+from protocall.interpreter.lexer import ParseError
+
+if len(sys.argv) == 1:
+  print "Usage: %s source..." % sys.argv[0]
+  sys.exit(1)
+
+status = 0
+for filename in sys.argv[1:]:
+  try:
+    print compile_cache.compile_file(filename)
+  except ParseError as e:
+    print "%s:%d:%d: %s" % (filename, e.lineno, e.col, e.msg)
+    status = 1
+sys.exit(status)
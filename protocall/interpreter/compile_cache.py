@@ -0,0 +1,96 @@
+# Copyright 2016 Google Inc. All Rights Reserved.
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import hashlib
+import os
+import tempfile
+
+from protocall.proto import compiled_pb2
+
+# Parsed programs are cached as a binary CompiledScope in source + ".pbc".
+# The cache is used only when its version and source hash match, so stale
+# or foreign caches are reparsed and rewritten rather than trusted.
+
+VERSION = 2
+SUFFIX = ".pbc"
+
+def cache_path(filename):
+  return filename + SUFFIX
+
+def source_hash(source):
+  return hashlib.sha256(source).digest()
+
+def parse(source):
+  # Imported here so that loading a valid cache never imports the parser.
+  from protocall.interpreter.pratt_parser import parse_scope
+  return parse_scope(source)
+
+def read_cache(path, digest):
+  try:
+    data = open(path, "rb").read()
+  except IOError:
+    return None
+  try:
+    compiled = compiled_pb2.CompiledScope()
+    compiled.MergeFromString(data)
+  except Exception:
+    return None
+  if compiled.version != VERSION or compiled.source_hash != digest:
+    return None
+  return compiled.scope
+
+def write_cache(path, digest, scope):
+  compiled = compiled_pb2.CompiledScope()
+  compiled.version = VERSION
+  compiled.source_hash = digest
+  compiled.scope.CopyFrom(scope)
+  # Written to a temporary file and renamed, so a concurrent reader never
+  # sees a partial cache.
+  fd, temp = tempfile.mkstemp(prefix=os.path.basename(path), dir=os.path.dirname(path) or ".")
+  try:
+    with os.fdopen(fd, "wb") as f:
+      # Partial, since the parser leaves Conditional.else_scope, a required
+      # field, unset when there is no else.
+      f.write(compiled.SerializePartialToString())
+    # mkstemp creates the file private to its owner; give it the usual
+    # permissions instead.
+    umask = os.umask(0)
+    os.umask(umask)
+    os.chmod(temp, 0666 & ~umask)
+    os.rename(temp, path)
+  except:
+    os.unlink(temp)
+    raise
+
+# Parses filename and writes its cache.  Returns the cache's path.
+def compile_file(filename):
+  source = open(filename, "rb").read()
+  path = cache_path(filename)
+  write_cache(path, source_hash(source), parse(source))
+  return path
+
+# Returns the Scope for filename, from its cache when that is valid.  On a
+# miss the source is parsed and the cache rewritten; failing to write it
+# (for example in a read-only directory) is not an error.
+def load_scope(filename):
+  source = open(filename, "rb").read()
+  digest = source_hash(source)
+  path = cache_path(filename)
+  scope = read_cache(path, digest)
+  if scope is None:
+    scope = parse(source)
+    try:
+      write_cache(path, digest, scope)
+    except (IOError, OSError):
+      pass
+  return scope
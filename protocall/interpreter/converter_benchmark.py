@@ -0,0 +1,71 @@
+# Copyright 2016 Google Inc. All Rights Reserved.
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Usage: converter_benchmark.py [statements [max_depth [repeat]]]
+#
+# Times parser_converter.convert_scope on generated ASTs with deeper and
+# deeper nesting: expressions nested depth operators deep inside if
+# statements nested depth scopes deep.  The ASTs are built directly, since
+# grammar.py cannot parse deeply nested programs in reasonable time.  When
+# conversion is linear in program size, the time per node stays flat as
+# depth grows.
+import sys
+import time
+
+from protocall.interpreter import parser_converter
+from protocall.interpreter.AST import Identifier, Field, Integer, ArithmeticOperator, ComparisonOperator, Expression, Assignment, IfScope, ElifScopes, Conditional, Statement, Block, Scope
+
+def generate_expression(depth):
+  e = Field([Identifier("x")])
+  for i in range(depth):
+    e = ArithmeticOperator(e, "+", Integer(i))
+  return e
+
+def generate_statement(depth):
+  s = Statement(Assignment(Field([Identifier("x")]), Expression(generate_expression(depth))))
+  for i in range(depth):
+    condition = Expression(ComparisonOperator(Field([Identifier("x")]), "<", Integer(i)))
+    s = Statement(Conditional([IfScope(condition, Scope(Block([s]))), ElifScopes([])]))
+  return s
+
+# Nodes: depth operators plus their operands for the expression, and a
+# comparison with its two operands per enclosing if.
+def count_nodes(statements, depth):
+  return statements * (2 * depth + 1 + 3 * depth + 1)
+
+def measure(block, repeat):
+  best = None
+  for i in range(repeat):
+    start = time.time()
+    parser_converter.convert_scope(block)
+    elapsed = time.time() - start
+    if best is None or elapsed < best:
+      best = elapsed
+  return best
+
+def main(argv):
+  statements = int(argv[1]) if len(argv) > 1 else 20
+  max_depth = int(argv[2]) if len(argv) > 2 else 160
+  repeat = int(argv[3]) if len(argv) > 3 else 3
+  print "%6s %8s %10s %12s" % ("depth", "nodes", "seconds", "us/node")
+  depth = 10
+  while depth <= max_depth:
+    block = Block([generate_statement(depth) for i in range(statements)])
+    elapsed = measure(block, repeat)
+    nodes = count_nodes(statements, depth)
+    print "%6d %8d %10.4f %12.2f" % (depth, nodes, elapsed, elapsed * 1e6 / nodes)
+    depth *= 2
+
+if __name__ == '__main__':
+  main(sys.argv)
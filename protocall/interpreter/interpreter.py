@@ -15,44 +15,77 @@ import sys
 
 from protocall.proto import protocall_pb2
 from google.protobuf import text_format
-from protocall.interpreter import parser_converter
 import readline
 from protocall.runtime import dump
-from pyparsing import ParseException
-from protocall.interpreter.grammar import block, scope
+from protocall.interpreter import compile_cache
 from protocall.runtime import vm
+from protocall.runtime import diagnostics
+from protocall.runtime.profiler import Profiler
+from protocall.runtime.sampler import Sampler
+from protocall.runtime.errors import ExecutionError
 
-pr = vm.Protocall()
+# interpreter.py [--profile] [--flamegraph=file] [--production] [filename]
+profiler = None
+sampler = None
+flamegraph = None
+production = False
+while len(sys.argv) > 1 and sys.argv[1].startswith("--"):
+  flag = sys.argv.pop(1)
+  if flag == "--profile":
+    profiler = Profiler()
+  elif flag.startswith("--flamegraph="):
+    flamegraph = flag[len("--flamegraph="):]
+    sampler = Sampler()
+  elif flag == "--production":
+    production = True
+  else:
+    print >>sys.stderr, "unknown flag", flag
+    sys.exit(2)
+
+pr = vm.Protocall(profiler=profiler, production=production)
 #pr.enable_tracing()
 
 if len(sys.argv) == 1:
+  from protocall.interpreter.pratt_parser import parse_block, ParseError
   while True:
     try:
       line = raw_input('> ')
       try:
-        print "line=", line
-        result = block.parseString(line)
-      except ParseException as e:
+        diagnostics.debug("input", line=line)
+        bl = parse_block(line)
+      except ParseError as e:
         print "Error parsing input at line", e.lineno, "column", e.col
         print e.line
         print ' ' * (e.col-2), '^'
         print e
       else:
-        bl = parser_converter.convert_block(result[0])
-        # try:
-        print pr.execute(bl)
-        # except Exception as e:
-        #   print e
+        try:
+          print pr.execute(bl)
+        except ExecutionError as e:
+          print text_format.MessageToString(e.report)
     except EOFError:
       break
 else:
   filename = sys.argv[1]
-  lines = open(filename).read()
-  result = scope.parseString(lines)
-  sc = parser_converter.convert_scope(result[0].scope)
+  # Parsed from source only when filename's compiled cache is missing or
+  # stale; see compile.py.
+  sc = compile_cache.load_scope(filename)
   # print "dump"
   # s= dump.dump(sc.block)
   # print s
   # end-to-end parse of file, print as program, parse that.
   # result2 = scope.parseString(s)
-  print pr.execute(sc.block)
+  if sampler is not None:
+    sampler.start()
+  try:
+    print pr.execute(sc.block)
+  except ExecutionError as e:
+    print >>sys.stderr, "Execution failed:"
+    print >>sys.stderr, text_format.MessageToString(e.report)
+    sys.exit(1)
+  if profiler is not None:
+    print >>sys.stderr, profiler.report()
+  if sampler is not None:
+    sampler.stop()
+    with open(flamegraph, "w") as f:
+      sampler.write(f)
@@ -13,6 +13,9 @@
 # limitations under the License.
 """Tests for protocall.runtime.runtime."""
 
+import os
+import shutil
+import tempfile
 import unittest
 
 from google.protobuf import text_format
@@ -23,7 +26,9 @@ from protocall.runtime import dump
 
 from protocall.runtime.truth import true, false, literal_true, literal_false
 from protocall.runtime.symbols import Symbols
-from protocall.interpreter import grammar, parser_converter
+from protocall.interpreter import grammar, parser_converter, compile_cache
+from protocall.interpreter import benchmark_corpus, pratt_parser
+from protocall.runtime.value import unbox
 
 def test_basic_code_test():
     s = """
@@ -317,6 +322,25 @@ def test_factorial_code_test():
     print "Result=", result
     return result
 
+def test_compile_cache(directory):
+    filename = os.path.join(directory, "program.p")
+    open(filename, "w").write("{ x = 5; if (x > 1) { x = 1; }; return x + 1; }")
+    first = compile_cache.load_scope(filename)
+    cached = compile_cache.read_cache(compile_cache.cache_path(filename),
+                                      compile_cache.source_hash(open(filename).read()))
+    # A changed source invalidates the cache.
+    open(filename, "w").write("{ x = 5; return x + 2; }")
+    second = compile_cache.load_scope(filename)
+    return first, cached, second
+
+def test_benchmark_corpus(size):
+    results = []
+    for name, generator, pyparsing in benchmark_corpus.programs:
+        text, expected = generator(size)
+        result = Protocall().execute(pratt_parser.parse_scope(text).block)
+        results.append((name, unbox(result), expected))
+    return results
+
 
 class InterpreterTest(unittest.TestCase):
   # def testBasicCodeTest(self):
@@ -341,6 +365,21 @@ class InterpreterTest(unittest.TestCase):
   #   assert test_proto_assignment_code_test().atom.literal.integer.value == 0
   # def testProtoOperatorCodeTest(self):
   #   assert test_proto_while_code_test().atom.literal.integer.value == 0
+  def testCompileCache(self):
+    directory = tempfile.mkdtemp()
+    try:
+      first, cached, second = test_compile_cache(directory)
+    finally:
+      shutil.rmtree(directory)
+    assert cached == first
+    assert Protocall().execute(first.block).atom.literal.integer.value == 2
+    assert Protocall().execute(second.block).atom.literal.integer.value == 7
+
+  def testBenchmarkCorpus(self):
+    for size in (1, 5):
+      for name, result, expected in test_benchmark_corpus(size):
+        assert result == expected, (name, size, result, expected)
+
   def testProtoOperatorCodeTest(self):
     assert test_factorial_code_test().atom.literal.integer.value == 479001600
 
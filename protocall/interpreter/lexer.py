@@ -0,0 +1,79 @@
+# Copyright 2016 Google Inc. All Rights Reserved.
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import re
+
+# Token kinds.  Keywords and punctuation use their own text as their kind.
+INTEGER = "integer"
+STRING = "string"
+IDENTIFIER = "identifier"
+END = "end"
+
+keywords = frozenset(["if", "elif", "else", "return", "define", "while", "true", "false"])
+
+# Same lexical rules as grammar.py: C and Python style comments, double
+# quoted strings with backslash escapes, and identifiers of letters, digits
+# and underscores that do not start with a digit.
+token_re = re.compile(r"""
+  (?P<space>\s+|/\*(?:.|\n)*?\*/|\#[^\n]*) |
+  (?P<integer>\d+) |
+  (?P<string>"(?:[^"\n\r\\]|\\.)*") |
+  (?P<identifier>[A-Za-z_][A-Za-z0-9_]*) |
+  (?P<punctuation>==|[{}()\[\]<>=,;.:+\-*/])
+""", re.VERBOSE)
+
+class ParseError(Exception):
+  # Carries the same position attributes as pyparsing's ParseException.
+  def __init__(self, message, text, loc):
+    Exception.__init__(self, message)
+    self.msg = message
+    self.loc = loc
+    self.lineno = text.count("\n", 0, loc) + 1
+    start = text.rfind("\n", 0, loc) + 1
+    self.col = loc - start + 1
+    end = text.find("\n", loc)
+    if end == -1:
+      end = len(text)
+    self.line = text[start:end]
+
+  def __str__(self):
+    return "%s (at char %d), (line:%d, col:%d)" % (self.msg, self.loc, self.lineno, self.col)
+
+# Returns parallel lists of token kinds, values and offsets, ending with an
+# END token.
+def tokenize(text):
+  kinds = []
+  values = []
+  offsets = []
+  pos = 0
+  n = len(text)
+  match = token_re.match
+  while pos < n:
+    m = match(text, pos)
+    if m is None:
+      raise ParseError("Unexpected character %r" % text[pos], text, pos)
+    kind = m.lastgroup
+    value = m.group(kind)
+    if kind != "space":
+      if kind == "punctuation":
+        kind = value
+      elif kind == "identifier" and value in keywords:
+        kind = value
+      kinds.append(kind)
+      values.append(value)
+      offsets.append(pos)
+    pos = m.end()
+  kinds.append(END)
+  values.append("")
+  offsets.append(n)
+  return kinds, values, offsets
@@ -0,0 +1,100 @@
+# Copyright 2016 Google Inc. All Rights Reserved.
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Usage: parser_benchmark.py [statements [operators [repeat]]]
+#
+# Compares the parse throughput of pratt_parser with grammar.py plus
+# parser_converter on a generated program, after checking that both produce
+# the same Scope.
+import random
+import sys
+import time
+
+from protocall.interpreter import grammar, parser_converter, pratt_parser
+
+# Only forms grammar.py can parse: it rejects chains of operators on one
+# precedence level, and its time grows exponentially with nested
+# parentheses and calls, so expressions use each arithmetic level at most
+# once and hold no parentheses or calls.
+def generate_operand(rng):
+  return rng.choice(["x", "y", "i", str(rng.randint(0, 1000)), "p.id"])
+
+def generate_expression(rng, operators):
+  levels = [rng.choice("+-"), "*", "/"][:operators]
+  e = generate_operand(rng)
+  for op in levels:
+    e = "%s %s %s" % (e, op, generate_operand(rng))
+  return e
+
+def generate_statement(rng, operators, indent):
+  r = rng.random()
+  if r < 0.5:
+    return "%sx = %s;" % (indent, generate_expression(rng, operators))
+  elif r < 0.65:
+    return "%sprint_(x=%s, s=\"%d\");" % (indent, generate_expression(rng, operators), rng.randint(0, 9))
+  elif r < 0.8:
+    return "%sif (%s < %s) {\n%s\n%s} elif (y == 1) {\n%s\n%s} else {\n%s\n%s};" % (
+      indent, generate_expression(rng, operators), generate_expression(rng, operators),
+      generate_statement(rng, operators, indent + "  "), indent,
+      generate_statement(rng, operators, indent + "  "), indent,
+      generate_statement(rng, operators, indent + "  "), indent)
+  elif r < 0.9:
+    return "%swhile (i > %s) {\n%s\n%s  i = i - 1;\n%s};" % (
+      indent, generate_expression(rng, operators),
+      generate_statement(rng, operators, indent + "  "), indent, indent)
+  return "%sp = Person<id: %d name: \"n\">;" % (indent, rng.randint(0, 1000))
+
+def generate_program(statements, operators, seed=0):
+  rng = random.Random(seed)
+  lines = ["{"]
+  lines.append("  define f {\n    return %s;\n  };" % generate_expression(rng, operators))
+  for i in range(statements):
+    lines.append(generate_statement(rng, operators, "  "))
+  lines.append("  return f(x=x);")
+  lines.append("}")
+  return "\n".join(lines)
+
+def parse_pyparsing(text):
+  return parser_converter.convert_scope(grammar.scope.parseString(text)[0].scope)
+
+def parse_pratt(text):
+  return pratt_parser.parse_scope(text)
+
+def measure(parse, text, repeat):
+  best = None
+  for i in range(repeat):
+    start = time.time()
+    parse(text)
+    elapsed = time.time() - start
+    if best is None or elapsed < best:
+      best = elapsed
+  return best
+
+def main(argv):
+  statements = int(argv[1]) if len(argv) > 1 else 50
+  operators = int(argv[2]) if len(argv) > 2 else 3
+  repeat = int(argv[3]) if len(argv) > 3 else 1
+  text = generate_program(statements, operators)
+  if parse_pyparsing(text) != parse_pratt(text):
+    raise RuntimeError("parsers disagree")
+  print "program: %d statements, %d operators per expression, %d bytes" % (statements, operators, len(text))
+  results = []
+  for name, parse in (("pyparsing", parse_pyparsing), ("pratt", parse_pratt)):
+    elapsed = measure(parse, text, repeat)
+    results.append(elapsed)
+    print "%-10s %8.4fs %10.0f bytes/s" % (name, elapsed, len(text) / elapsed)
+  print "speedup    %8.1fx" % (results[0] / results[1])
+
+if __name__ == '__main__':
+  main(sys.argv)
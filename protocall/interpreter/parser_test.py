@@ -16,6 +16,7 @@ import unittest
 
 from pyparsing import ParseResults
 from protocall.interpreter import parser_converter
+from protocall.interpreter import pratt_parser
 
 from protocall.interpreter.grammar import expression, statement, assignment, call, return_expression, block, scope, define_function_scope, while_scope, if_scope, elif_scope, elif_scopes, else_scope, conditional
 
@@ -86,6 +87,47 @@ class ParserTest(unittest.TestCase):
     result = define_function_scope.parseString("define f { print_(x=x); }")
     assert str(result[0]) == "define f { print_(x = x); }"
 
+  def testPrattExpression(self):
+    for s in ["(4 / x) - 2 > 5", "4 / y - 2 > 5", "a / b * c", "a + b * c", "(a < b) == c",
+              "f(x=1, y=z)", 'p.person<id: -1 name: "x">', 'x<>', 'x < y', '"a\\"b"', "true",
+              "{1, 2, 3}", "{1, x}"]:
+      result = expression.parseString(s)
+      assert pratt_parser.parse_expression(s) == parser_converter.convert_expression(result[0].expression)
+
+  def testPrattScope(self):
+    s = """{
+      # Comments are skipped.
+      define f {
+        if (x == 0) { return 0; } elif (x == 1) { return 1; }
+        else { a = f(x=y); b = f(x=z); return a+b; };
+      };
+      /* while loop */
+      while (x > 0) { print_(x=x, s="x"); x = x - 1; };
+      p.id = 5;
+      return f(x=5);
+    }"""
+    result = scope.parseString(s)
+    assert pratt_parser.parse_scope(s) == parser_converter.convert_scope(result[0].scope)
+
+  def testPrattChains(self):
+    # Operators of one level associate to the left, and +,- bind tightest.
+    e = pratt_parser.parse_expression("a - b + c * d")
+    assert e.arithmetic_operator.operator == pratt_parser.MULTIPLY
+    assert e.arithmetic_operator.left.arithmetic_operator.operator == pratt_parser.PLUS
+    assert e.arithmetic_operator.left.arithmetic_operator.left.arithmetic_operator.operator == pratt_parser.MINUS
+    e = pratt_parser.parse_expression("{x[1], 2}")
+    assert e.atom.literal.array.element[0].atom.array_ref.index.value == 1
+    e = pratt_parser.parse_expression("{1, 2, 3}")
+    assert list(e.atom.literal.integer_array.value) == [1, 2, 3]
+
+  def testPrattError(self):
+    try:
+      pratt_parser.parse_scope("{\n  x = 1;\n  y = ;\n}")
+    except pratt_parser.ParseError as e:
+      assert (e.lineno, e.col, e.line) == (3, 7, "  y = ;")
+    else:
+      self.fail()
+
 
 if __name__ == '__main__':
   unittest.main()
@@ -0,0 +1,330 @@
+# Copyright 2016 Google Inc. All Rights Reserved.
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+from protocall.proto import protocall_pb2
+from lexer import tokenize, ParseError, INTEGER, STRING, IDENTIFIER, END
+
+# Recursive descent parser for SeeThruP0 that produces the same protocall
+# protos as parsing with grammar.py and converting with parser_converter.
+# Expressions are parsed by precedence climbing into small tuples first,
+# then written into their Expression message top down, so operands are
+# never copied between messages.
+#
+# Precedence follows grammar.py's infixNotation levels, tightest first:
+# + and -, then *, then /, then the comparisons < > ==.  All are left
+# associative.  Unlike grammar.py, chains of operators on one level
+# (a + b - c) are accepted and parentheses may hold any expression.
+
+PLUS = protocall_pb2.ArithmeticOperator.Op.Value("PLUS")
+MINUS = protocall_pb2.ArithmeticOperator.Op.Value("MINUS")
+MULTIPLY = protocall_pb2.ArithmeticOperator.Op.Value("MULTIPLY")
+DIVIDE = protocall_pb2.ArithmeticOperator.Op.Value("DIVIDE")
+EQUALS = protocall_pb2.ComparisonOperator.Op.Value("EQUALS")
+LESS_THAN = protocall_pb2.ComparisonOperator.Op.Value("LESS_THAN")
+GREATER_THAN = protocall_pb2.ComparisonOperator.Op.Value("GREATER_THAN")
+
+# token: (precedence, node kind, operator)
+binary_operators = {
+  "+": (4, "arithmetic", PLUS),
+  "-": (4, "arithmetic", MINUS),
+  "*": (3, "arithmetic", MULTIPLY),
+  "/": (2, "arithmetic", DIVIDE),
+  "<": (1, "comparison", LESS_THAN),
+  ">": (1, "comparison", GREATER_THAN),
+  "==": (1, "comparison", EQUALS),
+}
+
+class Parser:
+  def __init__(self, text):
+    self.text = text
+    self.kinds, self.values, self.offsets = tokenize(text)
+    self.pos = 0
+
+  def error(self, expected):
+    pos = self.pos
+    found = self.values[pos] or "end of text"
+    raise ParseError("Expected %s, found %r" % (expected, found), self.text, self.offsets[pos])
+
+  def expect(self, kind):
+    if self.kinds[self.pos] != kind:
+      self.error(repr(kind))
+    value = self.values[self.pos]
+    self.pos += 1
+    return value
+
+  def at_end(self):
+    if self.kinds[self.pos] != END:
+      self.error("end of text")
+
+  # Statements
+
+  def parse_scope(self, scope):
+    self.expect("{")
+    self.parse_block(scope.block, "}")
+    self.expect("}")
+
+  def parse_block(self, block, end):
+    while True:
+      self.parse_statement(block.statement.add())
+      if self.kinds[self.pos] == end:
+        return
+
+  def parse_statement(self, s):
+    kind = self.kinds[self.pos]
+    if kind == IDENTIFIER:
+      components = self.parse_field()
+      kind = self.kinds[self.pos]
+      if kind == "[":
+        index = self.parse_index()
+        self.expect("=")
+        a = s.array_assignment
+        fill_field(a.array_ref.field, components)
+        a.array_ref.index.value = index
+        self.parse_expression(a.expression)
+      elif kind == "=":
+        self.pos += 1
+        fill_field(s.assignment.field, components)
+        self.parse_expression(s.assignment.expression)
+      elif kind == "(":
+        fill_call(s.call, components, self.parse_arguments())
+      else:
+        self.error("'=', '[' or '('")
+    elif kind == "if":
+      self.pos += 1
+      c = s.conditional
+      self.parse_expression_scope(c.if_scope)
+      while self.kinds[self.pos] == "elif":
+        self.pos += 1
+        self.parse_expression_scope(c.elif_scope.add())
+      if self.kinds[self.pos] == "else":
+        self.pos += 1
+        self.parse_scope(c.else_scope)
+    elif kind == "return":
+      self.pos += 1
+      self.parse_expression(s.return_.expression)
+    elif kind == "while":
+      self.pos += 1
+      self.parse_expression_scope(s.while_.expression_scope)
+    elif kind == "define":
+      self.pos += 1
+      fill_field(s.define.field, self.parse_field())
+      self.parse_scope(s.define.scope)
+    else:
+      self.error("statement")
+    self.expect(";")
+
+  def parse_expression_scope(self, expression_scope):
+    self.expect("(")
+    self.parse_expression(expression_scope.expression)
+    self.expect(")")
+    self.parse_scope(expression_scope.scope)
+
+  # Expressions
+
+  def parse_expression(self, e):
+    fill_expression(e, self.expression())
+
+  def expression(self):
+    if self.kinds[self.pos] == "{":
+      self.pos += 1
+      elements = [self.expression()]
+      while self.kinds[self.pos] == ",":
+        self.pos += 1
+        elements.append(self.expression())
+      self.expect("}")
+      return ("array", elements)
+    return self.binary(0)
+
+  def binary(self, min_precedence):
+    left = self.operand()
+    kinds = self.kinds
+    while True:
+      operator = binary_operators.get(kinds[self.pos])
+      if operator is None or operator[0] < min_precedence:
+        return left
+      self.pos += 1
+      precedence, kind, op = operator
+      right = self.binary(precedence + 1)
+      left = (kind, op, left, right)
+
+  def operand(self):
+    kind = self.kinds[self.pos]
+    value = self.values[self.pos]
+    if kind == INTEGER:
+      self.pos += 1
+      return ("integer", int(value))
+    elif kind == STRING:
+      self.pos += 1
+      return ("string", value[1:-1])
+    elif kind == "true" or kind == "false":
+      self.pos += 1
+      return ("boolean", kind == "true")
+    elif kind == "(":
+      self.pos += 1
+      e = self.binary(0)
+      self.expect(")")
+      return e
+    elif kind == IDENTIFIER:
+      components = self.parse_field()
+      kind = self.kinds[self.pos]
+      if kind == "(":
+        return ("call", components, self.parse_arguments())
+      elif kind == "[":
+        return ("array_ref", components, self.parse_index())
+      elif kind == "<":
+        proto = self.parse_proto()
+        if proto is not None:
+          return ("proto", components, proto)
+      return ("field", components)
+    self.error("expression")
+
+  def parse_field(self):
+    components = [self.expect(IDENTIFIER)]
+    while self.kinds[self.pos] == ".":
+      self.pos += 1
+      components.append(self.expect(IDENTIFIER))
+    return components
+
+  def parse_index(self):
+    self.expect("[")
+    index = int(self.expect(INTEGER))
+    self.expect("]")
+    return index
+
+  def parse_arguments(self):
+    self.expect("(")
+    arguments = []
+    if self.kinds[self.pos] != ")":
+      while True:
+        name = self.expect(IDENTIFIER)
+        self.expect("=")
+        arguments.append((name, self.expression()))
+        if self.kinds[self.pos] != ",":
+          break
+        self.pos += 1
+    self.expect(")")
+    return arguments
+
+  # A proto literal is field<text>.  As in grammar.py, "<" after a field
+  # is tried as a proto literal first and taken as less-than if the text
+  # does not parse.
+  def parse_proto(self):
+    start = self.pos
+    self.pos += 1
+    items = self.proto_items()
+    if items is None or self.kinds[self.pos] != ">":
+      self.pos = start
+      return None
+    self.pos += 1
+    return " ".join(items)
+
+  def proto_items(self):
+    items = []
+    kinds, values = self.kinds, self.values
+    while kinds[self.pos] == IDENTIFIER:
+      name = values[self.pos]
+      kind = kinds[self.pos + 1]
+      if kind == ":":
+        self.pos += 2
+        sign = ""
+        if kinds[self.pos] in ("+", "-"):
+          sign = values[self.pos]
+          self.pos += 1
+        if kinds[self.pos] == INTEGER:
+          items.append("%s: %d" % (name, int(sign + values[self.pos])))
+        elif kinds[self.pos] == STRING and not sign:
+          items.append("%s: %s" % (name, values[self.pos]))
+        else:
+          return None
+        self.pos += 1
+      elif kind == "{":
+        self.pos += 2
+        nested = self.proto_items()
+        if nested is None or kinds[self.pos] != "}":
+          return None
+        self.pos += 1
+        items.append("%s { %s }" % (name, " ".join(nested)))
+      else:
+        return None
+    return items
+
+def fill_field(f, components):
+  for name in components:
+    f.component.add().name = name
+
+def fill_call(c, components, arguments):
+  fill_field(c.field, components)
+  for name, node in arguments:
+    a = c.argument.add()
+    a.identifier.name = name
+    fill_expression(a.expression, node)
+
+def fill_expression(e, node):
+  kind = node[0]
+  if kind == "arithmetic" or kind == "comparison":
+    if kind == "arithmetic":
+      operator = e.arithmetic_operator
+    else:
+      operator = e.comparison_operator
+    operator.operator = node[1]
+    fill_expression(operator.left, node[2])
+    fill_expression(operator.right, node[3])
+  elif kind == "field":
+    fill_field(e.atom.field, node[1])
+  elif kind == "integer":
+    e.atom.literal.integer.value = node[1]
+  elif kind == "call":
+    fill_call(e.call, node[1], node[2])
+  elif kind == "string":
+    e.atom.literal.string.value = node[1]
+  elif kind == "boolean":
+    e.atom.literal.boolean.value = node[1]
+  elif kind == "array_ref":
+    fill_field(e.atom.array_ref.field, node[1])
+    e.atom.array_ref.index.value = node[2]
+  elif kind == "proto":
+    fill_field(e.atom.literal.proto.field, node[1])
+    e.atom.literal.proto.value = node[2]
+  elif kind == "array" and all(element[0] == "integer" for element in node[1]):
+    # Integer-only arrays are packed, like parser_converter's.
+    e.atom.literal.integer_array.value.extend(element[1] for element in node[1])
+  elif kind == "array":
+    array = e.atom.literal.array
+    for element in node[1]:
+      fill_expression(array.element.add(), element)
+  else:
+    raise RuntimeError(kind)
+
+# Parses "{ statement; ... }", like grammar.scope and
+# parser_converter.convert_scope.
+def parse_scope(text):
+  p = Parser(text)
+  s = protocall_pb2.Scope()
+  p.parse_scope(s)
+  p.at_end()
+  return s
+
+# Parses "statement; ...", like grammar.block and
+# parser_converter.convert_block.
+def parse_block(text):
+  p = Parser(text)
+  b = protocall_pb2.Block()
+  p.parse_block(b, END)
+  return b
+
+def parse_expression(text):
+  p = Parser(text)
+  e = protocall_pb2.Expression()
+  p.parse_expression(e)
+  p.at_end()
+  return e
@@ -0,0 +1,43 @@
+# Copyright 2016 Google Inc. All Rights Reserved.
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Usage: transpile.py [--serialized] input [output]
+#
+# Writes a Python module for a SeeThruP0 program, or with --serialized for a
+# file holding a serialized protocall Block.  The module's run() executes the
+# program; running the module prints its result.
+import sys
+
+from protocall.proto import protocall_pb2
+from protocall.interpreter.pratt_parser import parse_scope
+from protocall.runtime import transpiler
+
+args = sys.argv[1:]
+serialized = "--serialized" in args
+if serialized:
+  args.remove("--serialized")
+if not args:
+  print "Usage: %s [--serialized] input [output]" % sys.argv[0]
+  sys.exit(1)
+
+if serialized:
+  block = protocall_pb2.Block.FromString(open(args[0], "rb").read())
+else:
+  block = parse_scope(open(args[0]).read()).block
+
+source = transpiler.transpile(block)
+if len(args) > 1:
+  open(args[1], "w").write(source)
+else:
+  sys.stdout.write(source)
@@ -12,7 +12,7 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 from protocall.proto import protocall_pb2
-from value import value
+from value import value, symbol_value
 
 def print_(arguments, symbols):
     for arg in arguments:
@@ -27,13 +27,10 @@ def double(arguments, symbols):
     name = arg[0]
     atom = arg[1]
     
-    a = protocall_pb2.Atom()
-    a.literal.integer.value = atom.literal.integer.value * 2
-    return a
+    return value(atom) * 2
 
 def append(arguments, symbols):
   list_ = arguments[0]
   item = arguments[1]
-  e = list_[1].literal.array.element.add()
-  e.atom.CopyFrom(item[1])
-  return e
+  list_[1].append(symbol_value(item[1]))
+  return item[1]
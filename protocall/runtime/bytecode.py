@@ -0,0 +1,303 @@
+# Copyright 2016 Google Inc. All Rights Reserved.
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+from protocall.proto import protocall_pb2
+from protocall.proto import bytecode_pb2
+import subrs
+from value import box, unbox
+from google.protobuf.message import Message
+
+LOAD_CONST = bytecode_pb2.Code.LOAD_CONST
+LOAD_NAME = bytecode_pb2.Code.LOAD_NAME
+LOAD_FIELD = bytecode_pb2.Code.LOAD_FIELD
+LOAD_ARRAY_REF = bytecode_pb2.Code.LOAD_ARRAY_REF
+STORE_NAME = bytecode_pb2.Code.STORE_NAME
+STORE_FIELD = bytecode_pb2.Code.STORE_FIELD
+STORE_ARRAY_REF = bytecode_pb2.Code.STORE_ARRAY_REF
+BUILD_ARRAY = bytecode_pb2.Code.BUILD_ARRAY
+ARITHMETIC = bytecode_pb2.Code.ARITHMETIC
+COMPARE = bytecode_pb2.Code.COMPARE
+CALL = bytecode_pb2.Code.CALL
+CALL_SUBR = bytecode_pb2.Code.CALL_SUBR
+JUMP = bytecode_pb2.Code.JUMP
+JUMP_IF_FALSE = bytecode_pb2.Code.JUMP_IF_FALSE
+SET_RESULT = bytecode_pb2.Code.SET_RESULT
+SET_RETURN = bytecode_pb2.Code.SET_RETURN
+CLEAR_RESULT = bytecode_pb2.Code.CLEAR_RESULT
+DEFINE = bytecode_pb2.Code.DEFINE
+RETURN = bytecode_pb2.Code.RETURN
+LOAD_PROTO = bytecode_pb2.Code.LOAD_PROTO
+LOAD_ARRAY = bytecode_pb2.Code.LOAD_ARRAY
+
+default_subrs = frozenset(name for name in dir(subrs) if not name.startswith("_"))
+
+class Code:
+  def __init__(self, name):
+    self.name = name
+    self.ops = []
+    self.args = []
+    self.constants = []
+    self.names = []
+    self.fields = []
+    self.array_refs = []
+    self.call_sites = []
+    self.subr_calls = []
+    # (start, end, Statement) for every statement.  The Statement is None
+    # for code decoded from its serialized form.
+    self.statements = []
+
+  def emit(self, op, arg=0):
+    self.ops.append(op)
+    self.args.append(arg)
+    return len(self.ops) - 1
+
+  def patch(self, index, arg):
+    self.args[index] = arg
+
+  def here(self):
+    return len(self.ops)
+
+  def statement_at(self, pc):
+    # Innermost statement containing pc.
+    containing = [s for s in self.statements if s[0] <= pc < s[1]]
+    if not containing:
+      return None
+    return min(containing, key=lambda s: s[1] - s[0])
+
+  def to_proto(self):
+    c = bytecode_pb2.Code()
+    c.name = self.name
+    for op, arg in zip(self.ops, self.args):
+      c.instruction.extend((op, arg))
+    for constant in self.constants:
+      c.constant.add().CopyFrom(box(constant).literal)
+    c.name_table.extend(self.names)
+    for field in self.fields:
+      c.field.add().CopyFrom(field)
+    for field, index in self.array_refs:
+      a = c.array_ref.add()
+      a.field.CopyFrom(field)
+      a.index.value = index
+    for name, arguments in self.call_sites:
+      call_site = c.call_site.add()
+      call_site.name = name
+      call_site.argument.extend(arguments)
+    for call in self.subr_calls:
+      c.subr_call.add().CopyFrom(call)
+    statements = sorted(self.statements, key=lambda s: s[0])
+    for start, end, statement in statements:
+      c.statement.extend((start, end))
+    return c
+
+  @staticmethod
+  def from_proto(c):
+    code = Code(c.name)
+    code.ops = list(c.instruction[0::2])
+    code.args = list(c.instruction[1::2])
+    code.constants = [unbox(literal) for literal in c.constant]
+    code.names = list(c.name_table)
+    code.fields = list(c.field)
+    code.array_refs = [(array_ref.field, array_ref.index.value) for array_ref in c.array_ref]
+    code.call_sites = [(call_site.name, list(call_site.argument)) for call_site in c.call_site]
+    code.subr_calls = list(c.subr_call)
+    code.statements = [(c.statement[i], c.statement[i+1], None) for i in range(0, len(c.statement), 2)]
+    return code
+
+class Program:
+  def __init__(self, code=None):
+    if code is None:
+      code = []
+    self.code = code
+
+  def to_proto(self):
+    p = bytecode_pb2.Program()
+    for code in self.code:
+      p.code.add().CopyFrom(code.to_proto())
+    return p
+
+  def SerializeToString(self):
+    return self.to_proto().SerializeToString()
+
+  @staticmethod
+  def from_proto(p):
+    return Program([Code.from_proto(c) for c in p.code])
+
+  @staticmethod
+  def FromString(s):
+    return Program.from_proto(bytecode_pb2.Program.FromString(s))
+
+class Compiler:
+  def __init__(self, subr_names=default_subrs):
+    self.subr_names = subr_names
+    self.program = Program()
+
+  def compile_program(self, block):
+    self.compile_code("", block)
+    return self.program
+
+  def compile_code(self, name, block):
+    code = Code(name)
+    index = len(self.program.code)
+    self.program.code.append(code)
+    self.compile_block(code, block)
+    code.emit(RETURN)
+    return index
+
+  def compile_block(self, code, block):
+    for statement in block.statement:
+      start = code.here()
+      self.compile_statement(code, statement)
+      code.statements.append((start, code.here(), statement))
+
+  def compile_scope_block(self, code, block):
+    # Every executed conditional body produces its own result, as
+    # Protocall.execute does for a nested block.
+    code.emit(CLEAR_RESULT)
+    self.compile_block(code, block)
+
+  def compile_statement(self, code, statement):
+    if statement.HasField("assignment"):
+      assignment = statement.assignment
+      self.compile_expression(code, assignment.expression)
+      field = assignment.field
+      if len(field.component) == 1:
+        code.emit(STORE_NAME, self.name_index(code, field.component[0].name))
+      else:
+        code.emit(STORE_FIELD, self.field_index(code, field))
+      code.emit(SET_RESULT)
+    elif statement.HasField("array_assignment"):
+      array_assignment = statement.array_assignment
+      self.compile_expression(code, array_assignment.expression)
+      code.emit(STORE_ARRAY_REF, self.array_ref_index(code, array_assignment.array_ref))
+      code.emit(SET_RESULT)
+    elif statement.HasField("call"):
+      self.compile_call(code, statement.call)
+      code.emit(SET_RESULT)
+    elif statement.HasField("conditional"):
+      self.compile_conditional(code, statement.conditional)
+    elif statement.HasField("return_"):
+      self.compile_expression(code, statement.return_.expression)
+      code.emit(SET_RETURN)
+    elif statement.HasField("while_"):
+      expression_scope = statement.while_.expression_scope
+      top = code.here()
+      self.compile_expression(code, expression_scope.expression)
+      exit_jump = code.emit(JUMP_IF_FALSE)
+      self.compile_block(code, expression_scope.scope.block)
+      code.emit(JUMP, top)
+      code.patch(exit_jump, code.here())
+      code.emit(CLEAR_RESULT)
+    elif statement.HasField("define"):
+      ## Only support definition of top-level fields
+      define = statement.define
+      index = self.compile_code(define.field.component[0].name, define.scope.block)
+      code.emit(DEFINE, index)
+      code.emit(CLEAR_RESULT)
+    else:
+      raise RuntimeError(str(statement))
+
+  def compile_conditional(self, code, conditional):
+    end_jumps = []
+    scopes = [conditional.if_scope] + list(conditional.elif_scope)
+    for expression_scope in scopes:
+      self.compile_expression(code, expression_scope.expression)
+      next_jump = code.emit(JUMP_IF_FALSE)
+      self.compile_scope_block(code, expression_scope.scope.block)
+      end_jumps.append(code.emit(JUMP))
+      code.patch(next_jump, code.here())
+    if len(conditional.else_scope.block.statement):
+      self.compile_scope_block(code, conditional.else_scope.block)
+    for jump in end_jumps:
+      code.patch(jump, code.here())
+
+  def compile_call(self, code, call):
+    # Service.Method calls have a name with a dot in it.
+    name = ".".join([component.name for component in call.field.component])
+    if name in self.subr_names:
+      code.subr_calls.append(call)
+      code.emit(CALL_SUBR, len(code.subr_calls) - 1)
+      return
+    for arg in call.argument:
+      self.compile_expression(code, arg.expression)
+    code.call_sites.append((name, [arg.identifier.name for arg in call.argument]))
+    code.emit(CALL, len(code.call_sites) - 1)
+
+  def compile_expression(self, code, expression):
+    if expression.HasField("atom"):
+      atom = expression.atom
+      if atom.literal.HasField("array"):
+        elements = atom.literal.array.element
+        for element in elements:
+          self.compile_expression(code, element)
+        code.emit(BUILD_ARRAY, len(elements))
+      elif atom.HasField("literal"):
+        v = unbox(atom)
+        code.constants.append(v)
+        if isinstance(v, Message):
+          code.emit(LOAD_PROTO, len(code.constants) - 1)
+        elif isinstance(v, list):
+          code.emit(LOAD_ARRAY, len(code.constants) - 1)
+        else:
+          code.emit(LOAD_CONST, len(code.constants) - 1)
+      elif atom.HasField("expression"):
+        self.compile_expression(code, atom.expression)
+      elif atom.HasField("field"):
+        field = atom.field
+        if len(field.component) == 1:
+          code.emit(LOAD_NAME, self.name_index(code, field.component[0].name))
+        else:
+          code.emit(LOAD_FIELD, self.field_index(code, field))
+      elif atom.HasField("array_ref"):
+        code.emit(LOAD_ARRAY_REF, self.array_ref_index(code, atom.array_ref))
+      else:
+        raise RuntimeError(str(atom))
+    elif expression.HasField("call"):
+      self.compile_call(code, expression.call)
+    elif expression.HasField("arithmetic_operator"):
+      operator = expression.arithmetic_operator
+      self.compile_expression(code, operator.left)
+      self.compile_expression(code, operator.right)
+      code.emit(ARITHMETIC, operator.operator)
+    elif expression.HasField("comparison_operator"):
+      operator = expression.comparison_operator
+      self.compile_expression(code, operator.left)
+      self.compile_expression(code, operator.right)
+      code.emit(COMPARE, operator.operator)
+    else:
+      raise RuntimeError(str(expression))
+
+  def name_index(self, code, name):
+    if name not in code.names:
+      code.names.append(name)
+    return code.names.index(name)
+
+  def field_index(self, code, field):
+    code.fields.append(field)
+    return len(code.fields) - 1
+
+  def array_ref_index(self, code, array_ref):
+    code.array_refs.append((array_ref.field, array_ref.index.value))
+    return len(code.array_refs) - 1
+
+def compile_program(block, subr_names=default_subrs):
+  return Compiler(subr_names).compile_program(block)
+
+opcode_names = dict((number, name) for name, number in bytecode_pb2.Code.Opcode.items())
+
+def disassemble(program):
+  lines = []
+  for index, code in enumerate(program.code):
+    lines.append("code %d %s:" % (index, code.name or "<program>"))
+    for pc, (op, arg) in enumerate(zip(code.ops, code.args)):
+      lines.append("  %4d %-16s %d" % (pc, opcode_names[op], arg))
+  return "\n".join(lines)
@@ -0,0 +1,198 @@
+# Copyright 2016 Google Inc. All Rights Reserved.
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import collections
+import sys
+import threading
+import time
+from google.protobuf.message import Message
+from tasks import Task
+from value import symbol_value, copy_message
+
+# Memoizes calls to services and pure builtins.  Pass a CallCache to
+# Protocall(cache=...) with the names of the calls it may answer:
+#
+#   cache = CallCache(["People.Lookup", "sqrt"], max_bytes=1 << 20, ttl=60)
+#
+# Every engine's builtin and service calls to those names go through it.
+# Calls are keyed by name and a canonical serialization of their evaluated
+# arguments, so the same request message built twice hits the same entry.
+# Calls with arguments that cannot be serialized, such as tasks, are made
+# without the cache.
+#
+# Entries are evicted least recently used first when there are more than
+# max_entries of them or their sizes add up to more than max_bytes, and
+# expire ttl seconds after they were stored.  Sizes are approximate: the
+# key plus the serialized size of messages and the length of strings.
+#
+# Concurrent calls with the same key, for example from spawned tasks, make
+# a single call: the first one runs it and the others wait for its result,
+# or its error, which is not cached.  Results are copied in and out of the
+# cache, so callers can change the messages they get.
+
+class CallCache:
+  def __init__(self, targets, max_bytes=1 << 20, max_entries=None, ttl=None, clock=time.time):
+    self.targets = set(targets)
+    self.max_bytes = max_bytes
+    self.max_entries = max_entries
+    self.ttl = ttl
+    self.clock = clock
+    # key: (result, size, expiry time or None), least recently used first.
+    self.entries = collections.OrderedDict()
+    self.bytes = 0
+    # key: Task of the call being made for it.
+    self.in_flight = {}
+    self.lock = threading.Lock()
+    self.hits = 0
+    self.misses = 0
+    # Calls that waited for the same call in flight instead of making it.
+    self.shared = 0
+    self.evictions = 0
+    self.expirations = 0
+    self.uncacheable = 0
+
+  def __contains__(self, name):
+    return name in self.targets
+
+  # The result of fn(name, args), from the cache if it can be.
+  def call(self, name, args, fn):
+    try:
+      key = call_key(name, args)
+    except TypeError:
+      with self.lock:
+        self.uncacheable += 1
+      return fn(name, args)
+    leader = False
+    with self.lock:
+      entry = self.entries.pop(key, None)
+      if entry is not None:
+        result, size, expires = entry
+        if expires is None or self.clock() < expires:
+          self.entries[key] = entry
+          self.hits += 1
+          return copy_value(result)
+        self.bytes -= size
+        self.expirations += 1
+      task = self.in_flight.get(key)
+      if task is not None:
+        self.shared += 1
+      else:
+        self.misses += 1
+        task = self.in_flight[key] = Task()
+        leader = True
+    if not leader:
+      return copy_value(task.wait())
+    try:
+      result = fn(name, args)
+      task.result = copy_value(result)
+    except Exception:
+      task.error = sys.exc_info()
+      raise
+    finally:
+      with self.lock:
+        del self.in_flight[key]
+        if task.error is None:
+          self.store(key, task.result)
+      task.done.set()
+    return result
+
+  # With self.lock held.
+  def store(self, key, result):
+    size = len(key) + value_size(result)
+    if size > self.max_bytes:
+      return
+    expires = None
+    if self.ttl is not None:
+      expires = self.clock() + self.ttl
+    self.entries[key] = (result, size, expires)
+    self.bytes += size
+    while self.bytes > self.max_bytes or (self.max_entries is not None and len(self.entries) > self.max_entries):
+      old_key, (old, old_size, old_expires) = self.entries.popitem(last=False)
+      self.bytes -= old_size
+      self.evictions += 1
+
+  def clear(self):
+    with self.lock:
+      self.entries.clear()
+      self.bytes = 0
+
+  def stats(self):
+    with self.lock:
+      return {"hits": self.hits, "misses": self.misses, "shared": self.shared,
+              "evictions": self.evictions, "expirations": self.expirations,
+              "uncacheable": self.uncacheable, "entries": len(self.entries),
+              "bytes": self.bytes}
+
+# Length-prefixed, so that no two different calls have the same key.  Only
+# bytes: names from the proto are unicode, and joining them with
+# serialized arguments would decode those as ASCII.
+def call_key(name, args):
+  parts = [utf8(name)]
+  for arg_name, v in args:
+    parts.append(utf8(arg_name))
+    parts.append(canonical(symbol_value(v)))
+  return join(parts)
+
+def utf8(s):
+  if isinstance(s, unicode):
+    return s.encode("utf-8")
+  return s
+
+def join(parts):
+  return "".join(["%d:%s" % (len(part), part) for part in parts])
+
+# A string that is the same for equal values and differs for values of
+# different types.  Deterministic serialization, so that messages with map
+# fields do not depend on insertion order, and partial, since parsed
+# messages may lack required fields.
+def canonical(v):
+  if v is None:
+    return "n"
+  elif isinstance(v, bool):
+    return "b%d" % v
+  elif isinstance(v, (int, long)):
+    return "i%d" % v
+  elif isinstance(v, float):
+    return "f" + repr(v)
+  elif isinstance(v, basestring):
+    # Text is the same key as str or unicode, since proto string fields
+    # give back unicode and literals may be str.  Bytes that are not UTF-8
+    # stay apart.
+    if isinstance(v, str):
+      try:
+        v.decode("utf-8")
+      except UnicodeDecodeError:
+        return "s" + v
+      return "u" + v
+    return "u" + v.encode("utf-8")
+  elif isinstance(v, Message):
+    return "m" + join([v.DESCRIPTOR.full_name, v.SerializePartialToString(deterministic=True)])
+  elif isinstance(v, list):
+    return "l" + join([canonical(element) for element in v])
+  raise TypeError("cannot cache a call with argument %r" % (v,))
+
+def copy_value(v):
+  if isinstance(v, Message):
+    return copy_message(v)
+  elif isinstance(v, list):
+    return [copy_value(element) for element in v]
+  return v
+
+def value_size(v):
+  if isinstance(v, Message):
+    return v.ByteSize()
+  elif isinstance(v, list):
+    return sum([value_size(element) for element in v])
+  elif isinstance(v, basestring):
+    return len(v)
+  return 8
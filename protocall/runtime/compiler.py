@@ -0,0 +1,280 @@
+# Copyright 2016 Google Inc. All Rights Reserved.
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+from protocall.proto import protocall_pb2
+from truth import is_true
+from value import unbox, symbol_value, copy_message
+from google.protobuf.message import Message
+from operators import arithmetic_operators, comparison_operators
+from symbols import UNBOUND
+from resolver import resolve_block
+from profiler import clock
+import diagnostics
+
+# Compiles protocall Blocks into trees of Python closures.  Every closure
+# takes the running Protocall instance and mirrors the corresponding branch
+# of Protocall.execute/evaluate, with the HasField dispatch done once, at
+# compile time, instead of every time the statement is reached.
+#
+# UDF bodies are compiled against the Scope computed by resolver.py and run
+# in pooled array-backed Frames, so their locals and arguments are read and
+# written by slot index.  Program-level code keeps using the caller's
+# Symbols by name, since callers seed and inspect that frame.
+
+# Returned by statements that leave the block result untouched (a
+# conditional with no matching branch).
+NO_RESULT = object()
+
+def compile_function(block):
+  scope = resolve_block(block)
+  block_fn = compile_block(block, scope)
+  def function_fn(pr, args):
+    frame = scope.acquire()
+    for name, v in args:
+      frame[name] = v
+    symbols = pr.symbols
+    symbols.push_frame(frame)
+    try:
+      return block_fn(pr)
+    finally:
+      pr.returning = False
+      symbols.pop_frame()
+      scope.release(frame)
+  return function_fn
+
+# Diagnostics are decided when a block is compiled: with them off, the
+# closures contain no logging code.
+def logged_statement(statement, fn):
+  trace = statement.HasField("assignment") and diagnostics.enabled(diagnostics.TRACE)
+  def logged_fn(pr):
+    diagnostics.debug("statement", statement=statement)
+    r = fn(pr)
+    if trace:
+      diagnostics.trace("assignment", field=statement.assignment.field, value=r)
+    return r
+  return logged_fn
+
+def compile_block(block, scope=None):
+  statements = [(statement, compile_statement(statement, scope)) for statement in block.statement]
+  if diagnostics.enabled(diagnostics.DEBUG):
+    statements = [(statement, logged_statement(statement, fn)) for statement, fn in statements]
+  def block_fn(pr):
+    result = None
+    for statement, fn in statements:
+      if pr.tracing:
+        pr.trace(statement)
+      profiler = pr.profiler
+      if profiler is not None:
+        start = clock()
+      try:
+        r = fn(pr)
+      except Exception as e:
+        pr.statement_failed(statement)
+      else:
+        if r is not NO_RESULT:
+          result = r
+      if profiler is not None:
+        profiler.statement(statement, clock() - start)
+      if pr.returning:
+        break
+    return result
+  return block_fn
+
+def compile_scope_block(block, scope):
+  # Conditional and loop bodies with no statements are never executed.
+  if len(block.statement):
+    return compile_block(block, scope)
+  return None
+
+def compile_statement(statement, scope):
+  if statement.HasField("assignment"):
+    return compile_assignment(statement.assignment, scope)
+  elif statement.HasField("array_assignment"):
+    return compile_array_assignment(statement.array_assignment, scope)
+  elif statement.HasField("call"):
+    return compile_call(statement.call, scope)
+  elif statement.HasField("conditional"):
+    return compile_conditional(statement.conditional, scope)
+  elif statement.HasField("return_"):
+    return compile_return(statement.return_, scope)
+  elif statement.HasField("while_"):
+    return compile_while(statement.while_, scope)
+  elif statement.HasField("define"):
+    return compile_define(statement.define)
+  else:
+    raise RuntimeError(str(statement))
+
+def compile_assignment(assignment, scope):
+  field = assignment.field
+  e_fn = compile_expression(assignment.expression, scope)
+  if scope is not None and len(field.component) == 1:
+    i = scope.index[field.component[0].name]
+    def slot_assignment_fn(pr):
+      v = symbol_value(e_fn(pr))
+      pr.symbols.stack[-1].slots[i] = v
+      return v
+    return slot_assignment_fn
+  def assignment_fn(pr):
+    v = symbol_value(e_fn(pr))
+    pr.symbols.add_local_symbol(field, v)
+    return v
+  return assignment_fn
+
+def compile_array_assignment(array_assignment, scope):
+  field = array_assignment.array_ref.field
+  index = array_assignment.array_ref.index.value
+  e_fn = compile_expression(array_assignment.expression, scope)
+  def array_assignment_fn(pr):
+    e = symbol_value(e_fn(pr))
+    pr.symbols.lookup(field)[index] = e
+    return e
+  return array_assignment_fn
+
+def compile_conditional(conditional, scope):
+  branches = [(compile_expression(conditional.if_scope.expression, scope),
+               compile_scope_block(conditional.if_scope.scope.block, scope))]
+  for expression_scope in conditional.elif_scope:
+    branches.append((compile_expression(expression_scope.expression, scope),
+                     compile_scope_block(expression_scope.scope.block, scope)))
+  else_fn = compile_scope_block(conditional.else_scope.block, scope)
+  def conditional_fn(pr):
+    for e_fn, block_fn in branches:
+      if is_true(e_fn(pr)):
+        if block_fn is None:
+          return None
+        return block_fn(pr)
+    if else_fn is not None:
+      return else_fn(pr)
+    return NO_RESULT
+  return conditional_fn
+
+def compile_return(return_, scope):
+  e_fn = compile_expression(return_.expression, scope)
+  def return_fn(pr):
+    v = e_fn(pr)
+    pr.returning = True
+    return v
+  return return_fn
+
+def compile_while(while_, scope):
+  e_fn = compile_expression(while_.expression_scope.expression, scope)
+  block_fn = compile_scope_block(while_.expression_scope.scope.block, scope)
+  def while_fn(pr):
+    while is_true(e_fn(pr)):
+      if block_fn is not None:
+        r = block_fn(pr)
+        if pr.returning:
+          return r
+    return None
+  return while_fn
+
+def compile_define(define):
+  ## Only support definition of top-level fields
+  identifier = define.field.component[0].name
+  block = define.scope.block
+  def define_fn(pr):
+    pr.udfs[identifier] = block
+    return None
+  return define_fn
+
+def compile_call(call, scope):
+  args = [(arg.identifier.name, compile_expression(arg.expression, scope)) for arg in call.argument]
+  if len(call.field.component) != 1:
+    service_name = ".".join([component.name for component in call.field.component])
+    def service_call_fn(pr):
+      return pr.call_service(service_name, [(arg_name, symbol_value(e_fn(pr))) for arg_name, e_fn in args])
+    return service_call_fn
+  name = call.field.component[0].name
+  arguments = call.argument
+  def call_fn(pr):
+    if name in pr.subrs:
+      return pr.subrs[name](pr, arguments, pr.symbols)
+    elif name in pr.builtins or name in pr.udfs:
+      return pr.call_function(name, [(arg_name, e_fn(pr)) for arg_name, e_fn in args])
+    else:
+      raise KeyError, name
+  return call_fn
+
+def compile_expression(expression, scope=None):
+  if expression.HasField("atom"):
+    if expression.atom.literal.HasField("array"):
+      return compile_array(expression.atom.literal.array, scope)
+    return compile_atom(expression.atom, scope)
+  elif expression.HasField("call"):
+    return compile_call(expression.call, scope)
+  elif expression.HasField("arithmetic_operator"):
+    return compile_operator(expression.arithmetic_operator, arithmetic_operators, scope)
+  elif expression.HasField("comparison_operator"):
+    return compile_operator(expression.comparison_operator, comparison_operators, scope)
+  else:
+    raise RuntimeError(str(expression))
+
+def compile_array(array, scope):
+  elements = [compile_expression(element, scope) for element in array.element]
+  def array_fn(pr):
+    return [symbol_value(e_fn(pr)) for e_fn in elements]
+  return array_fn
+
+def compile_atom(atom, scope):
+  if atom.HasField("literal"):
+    v = unbox(atom)
+    if isinstance(v, Message):
+      # Proto literals are parsed once; each evaluation gets its own copy.
+      def proto_fn(pr):
+        return copy_message(v)
+      return proto_fn
+    if isinstance(v, list):
+      # Packed arrays are lists, so they are copied too.
+      def packed_array_fn(pr):
+        return list(v)
+      return packed_array_fn
+    def literal_fn(pr):
+      return v
+    return literal_fn
+  elif atom.HasField("expression"):
+    return compile_expression(atom.expression, scope)
+  elif atom.HasField("field"):
+    field = atom.field
+    if scope is not None and len(field.component) == 1:
+      key = field.component[0].name
+      i = scope.index[key]
+      def slot_fn(pr):
+        v = pr.symbols.stack[-1].slots[i]
+        if v is UNBOUND:
+          raise KeyError, key
+        return v
+      return slot_fn
+    elif len(field.component) == 1:
+      key = field.component[0].name
+      def key_fn(pr):
+        return pr.symbols.lookup_local_key(key)
+      return key_fn
+    def field_fn(pr):
+      return pr.symbols.lookup_local(field)
+    return field_fn
+  elif atom.HasField("array_ref"):
+    field = atom.array_ref.field
+    index = atom.array_ref.index.value
+    def array_ref_fn(pr):
+      return pr.symbols.lookup_local(field)[index]
+    return array_ref_fn
+  else:
+    raise RuntimeError(str(atom))
+
+def compile_operator(operator, operators, scope):
+  op = operators[operator.operator]
+  left_fn = compile_expression(operator.left, scope)
+  right_fn = compile_expression(operator.right, scope)
+  def operator_fn(pr):
+    return op(left_fn(pr), right_fn(pr))
+  return operator_fn
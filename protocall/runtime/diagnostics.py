@@ -0,0 +1,129 @@
+# Copyright 2016 Google Inc. All Rights Reserved.
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import json
+import os
+import sys
+import time
+from google.protobuf import text_format
+from google.protobuf.message import Message
+
+# Leveled diagnostics for the runtime and interpreter.  A record is an event
+# name plus keyword fields, and is passed to the configured sink only when
+# its level is at or above the threshold.
+#
+# Hot paths do not call log for every statement.  They read enabled() once,
+# when a block starts running or is compiled, and skip logging entirely when
+# it is off; the compiled engine builds its closures without any logging
+# code at all.  Fields are formatted by the sink, so protos are only turned
+# into text for records that are written.
+#
+# The threshold and sink can be set with configure, or with the environment
+# variable PROTOCALL_LOG=level[,json], for example PROTOCALL_LOG=debug.
+
+TRACE = 5
+DEBUG = 10
+INFO = 20
+WARNING = 30
+ERROR = 40
+
+level_names = {TRACE: "TRACE", DEBUG: "DEBUG", INFO: "INFO", WARNING: "WARNING", ERROR: "ERROR"}
+levels = dict((name.lower(), level) for level, name in level_names.items())
+
+def format_field(v):
+  if isinstance(v, Message):
+    return text_format.MessageToString(v, as_one_line=True)
+  return v
+
+# Writes "LEVEL event key=value ..." lines.
+class TextSink:
+  def __init__(self, stream=None):
+    self.stream = stream
+
+  def __call__(self, record):
+    stream = self.stream or sys.stderr
+    fields = " ".join("%s=%s" % (key, format_field(v)) for key, v in sorted(record["fields"].items()))
+    stream.write("%s %s %s\n" % (level_names.get(record["level"], record["level"]), record["event"], fields))
+
+# Writes one JSON object per record.
+class JsonSink:
+  def __init__(self, stream=None):
+    self.stream = stream
+
+  def __call__(self, record):
+    stream = self.stream or sys.stderr
+    record = dict(record)
+    record["level"] = level_names.get(record["level"], record["level"])
+    record["fields"] = dict((key, format_field(v)) for key, v in record["fields"].items())
+    stream.write(json.dumps(record, sort_keys=True, default=repr) + "\n")
+
+# Keeps records in a list, for tests and for callers that ship them
+# elsewhere.
+class ListSink:
+  def __init__(self):
+    self.records = []
+
+  def __call__(self, record):
+    self.records.append(record)
+
+threshold = WARNING
+sink = TextSink()
+
+def configure(level=None, output=None):
+  global threshold, sink
+  if level is not None:
+    if not isinstance(level, int):
+      if level.lower() not in levels:
+        raise ValueError("unknown log level %r; expected one of %s" % (
+          level, ", ".join(sorted(levels, key=levels.get))))
+      level = levels[level.lower()]
+    threshold = level
+  if output is not None:
+    sink = output
+
+def enabled(level):
+  return level >= threshold
+
+def log(level, event, **fields):
+  if level >= threshold:
+    sink({"time": time.time(), "level": level, "event": event, "fields": fields})
+
+def trace(event, **fields):
+  log(TRACE, event, **fields)
+
+def debug(event, **fields):
+  log(DEBUG, event, **fields)
+
+def info(event, **fields):
+  log(INFO, event, **fields)
+
+def warning(event, **fields):
+  log(WARNING, event, **fields)
+
+def error(event, **fields):
+  log(ERROR, event, **fields)
+
+def configure_from_environment(environ=os.environ):
+  setting = environ.get("PROTOCALL_LOG")
+  if not setting:
+    return
+  parts = setting.split(",")
+  configure(None, JsonSink() if "json" in parts[1:] else None)
+  # A bad setting keeps the default level rather than breaking every
+  # import of the runtime.
+  try:
+    configure(parts[0])
+  except ValueError as e:
+    warning("bad_protocall_log", setting=setting, error=str(e))
+
+configure_from_environment()
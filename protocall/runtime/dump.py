@@ -32,6 +32,10 @@ def dump_expression(expression):
                     s = 'true'
             elif literal.HasField("array"):
                 s = "'%s'" % literal.array.element
+            elif literal.HasField("integer_array"):
+                s = "{%s}" % ", ".join([str(v) for v in literal.integer_array.value])
+            elif literal.HasField("double_array"):
+                s = "{%s}" % ", ".join([repr(v) for v in literal.double_array.value])
             elif literal.HasField("proto"):
                 p = literal.proto
                 s = "%s<%s>" % (".".join([component.name for component in p.field.component]),
@@ -88,45 +92,48 @@ def dump_expression(expression):
 def indent(s, level=0):
     return '  ' * level + s
 
+def dump_statement(statement, level=0):
+    if statement.HasField("assignment"):
+        assignment = statement.assignment
+        name = field_to_string(assignment.field)
+        expression = dump_expression(assignment.expression)
+        s = indent("%s = %s;" %  (name, expression), level+1)
+    elif statement.HasField("call"):
+        call = statement.call
+        name = field_to_string(call.field)
+        arguments = call.argument
+        args = [ "%s=%s" % (arg.identifier.name, dump_expression(arg.expression)) for arg in arguments ]
+        s = indent("%s(%s);" % (name, ",".join(args)), level+1)
+    elif statement.HasField("conditional"):
+        conditional = statement.conditional
+        if_scope = conditional.if_scope
+        s = indent("if %s%s" % (
+            dump_expression(if_scope.expression),
+            dump(conditional.if_scope.scope.block, level+1)),
+                   level+1)
+        for elif_scope in conditional.elif_scope:
+            s += "\n" + indent("elif %s%s" % (dump_expression(elif_scope.expression), dump(elif_scope.scope.block, level+1)), level+1)
+        if conditional.HasField("else_scope"):
+            else_scope = conditional.else_scope
+            s += "\n" + indent("else %s;" % (dump(conditional.else_scope.block, level+1)), level+1)
+    elif statement.HasField("return_"):
+        return_ = statement.return_
+        s = indent("return %s;" % dump_expression(return_.expression), level+1)
+    elif statement.HasField("while_"):
+        while_ = statement.while_
+        expression_scope = while_.expression_scope
+        s = indent("while %s%s;" % (dump_expression(expression_scope.expression), dump(expression_scope.scope.block, level+1)), level+1)
+    elif statement.HasField("define"):
+        define = statement.define
+        block = define.scope.block
+        s = indent("define %s%s;" % (field_to_string(define.field), dump(block, level+1)), level+1)
+    else:
+        raise RuntimeError
+    return s
+
 def dump(block, level=0):
     result = ["\n" + indent('{', level)]
     for statement in block.statement:
-        if statement.HasField("assignment"):
-            assignment = statement.assignment
-            name = field_to_string(assignment.field)
-            expression = dump_expression(assignment.expression)
-            s = indent("%s = %s;" %  (name, expression), level+1)
-        elif statement.HasField("call"):
-            call = statement.call
-            name = field_to_string(call.field)
-            arguments = call.argument
-            args = [ "%s=%s" % (arg.identifier.name, dump_expression(arg.expression)) for arg in arguments ]
-            s = indent("%s(%s);" % (name, ",".join(args)), level+1)
-        elif statement.HasField("conditional"):
-            conditional = statement.conditional
-            if_scope = conditional.if_scope
-            s = indent("if %s%s" % (
-                dump_expression(if_scope.expression),
-                dump(conditional.if_scope.scope.block, level+1)),
-                       level+1)
-            for elif_scope in conditional.elif_scope:
-                s += "\n" + indent("elif %s%s" % (dump_expression(elif_scope.expression), dump(elif_scope.scope.block, level+1)), level+1)
-            if conditional.HasField("else_scope"):
-                else_scope = conditional.else_scope
-                s += "\n" + indent("else %s;" % (dump(conditional.else_scope.block, level+1)), level+1)
-        elif statement.HasField("return_"):
-            return_ = statement.return_
-            s = indent("return %s;" % dump_expression(return_.expression), level+1)
-        elif statement.HasField("while_"):
-            while_ = statement.while_
-            expression_scope = while_.expression_scope
-            s = indent("while %s%s;" % (dump_expression(expression_scope.expression), dump(expression_scope.scope.block, level+1)), level+1)
-        elif statement.HasField("define"):
-            define = statement.define
-            block = define.scope.block
-            s = indent("define %s%s;" % (field_to_string(define.field), dump(block, level+1)), level+1)
-        else:
-            raise RuntimeError
-        result.append(s)
+        result.append(dump_statement(statement, level))
     result.append(indent('}', level))
     return "\n".join([r for r in result] )
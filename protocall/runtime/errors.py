@@ -0,0 +1,64 @@
+# Copyright 2016 Google Inc. All Rights Reserved.
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import sys
+from protocall.proto import error_pb2
+from value import box
+
+# Raised in production mode (Protocall(production=True)) by the innermost
+# statement that fails, instead of stopping in pdb.  Statements that
+# enclose it, in the same UDF or in its callers, let it pass through
+# unchanged.  Everything about the failure is in self.report, an
+# error_pb2.ErrorReport.
+class ExecutionError(Exception):
+  def __init__(self, report):
+    Exception.__init__(self, "%s: %s" % (report.error_type, report.message))
+    self.report = report
+
+  # So that it can be pickled, for example by a parallel_map worker.
+  def __reduce__(self):
+    return ExecutionError, (self.report,)
+
+  # Partial, since parsed conditionals may leave their required else_scope
+  # unset.
+  def serialize(self):
+    return self.report.SerializePartialToString()
+
+def parse_report(data):
+  report = error_pb2.ErrorReport()
+  report.MergeFromString(data)
+  return report
+
+# Builds the ExecutionError for the exception being handled, which was
+# raised while pr ran statement.  Locals are boxed now, so later changes to
+# live messages do not show up in the report.
+def execution_error(pr, statement):
+  from sampler import protocall_stack
+  error_type, error, tb = sys.exc_info()
+  report = error_pb2.ErrorReport()
+  if statement is not None:
+    report.statement.CopyFrom(statement)
+  call_stack = protocall_stack(sys._getframe(1))
+  if call_stack is not None:
+    report.call_stack.extend(call_stack[1:])
+  for name, v in sorted(pr.symbols.locals().items()):
+    local = report.local.add()
+    local.name = name
+    try:
+      local.value.CopyFrom(box(v))
+    except (TypeError, AttributeError):
+      local.ClearField("value")
+      local.text = repr(v)
+  report.error_type = error_type.__name__
+  report.message = str(error)
+  return ExecutionError(report)
@@ -0,0 +1,253 @@
+# Copyright 2016 Google Inc. All Rights Reserved.
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Usage: micro_benchmark.py [--filter=text] [--repeat=15] [--save=file]
+#                           [--compare=file]
+#
+# Times the runtime's hot primitives one at a time.  Every benchmark is run
+# repeat times, each long enough to be measured reliably, giving repeat
+# samples of the time per call.  --save writes the samples as a baseline;
+# --compare checks the new samples against a baseline with a Mann-Whitney U
+# test and exits with status 1 if any benchmark got significantly slower.
+import json
+import math
+import sys
+import timeit
+
+from protocall.proto import protocall_pb2
+from vm import Protocall
+from symbols import Symbols
+from value import value
+from operators import arithmetic_operators, comparison_operators
+from protos import parse_proto
+
+# A change is reported when it is this significant and this large.
+ALPHA = 0.01
+THRESHOLD = 0.05
+
+# name: function returning the callable to time
+benchmarks = []
+
+def benchmark(name):
+  def register(setup):
+    benchmarks.append((name, setup))
+    return setup
+  return register
+
+def make_field(*names):
+  field = protocall_pb2.Field()
+  for name in names:
+    field.component.add().name = name
+  return field
+
+# Symbols with x in the bottom frame and depth - 1 frames above it, so a
+# lookup of x searches the whole stack.
+def make_symbols(depth):
+  symbols = Symbols({'x': 1})
+  for i in range(depth - 1):
+    symbols.push_frame({'y': i})
+  return symbols
+
+for depth in (1, 10, 100):
+  @benchmark("symbols_lookup_depth_%d" % depth)
+  def lookup(depth=depth):
+    symbols = make_symbols(depth)
+    field = make_field('x')
+    return lambda: symbols.lookup(field)
+
+  @benchmark("symbols_add_local_symbol_depth_%d" % depth)
+  def add_local_symbol(depth=depth):
+    symbols = make_symbols(depth)
+    field = make_field('z')
+    return lambda: symbols.add_local_symbol(field, 5)
+
+def make_person(depth):
+  text = "id: 1 name: \"a\""
+  for i in range(depth):
+    text = "id: %d name: \"a\" person { %s }" % (i + 2, text)
+  return parse_proto(text, "Person")
+
+for depth in (1, 4, 16):
+  @benchmark("symbols_traverse_atom_depth_%d" % depth)
+  def traverse_atom(depth=depth):
+    symbols = Symbols()
+    person = make_person(depth)
+    components = ['person'] * depth + ['id']
+    return lambda: symbols.traverse_atom(person, components)
+
+  @benchmark("symbols_add_local_symbol_proto_depth_%d" % depth)
+  def add_local_symbol_proto(depth=depth):
+    symbols = Symbols({'p': make_person(depth)})
+    field = make_field(*(['p'] + ['person'] * depth + ['id']))
+    return lambda: symbols.add_local_symbol(field, 5)
+
+def make_literals():
+  e = protocall_pb2.Expression()
+  e.atom.literal.integer.value = 5
+  s = protocall_pb2.Literal()
+  s.string.value = "five"
+  return [("int", 5), ("string_literal", s), ("atom", e.atom), ("expression", e)]
+
+for kind, v in make_literals():
+  @benchmark("value_value_%s" % kind)
+  def value_dispatch(v=v):
+    return lambda: value(v)
+
+for op, function in sorted(arithmetic_operators.items()):
+  @benchmark("arithmetic_%s" % function.__name__)
+  def arithmetic(function=function):
+    return lambda: function(12, 3)
+
+for op, function in sorted(comparison_operators.items()):
+  @benchmark("comparison_%s" % function.__name__)
+  def comparison(function=function):
+    return lambda: function(12, 3)
+
+def make_call(name):
+  call = protocall_pb2.Call()
+  call.field.component.add().name = name
+  arg = call.argument.add()
+  arg.identifier.name = 'x'
+  arg.expression.atom.literal.integer.value = 4
+  return call
+
+@benchmark("invoke_builtin")
+def invoke_builtin():
+  pr = Protocall()
+  call = make_call('double')
+  return lambda: pr.invoke(call)
+
+@benchmark("invoke_udf")
+def invoke_udf():
+  pr = Protocall()
+  block = protocall_pb2.Block()
+  e = block.statement.add().return_.expression
+  e.arithmetic_operator.operator = protocall_pb2.ArithmeticOperator.Op.Value("PLUS")
+  e.arithmetic_operator.left.atom.field.component.add().name = 'x'
+  e.arithmetic_operator.right.atom.literal.integer.value = 4
+  pr.udfs['plus_four'] = block
+  call = make_call('plus_four')
+  return lambda: pr.invoke(call)
+
+# Returns repeat samples of the time per call of fn, in seconds.  Each
+# sample runs fn enough times to take at least min_time.
+def measure(fn, repeat, min_time=0.01):
+  timer = timeit.Timer(fn)
+  number = 1
+  while timer.timeit(number) < min_time:
+    number *= 10
+  return [t / number for t in timer.repeat(repeat, number)]
+
+def median(samples):
+  s = sorted(samples)
+  n = len(s)
+  if n % 2:
+    return s[n // 2]
+  return (s[n // 2 - 1] + s[n // 2]) / 2.0
+
+# Two-sided p-value of the Mann-Whitney U test that a and b come from the
+# same distribution, by the normal approximation with a correction for
+# ties.  Makes no assumption about the shape of the timing distributions.
+def mann_whitney(a, b):
+  n1, n2 = len(a), len(b)
+  combined = sorted([(v, 0) for v in a] + [(v, 1) for v in b])
+  ranks = [0.0] * len(combined)
+  ties = 0.0
+  i = 0
+  while i < len(combined):
+    j = i
+    while j + 1 < len(combined) and combined[j + 1][0] == combined[i][0]:
+      j += 1
+    rank = (i + j) / 2.0 + 1
+    for k in range(i, j + 1):
+      ranks[k] = rank
+    t = j - i + 1
+    ties += t ** 3 - t
+    i = j + 1
+  r1 = sum(rank for rank, (v, group) in zip(ranks, combined) if group == 0)
+  u = r1 - n1 * (n1 + 1) / 2.0
+  n = n1 + n2
+  variance = n1 * n2 / 12.0 * ((n + 1) - ties / (n * (n - 1)))
+  if variance <= 0:
+    return 1.0
+  z = (abs(u - n1 * n2 / 2.0) - 0.5) / math.sqrt(variance)
+  return min(1.0, math.erfc(max(z, 0.0) / math.sqrt(2)))
+
+def run(names, repeat):
+  results = {}
+  for name, setup in benchmarks:
+    if name in names:
+      results[name] = measure(setup(), repeat)
+  return results
+
+# Returns (name, baseline median, new median, change, p, verdict) for every
+# benchmark in both result sets.  The verdict is "regression", "improvement"
+# or "".
+def compare(baseline, results, alpha=ALPHA, threshold=THRESHOLD):
+  rows = []
+  for name in sorted(results):
+    if name not in baseline:
+      continue
+    old, new = median(baseline[name]), median(results[name])
+    change = new / old - 1
+    p = mann_whitney(baseline[name], results[name])
+    verdict = ""
+    if p < alpha and change > threshold:
+      verdict = "regression"
+    elif p < alpha and change < -threshold:
+      verdict = "improvement"
+    rows.append((name, old, new, change, p, verdict))
+  return rows
+
+def main(argv):
+  text = ""
+  repeat = 15
+  save = None
+  baseline = None
+  for arg in argv[1:]:
+    if arg.startswith("--filter="):
+      text = arg[len("--filter="):]
+    elif arg.startswith("--repeat="):
+      repeat = int(arg[len("--repeat="):])
+    elif arg.startswith("--save="):
+      save = arg[len("--save="):]
+    elif arg.startswith("--compare="):
+      baseline = json.load(open(arg[len("--compare="):]))["benchmarks"]
+    else:
+      print >>sys.stderr, "unknown flag", arg
+      sys.exit(2)
+  names = [name for name, setup in benchmarks if text in name]
+  results = run(names, repeat)
+  if save is not None:
+    with open(save, "w") as f:
+      json.dump({"repeat": repeat, "benchmarks": results}, f, indent=2, sort_keys=True)
+      f.write("\n")
+  if baseline is None:
+    print "%-40s %12s %12s" % ("benchmark", "median ns", "min ns")
+    for name in names:
+      print "%-40s %12.1f %12.1f" % (name, median(results[name]) * 1e9, min(results[name]) * 1e9)
+    return 0
+  print "%-40s %12s %12s %8s %8s" % ("benchmark", "base ns", "new ns", "change", "p")
+  regressions = 0
+  for name, old, new, change, p, verdict in compare(baseline, results):
+    print "%-40s %12.1f %12.1f %+7.1f%% %8.4f %s" % (name, old * 1e9, new * 1e9, change * 100, p, verdict)
+    if verdict == "regression":
+      regressions += 1
+  if regressions:
+    print "%d significant regressions" % regressions
+    return 1
+  return 0
+
+if __name__ == '__main__':
+  sys.exit(main(sys.argv))
@@ -11,52 +11,126 @@
 # WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 # See the License for the specific language governing permissions and
 # limitations under the License.
+import array
 from protocall.proto import protocall_pb2
-from value import value
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# Operators take and return native runtime values; see value.box/unbox.
+# Arrays (lists) are operated on element by element, against another array
+# of the same length or against a scalar.  Comparisons of arrays give lists
+# of booleans, which the pipeline.filter subr takes as its mask argument.
 
 def plus(left, right):
-    result = protocall_pb2.Literal()
-    result.integer.value = value(left) + value(right)
-    return result
+    if left.__class__ is list or right.__class__ is list:
+        return elementwise(plus, left, right)
+    return left + right
 
 def minus(left, right):
-    result = protocall_pb2.Literal()
-    result.integer.value = value(left) - value(right)
-    return result
+    if left.__class__ is list or right.__class__ is list:
+        return elementwise(minus, left, right)
+    return left - right
 
 def multiply(left, right):
-    result = protocall_pb2.Literal()
-    print "multiply"
-    print "left=",type(left)
-    print "right=",type(right)
-    v_left = value(left)
-    v_right = value(right)
-    print "v_left=", type(v_left)
-    print "v_right=", type(v_right)
-    result = v_left * v_right
-    print "result=", result
-    result.integer.value = result
-    return result
+    if left.__class__ is list or right.__class__ is list:
+        return elementwise(multiply, left, right)
+    return left * right
 
 def divide(left, right):
-    result = protocall_pb2.Literal()
-    result.integer.value = value(left) / value(right)
-    return result
+    if left.__class__ is list or right.__class__ is list:
+        return elementwise(divide, left, right)
+    return left / right
 
 def equals(left, right):
-    result = protocall_pb2.Literal()
-    result.boolean.value = value(left) == value(right)
-    return result
+    if left.__class__ is list or right.__class__ is list:
+        return elementwise(equals, left, right)
+    return left == right
 
 def less_than(left, right):
-    result = protocall_pb2.Literal()
-    result.boolean.value = value(left) < value(right)
-    return result
+    if left.__class__ is list or right.__class__ is list:
+        return elementwise(less_than, left, right)
+    return left < right
 
 def greater_than(left, right):
-    result = protocall_pb2.Literal()
-    result.boolean.value = value(left) > value(right)
-    return result
+    if left.__class__ is list or right.__class__ is list:
+        return elementwise(greater_than, left, right)
+    return left > right
+
+def elementwise(function, left, right):
+    if numpy is not None:
+        result = vectorized(function, left, right)
+        if result is not None:
+            return result
+    if left.__class__ is list and right.__class__ is list:
+        if len(left) != len(right):
+            raise ValueError("arrays of different lengths: %d and %d" % (len(left), len(right)))
+        return [function(l, r) for l, r in zip(left, right)]
+    elif left.__class__ is list:
+        return [function(l, right) for l in left]
+    return [function(left, r) for r in right]
+
+# Arrays shorter than this are not worth converting to NumPy.
+NUMPY_THRESHOLD = 32
+
+# Integers below this magnitude cannot overflow int64 when multiplied.
+NUMPY_INTEGER_LIMIT = 2 ** 31
+
+# Returns function(left, right) computed by NumPy, or None when NumPy would
+# not give exactly what the Python fallback gives: for short arrays, for
+# arrays that are not all int or all float, for integers that might
+# overflow int64, for division by zero and for arrays of different lengths.
+def vectorized(function, left, right):
+    if left.__class__ is list and right.__class__ is list and len(left) != len(right):
+        return None
+    if len(left if left.__class__ is list else right) < NUMPY_THRESHOLD:
+        return None
+    l = to_numpy(left)
+    if l is None:
+        return None
+    r = to_numpy(right)
+    if r is None:
+        return None
+    if function is divide:
+        if not numpy.all(r):
+            return None
+        if numpy.asarray(l).dtype.kind == "i" and numpy.asarray(r).dtype.kind == "i":
+            return numpy.floor_divide(l, r).tolist()
+        return numpy.true_divide(l, r).tolist()
+    return numpy_functions[function](l, r).tolist()
+
+# Lists go through array.array, which converts them several times faster
+# than numpy.asarray does and rejects anything that is not an int.
+def to_numpy(operand):
+    if operand.__class__ is not list:
+        if operand.__class__ is float:
+            return operand
+        if operand.__class__ is int and abs(operand) < NUMPY_INTEGER_LIMIT:
+            return operand
+        return None
+    try:
+        a = numpy.frombuffer(array.array("l", operand), "l")
+    except (TypeError, OverflowError):
+        if set(map(type, operand)) != numpy_float:
+            return None
+        return numpy.frombuffer(array.array("d", operand), "d")
+    if abs(a).max() >= NUMPY_INTEGER_LIMIT:
+        return None
+    return a
+
+numpy_float = set([float])
+
+if numpy is not None:
+    numpy_functions = {
+        plus: numpy.add,
+        minus: numpy.subtract,
+        multiply: numpy.multiply,
+        equals: numpy.equal,
+        less_than: numpy.less,
+        greater_than: numpy.greater,
+    }
 
 arithmetic_operators = {
     protocall_pb2.ArithmeticOperator.Op.Value("PLUS"): plus,
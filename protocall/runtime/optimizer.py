@@ -0,0 +1,174 @@
+# Copyright 2016 Google Inc. All Rights Reserved.
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import sys
+from protocall.proto import protocall_pb2
+from value import box
+from operators import arithmetic_operators, comparison_operators
+
+# Rewrites Blocks ahead of execution:
+#  - ArithmeticOperator and ComparisonOperator nodes over literals are folded
+#    into a literal.  Identities such as x+0 and x*1 are left alone: x may
+#    be an array, which they would alias instead of copying, or a boolean,
+#    which they would not turn into a number;
+#  - Conditional branches whose condition folds to a constant are pruned;
+#  - statements after a return_ in the same block are dropped.
+# optimize() works on a copy; optimize_block() rewrites in place.
+
+def optimize(block):
+  b = protocall_pb2.Block()
+  b.CopyFrom(block)
+  optimize_block(b)
+  return b
+
+def optimize_string(s):
+  return optimize(protocall_pb2.Block.FromString(s)).SerializeToString()
+
+def optimize_block(block):
+  statements = []
+  for statement in block.statement:
+    statements.extend(optimize_statement(statement))
+    if statements and statements[-1].HasField("return_"):
+      break
+  if len(statements) != len(block.statement) or any(a is not b for a, b in zip(statements, block.statement)):
+    statements = [copy(statement) for statement in statements]
+    del block.statement[:]
+    block.statement.extend(statements)
+
+def copy(m):
+  c = m.__class__()
+  c.CopyFrom(m)
+  return c
+
+# Returns the statements that replace statement.
+def optimize_statement(statement):
+  if statement.HasField("assignment"):
+    optimize_expression(statement.assignment.expression)
+  elif statement.HasField("array_assignment"):
+    optimize_expression(statement.array_assignment.expression)
+  elif statement.HasField("call"):
+    optimize_call(statement.call)
+  elif statement.HasField("conditional"):
+    return optimize_conditional(statement)
+  elif statement.HasField("return_"):
+    optimize_expression(statement.return_.expression)
+  elif statement.HasField("while_"):
+    optimize_expression(statement.while_.expression_scope.expression)
+    optimize_block(statement.while_.expression_scope.scope.block)
+  elif statement.HasField("define"):
+    optimize_block(statement.define.scope.block)
+  return [statement]
+
+def optimize_conditional(statement):
+  conditional = statement.conditional
+  branches = []
+  for expression_scope in [conditional.if_scope] + list(conditional.elif_scope):
+    optimize_expression(expression_scope.expression)
+    optimize_block(expression_scope.scope.block)
+    truth = constant_truth(expression_scope.expression)
+    if truth is False:
+      continue
+    branches.append(expression_scope)
+    if truth is True:
+      break
+  else_block = None
+  if not branches or constant_truth(branches[-1].expression) is not True:
+    optimize_block(conditional.else_scope.block)
+    if len(conditional.else_scope.block.statement):
+      else_block = conditional.else_scope.block
+  if not branches and else_block is None:
+    # No branch can be taken, so the statement does nothing.
+    return []
+  if not branches or constant_truth(branches[0].expression) is True:
+    if branches:
+      block = branches[0].scope.block
+    else:
+      block = else_block
+    if inlinable(block):
+      return list(block.statement)
+    c = protocall_pb2.Statement()
+    c.conditional.if_scope.expression.atom.literal.boolean.value = True
+    c.conditional.if_scope.scope.block.CopyFrom(block)
+    return [c]
+  if len(branches) == 1 + len(conditional.elif_scope) and (else_block is not None or not len(conditional.else_scope.block.statement)):
+    return [statement]
+  c = protocall_pb2.Statement()
+  c.conditional.if_scope.CopyFrom(branches[0])
+  for expression_scope in branches[1:]:
+    c.conditional.elif_scope.add().CopyFrom(expression_scope)
+  if else_block is not None:
+    c.conditional.else_scope.block.CopyFrom(else_block)
+  return [c]
+
+# A taken branch can be spliced into the enclosing block when that leaves
+# the block result unchanged: the body must end in a statement that always
+# produces a result.  Conditional and loop bodies share the frame of the
+# enclosing block, so the symbols are the same either way.
+def inlinable(block):
+  if not len(block.statement):
+    return False
+  return not block.statement[-1].HasField("conditional")
+
+def constant_truth(expression):
+  if expression.HasField("atom") and expression.atom.literal.HasField("boolean"):
+    return expression.atom.literal.boolean.value
+  return None
+
+def optimize_call(call):
+  for arg in call.argument:
+    optimize_expression(arg.expression)
+
+def optimize_expression(expression):
+  if expression.HasField("atom"):
+    atom = expression.atom
+    if atom.HasField("expression"):
+      optimize_expression(atom.expression)
+      if is_constant(atom.expression):
+        expression.CopyFrom(atom.expression)
+    elif atom.literal.HasField("array"):
+      for element in atom.literal.array.element:
+        optimize_expression(element)
+  elif expression.HasField("call"):
+    optimize_call(expression.call)
+  elif expression.HasField("arithmetic_operator"):
+    optimize_operator(expression, expression.arithmetic_operator, arithmetic_operators)
+  elif expression.HasField("comparison_operator"):
+    optimize_operator(expression, expression.comparison_operator, comparison_operators)
+
+def optimize_operator(expression, operator, operators):
+  optimize_expression(operator.left)
+  optimize_expression(operator.right)
+  if is_constant(operator.left) and is_constant(operator.right):
+    try:
+      v = operators[operator.operator](constant(operator.left), constant(operator.right))
+      atom = box(v)
+    except Exception:
+      # Left for the runtime to fail on, and report, when it is reached.
+      return
+    e = protocall_pb2.Expression()
+    e.atom.CopyFrom(atom)
+    expression.CopyFrom(e)
+
+def is_constant(expression):
+  if not expression.HasField("atom") or not expression.atom.HasField("literal"):
+    return False
+  kind = expression.atom.literal.WhichOneof("literal")
+  return kind in ("integer", "string", "boolean")
+
+def constant(expression):
+  literal = expression.atom.literal
+  return getattr(literal, literal.WhichOneof("literal")).value
+
+# Reads a serialized Block on stdin and writes the optimized Block to stdout.
+if __name__ == '__main__':
+  sys.stdout.write(optimize_string(sys.stdin.read()))
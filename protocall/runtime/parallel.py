@@ -0,0 +1,169 @@
+# Copyright 2016 Google Inc. All Rights Reserved.
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import hashlib
+import multiprocessing
+import threading
+from protocall.proto import protocall_pb2
+from protocall.proto import bytecode_pb2
+from value import symbol_value
+
+# The parallel_map subr:
+#
+#   parallel_map(a=array, f="name", processes=n)
+#
+# is map(a=array, f="name") with the calls of f spread over a pool of n
+# worker processes, by default one per CPU.  Every worker runs its own
+# Protocall, or StackVM for a StackVM program, in production mode.
+#
+# The program's UDFs are serialized and handed to the workers once, when
+# the pool is started, and each worker keeps them.  The pool is then kept
+# for later calls for as long as the UDFs, engine and number of processes
+# stay the same.  Tasks only carry the UDF name and a chunk of elements,
+# and pool.map returns the chunks' results in order.
+#
+# Calls may run at once, from spawned tasks or server workers.  A pool that
+# is replaced while calls still use it is terminated when the last of them
+# finishes.
+#
+# f must be a UDF or a default builtin, and the elements and results must
+# be picklable.
+
+# Chunks per process, so that processes that finish early pick up more.
+CHUNKS_PER_PROCESS = 4
+
+lock = threading.Lock()
+# The SharedPool new calls use.
+current = None
+# (UDFs as (name, udf) pairs, their serialization, its digest) for the last
+# UDFs serialized.  The UDFs are kept so their ids cannot be reused.
+serialized = None
+
+class SharedPool:
+  def __init__(self, key, pool):
+    self.key = key
+    self.pool = pool
+    self.users = 0
+    self.retired = False
+
+def parallel_map(protocall, arguments, symbols):
+  from pipeline import source
+  elements = list(source(protocall, arguments[0].expression))
+  name = symbol_value(protocall.eval(arguments[1].expression))
+  if len(arguments) > 2:
+    processes = symbol_value(protocall.eval(arguments[2].expression))
+  else:
+    processes = multiprocessing.cpu_count()
+  if not elements:
+    return []
+  size = max(1, -(-len(elements) // (processes * CHUNKS_PER_PROCESS)))
+  chunks = [(name, elements[i:i + size]) for i in range(0, len(elements), size)]
+  shared = acquire_pool(protocall, processes)
+  try:
+    results = []
+    for chunk in shared.pool.map(run_chunk, chunks):
+      results.extend(chunk)
+    return results
+  finally:
+    release_pool(shared)
+
+# (name, kind, serialized) for the UDFs that can be sent to a worker.
+# Partial serialization, since parsed conditionals may leave their required
+# else_scope unset.
+def serialize_udfs(udfs):
+  # Not imported at the top: subrs imports this module, and bytecode
+  # imports subrs to list the subr names.
+  import bytecode
+  result = []
+  for name, udf in udfs:
+    if isinstance(udf, protocall_pb2.Block):
+      result.append((name, "block", udf.SerializePartialToString()))
+    elif isinstance(udf, bytecode.Code):
+      result.append((name, "code", udf.to_proto().SerializePartialToString()))
+  return result
+
+# With lock held.  UDFs are serialized and hashed again only when they are
+# not the same objects as last time.
+def serialize(protocall):
+  global serialized
+  udfs = sorted(protocall.udfs.items())
+  if serialized is not None:
+    last = serialized[0]
+    if len(last) == len(udfs) and all(a[0] == b[0] and a[1] is b[1] for a, b in zip(last, udfs)):
+      return serialized[1], serialized[2]
+  data = serialize_udfs(udfs)
+  serialized = (udfs, data, hashlib.sha1(repr(data)).hexdigest())
+  return serialized[1], serialized[2]
+
+def acquire_pool(protocall, processes):
+  global current
+  with lock:
+    udfs, digest = serialize(protocall)
+    stack_vm = any(kind == "code" for name, kind, data in udfs)
+    key = (digest, protocall.engine, stack_vm, processes)
+    if current is None or current.key != key:
+      retire()
+      pool = multiprocessing.Pool(processes, start_worker, (udfs, protocall.engine, stack_vm))
+      current = SharedPool(key, pool)
+    current.users += 1
+    return current
+
+def release_pool(shared):
+  with lock:
+    shared.users -= 1
+    if shared.retired and not shared.users:
+      terminate(shared)
+
+def close_pool():
+  with lock:
+    retire()
+
+# With lock held: new calls stop using the current pool, which is
+# terminated once it is not in use.
+def retire():
+  global current
+  if current is not None:
+    current.retired = True
+    if not current.users:
+      terminate(current)
+  current = None
+
+def terminate(shared):
+  shared.pool.terminate()
+  shared.pool.join()
+
+# In a worker process: the Protocall that runs every chunk.
+worker = None
+
+def start_worker(udfs, engine, stack_vm):
+  global worker
+  import bytecode
+  if stack_vm:
+    from stack_vm import StackVM
+    worker = StackVM(production=True)
+  else:
+    from vm import Protocall
+    worker = Protocall(engine=engine, production=True)
+  for name, kind, data in udfs:
+    if kind == "block":
+      udf = protocall_pb2.Block()
+      udf.MergeFromString(data)
+    else:
+      c = bytecode_pb2.Code()
+      c.MergeFromString(data)
+      udf = bytecode.Code.from_proto(c)
+    worker.udfs[name] = udf
+
+def run_chunk(task):
+  name, elements = task
+  return [symbol_value(worker.call_function(name, [("x", v)])) for v in elements]
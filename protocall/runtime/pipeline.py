@@ -0,0 +1,97 @@
+# Copyright 2016 Google Inc. All Rights Reserved.
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import itertools
+from truth import is_true
+from value import symbol_value
+
+# The map, filter and reduce subrs:
+#
+#   map(a=array, f="name")                 f(x=element) for every element
+#   filter(a=array, f="name")              the elements for which f(x=element)
+#   filter(a=array, mask=booleans)         the elements whose mask entry is true
+#   reduce(a=array, f="name", initial=v)   f(acc=..., x=element) over the elements
+#
+# f is the name of a UDF or builtin.  Arguments are taken in order, and
+# reduce without an initial value starts from the first element.
+#
+# Being subrs, they get their arguments unevaluated.  When the array of a
+# map, filter or reduce is itself a map or filter call, it is not evaluated
+# into an array: the stages are chained as generators, so all of them run
+# in a single pass over the innermost array, one element at a time, and no
+# array is built for the intermediate results.  Only the outermost call
+# materializes its result.
+
+def map(protocall, arguments, symbols):
+  return list(stream(protocall, "map", arguments))
+
+def filter(protocall, arguments, symbols):
+  return list(stream(protocall, "filter", arguments))
+
+def reduce(protocall, arguments, symbols):
+  elements = source(protocall, arguments[0].expression)
+  name = symbol_value(protocall.eval(arguments[1].expression))
+  if len(arguments) > 2:
+    acc = symbol_value(protocall.eval(arguments[2].expression))
+  else:
+    elements = iter(elements)
+    acc = next(elements, empty)
+    if acc is empty:
+      raise ValueError("reduce of an empty array with no initial value")
+  for v in elements:
+    acc = call(protocall, name, acc=acc, x=v)
+  return acc
+
+stages = {"map": map, "filter": filter}
+
+empty = object()
+
+# The elements of the array expression evaluates to, as an iterable.
+def source(protocall, expression):
+  if expression.HasField("call") and len(expression.call.field.component) == 1:
+    name = expression.call.field.component[0].name
+    if name in stages and protocall.subrs.get(name) is stages[name]:
+      return stream(protocall, name, expression.call.argument)
+  return symbol_value(protocall.eval(expression))
+
+def stream(protocall, kind, arguments):
+  elements = source(protocall, arguments[0].expression)
+  f = symbol_value(protocall.eval(arguments[1].expression))
+  if kind == "map":
+    return (call(protocall, f, x=v) for v in elements)
+  elif isinstance(f, list):
+    return masked(elements, f)
+  return (v for v in elements if is_true(call(protocall, f, x=v)))
+
+def masked(elements, mask):
+  if isinstance(elements, list):
+    if len(elements) != len(mask):
+      raise ValueError("array and mask of different lengths: %d and %d" % (len(elements), len(mask)))
+    return itertools.compress(elements, mask)
+  return masked_stream(elements, mask)
+
+# Like itertools.compress, but for elements whose number is only known at
+# the end.
+def masked_stream(elements, mask):
+  n = 0
+  for v in elements:
+    if n == len(mask):
+      raise ValueError("array longer than its mask of length %d" % len(mask))
+    if mask[n]:
+      yield v
+    n += 1
+  if n < len(mask):
+    raise ValueError("array of length %d shorter than its mask of length %d" % (n, len(mask)))
+
+def call(protocall, name, **args):
+  return symbol_value(protocall.call_function(name, sorted(args.items())))
@@ -0,0 +1,155 @@
+# Copyright 2016 Google Inc. All Rights Reserved.
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+from timeit import default_timer as clock
+from dump import dump_statement, dump_expression, field_to_string
+
+# Counts executions and wall time per Statement, per UDF and per builtin.
+# Pass a Profiler to Protocall(profiler=...); the engines only call into it
+# when one is set, so an unprofiled run pays a single None check per
+# statement and call.
+#
+# Statement times are inclusive: a conditional, while or call statement
+# includes the time of everything it runs, so recursive UDFs count their
+# nested calls more than once.
+
+# Histogram buckets are powers of two microseconds, from <=1us to <=2**26us
+# (about a minute), plus one bucket for anything slower.
+BUCKETS = 28
+
+class Histogram:
+  def __init__(self):
+    self.count = 0
+    self.total = 0.0
+    self.min = None
+    self.max = 0.0
+    self.buckets = [0] * BUCKETS
+
+  def add(self, seconds):
+    self.count += 1
+    self.total += seconds
+    if self.min is None or seconds < self.min:
+      self.min = seconds
+    if seconds > self.max:
+      self.max = seconds
+    us = int(seconds * 1e6)
+    bucket = 0
+    while us > (1 << bucket) and bucket < BUCKETS - 1:
+      bucket += 1
+    self.buckets[bucket] += 1
+
+  def mean(self):
+    if not self.count:
+      return 0.0
+    return self.total / self.count
+
+  # Upper bound, in seconds, of the bucket holding the fraction p of the
+  # samples; the slowest bucket reports the maximum.
+  def percentile(self, p):
+    if not self.count:
+      return 0.0
+    target = p * self.count
+    seen = 0
+    for bucket, n in enumerate(self.buckets):
+      seen += n
+      if seen >= target and n:
+        if bucket == BUCKETS - 1:
+          return self.max
+        return min((1 << bucket) / 1e6, self.max)
+    return self.max
+
+  def lines(self, width=40):
+    used = [bucket for bucket, n in enumerate(self.buckets) if n]
+    if not used:
+      return []
+    most = max(self.buckets)
+    result = []
+    for bucket in range(used[0], used[-1] + 1):
+      n = self.buckets[bucket]
+      if bucket == BUCKETS - 1:
+        label = ">%dus" % (1 << (bucket - 1))
+      else:
+        label = "<=%dus" % (1 << bucket)
+      result.append("%12s %8d %s" % (label, n, "#" * (n * width // most)))
+    return result
+
+# One line of readable source for a statement.  Statements with nested
+# scopes are shown without their bodies, whose statements are reported on
+# their own.
+def describe(statement):
+  if statement.HasField("conditional"):
+    return "if %s {...};" % dump_expression(statement.conditional.if_scope.expression)
+  elif statement.HasField("while_"):
+    return "while %s {...};" % dump_expression(statement.while_.expression_scope.expression)
+  elif statement.HasField("define"):
+    return "define %s {...};" % field_to_string(statement.define.field)
+  return dump_statement(statement).strip()
+
+class Profiler:
+  def __init__(self):
+    # Keyed by id() of the Statement; the Statement is kept in the entry so
+    # its id cannot be reused.
+    self.statements = {}
+    self.udfs = {}
+    self.builtins = {}
+
+  def statement(self, statement, seconds):
+    entry = self.statements.get(id(statement))
+    if entry is None:
+      entry = (statement, Histogram())
+      self.statements[id(statement)] = entry
+    entry[1].add(seconds)
+
+  def call(self, name, builtin, seconds):
+    if builtin:
+      histograms = self.builtins
+    else:
+      histograms = self.udfs
+    histogram = histograms.get(name)
+    if histogram is None:
+      histogram = histograms[name] = Histogram()
+    histogram.add(seconds)
+
+  def reset(self):
+    self.statements.clear()
+    self.udfs.clear()
+    self.builtins.clear()
+
+  def report(self, top=20):
+    lines = []
+    header = "%8s %10s %10s %10s %10s %10s  %s" % (
+      "count", "total ms", "mean us", "p50 us", "p99 us", "max us", "%s")
+    def row(h, name):
+      return "%8d %10.3f %10.1f %10.1f %10.1f %10.1f  %s" % (
+        h.count, h.total * 1e3, h.mean() * 1e6, h.percentile(0.5) * 1e6,
+        h.percentile(0.99) * 1e6, h.max * 1e6, name)
+    if self.statements:
+      statements = sorted(self.statements.values(), key=lambda entry: -entry[1].total)
+      lines.append("Hot statements (inclusive wall time):")
+      lines.append(header % "statement")
+      for statement, h in statements[:top]:
+        lines.append(row(h, describe(statement)))
+    for title, histograms in (("UDFs", self.udfs), ("Builtins", self.builtins)):
+      if not histograms:
+        continue
+      if lines:
+        lines.append("")
+      lines.append("%s:" % title)
+      lines.append(header % "name")
+      for name, h in sorted(histograms.items(), key=lambda item: -item[1].total):
+        lines.append(row(h, name))
+      for name, h in sorted(histograms.items(), key=lambda item: -item[1].total)[:top]:
+        lines.append("")
+        lines.append("%s latency:" % name)
+        lines.extend(h.lines())
+    return "\n".join(lines)
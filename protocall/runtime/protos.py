@@ -29,5 +29,10 @@ def parse_proto(text, message_name):
     p = protos[message_name]()
     text_format.Merge(text, p)
     return p
-  import pdb; pdb.set_trace()
   raise RuntimeError("message name is: '" + message_name + "'")
+
+def message_name(message):
+  for name, cls in protos.items():
+    if isinstance(message, cls):
+      return name
+  return message.DESCRIPTOR.full_name
@@ -0,0 +1,77 @@
+# Copyright 2016 Google Inc. All Rights Reserved.
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+from symbols import Scope
+
+# Assigns a frame slot to every name a Block refers to.  Conditional and
+# loop bodies share the frame of the block they are in; the bodies of
+# defines get a Scope of their own when they are compiled.  Lookups only
+# ever read the innermost frame, so a resolved name is always a slot of the
+# current frame.
+
+def resolve_block(block, scope=None):
+  if scope is None:
+    scope = Scope()
+  for statement in block.statement:
+    resolve_statement(statement, scope)
+  return scope
+
+def resolve_statement(statement, scope):
+  if statement.HasField("assignment"):
+    resolve_expression(statement.assignment.expression, scope)
+    resolve_field(statement.assignment.field, scope)
+  elif statement.HasField("array_assignment"):
+    resolve_expression(statement.array_assignment.expression, scope)
+    resolve_field(statement.array_assignment.array_ref.field, scope)
+  elif statement.HasField("call"):
+    resolve_call(statement.call, scope)
+  elif statement.HasField("conditional"):
+    conditional = statement.conditional
+    for expression_scope in [conditional.if_scope] + list(conditional.elif_scope):
+      resolve_expression(expression_scope.expression, scope)
+      resolve_block(expression_scope.scope.block, scope)
+    resolve_block(conditional.else_scope.block, scope)
+  elif statement.HasField("return_"):
+    resolve_expression(statement.return_.expression, scope)
+  elif statement.HasField("while_"):
+    resolve_expression(statement.while_.expression_scope.expression, scope)
+    resolve_block(statement.while_.expression_scope.scope.block, scope)
+
+def resolve_call(call, scope):
+  for arg in call.argument:
+    resolve_expression(arg.expression, scope)
+
+def resolve_expression(expression, scope):
+  if expression.HasField("atom"):
+    atom = expression.atom
+    if atom.HasField("field"):
+      resolve_field(atom.field, scope)
+    elif atom.HasField("array_ref"):
+      resolve_field(atom.array_ref.field, scope)
+    elif atom.HasField("expression"):
+      resolve_expression(atom.expression, scope)
+    elif atom.literal.HasField("array"):
+      for element in atom.literal.array.element:
+        resolve_expression(element, scope)
+  elif expression.HasField("call"):
+    resolve_call(expression.call, scope)
+  elif expression.HasField("arithmetic_operator"):
+    resolve_expression(expression.arithmetic_operator.left, scope)
+    resolve_expression(expression.arithmetic_operator.right, scope)
+  elif expression.HasField("comparison_operator"):
+    resolve_expression(expression.comparison_operator.left, scope)
+    resolve_expression(expression.comparison_operator.right, scope)
+
+def resolve_field(field, scope):
+  # Only the first component names a symbol; the rest are message fields.
+  return scope.slot(field.component[0].name)
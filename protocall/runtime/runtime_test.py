@@ -13,16 +13,44 @@
 # limitations under the License.
 """Tests for protocall.runtime.runtime."""
 
+import json
+import os
+import pickle
+import socket
+import subprocess
+import sys
+import threading
+import time
+import StringIO
 import unittest
 
 from google.protobuf import text_format
 
 from protocall.proto import protocall_pb2
-from protocall.runtime.vm import Protocall
+from protocall.proto import test_pb2
+from protocall.interpreter import pratt_parser
+from protocall.runtime.vm import Protocall, COMPILED
+from protocall.runtime.stack_vm import StackVM
+from protocall.runtime import bytecode
 from protocall.runtime import dump
 
-from protocall.runtime.truth import true, false, literal_true, literal_false
-from protocall.runtime.symbols import Symbols
+from protocall.runtime.truth import true, false, literal_true, literal_false, atom_true
+from protocall.runtime.value import box, unbox
+from protocall.runtime.symbols import Symbols, Scope
+from protocall.runtime.resolver import resolve_block
+from protocall.runtime import optimizer
+from protocall.runtime import transpiler
+from protocall.runtime.profiler import Profiler, Histogram
+from protocall.runtime.sampler import Sampler, protocall_stack
+from protocall.runtime import micro_benchmark
+from protocall.runtime import diagnostics
+from protocall.runtime import operators
+from protocall.runtime import parallel
+from protocall.runtime import tasks
+from protocall.runtime import services
+from protocall.runtime import server
+from protocall.runtime.cache import CallCache
+from protocall.runtime.errors import ExecutionError, parse_report
 
 
 def create_expression():
@@ -484,13 +512,472 @@ def test_evaluate_proto_expression():
     result = pr.evaluate(expression)
     return result
 
+def test_compiled(p):
+    pr = Protocall(engine=COMPILED)
+    print "Program:"
+    print dump.dump(p)
+    result = pr.execute(p)
+    print "Result:"
+    print result
+    return result
+
+def test_compiled_cache():
+    p = create_define()
+    pr = Protocall(engine=COMPILED)
+    pr.execute(p)
+    compiled = dict(pr.compiled)
+    functions = dict(pr.compiled_functions)
+    pr.execute(p)
+    assert pr.compiled == compiled
+    assert pr.compiled_functions == functions
+    return pr
+
+def test_stack_vm(p):
+    pr = StackVM()
+    program = bytecode.compile_program(p)
+    print "Program:"
+    print bytecode.disassemble(program)
+    result = pr.run(program)
+    print "Result:"
+    print result
+    return result
+
+def test_stack_vm_serialized(p):
+    s = bytecode.compile_program(p).SerializeToString()
+    pr = StackVM()
+    result = pr.run(bytecode.Program.FromString(s))
+    print "Result:"
+    print result
+    return result
+
+# Runs a serialized StackVM program that calls the map subr in a fresh
+# interpreter that imports vm before anything else, and returns its output.
+def test_subrs_after_vm():
+    code = """if 1:
+      from protocall.runtime import vm
+      from protocall.runtime import bytecode
+      from protocall.runtime.stack_vm import StackVM
+      from protocall.runtime.value import unbox
+      from protocall.interpreter import pratt_parser
+      block = pratt_parser.parse_scope('''{
+        define square { return x * x; };
+        return map(a={1, 2, 3}, f="square");
+      }''').block
+      s = bytecode.compile_program(block).SerializeToString()
+      print [int(v) for v in unbox(StackVM().run(bytecode.Program.FromString(s)))]
+    """
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path))
+    return subprocess.check_output([sys.executable, "-c", code], env=env).strip()
+
+def test_native_values():
+    expression = create_expression()
+    pr = Protocall(Symbols({'xyz': 5}))
+    return pr.eval(expression)
+
+def test_live_proto():
+    a = protocall_pb2.Atom()
+    p = a.literal.proto
+    p.field.component.add().name = "Person"
+    p.value = 'id: 1 name: "Ann" person { id: 2 name: "Bob" }'
+    symbols = Symbols({'p': a})
+    person = symbols.lookup_local_key('p')
+    field = protocall_pb2.Field()
+    field.component.add().name = 'p'
+    field.component.add().name = 'person'
+    field.component.add().name = 'id'
+    symbols.add_local_symbol(field, 7)
+    assert symbols.lookup_local_key('p') is person
+    return symbols.lookup_local(field), box(person)
+
+def test_frames():
+    scope = resolve_block(create_while())
+    frame = scope.acquire()
+    frame['x'] = 3
+    frame['unused'] = 4
+    slots = list(frame.slots)
+    symbols = Symbols()
+    symbols.push_frame(frame)
+    x = symbols.lookup_local_key('x')
+    symbols.pop_frame()
+    scope.release(frame)
+    return scope, frame, slots, x
+
+def create_constant_program():
+    p = protocall_pb2.Block()
+
+    # y = 9 * (2 + 5)
+    s = p.statement.add()
+    s.assignment.field.component.add().name = 'y'
+    e = s.assignment.expression
+    e.arithmetic_operator.operator = protocall_pb2.ArithmeticOperator.Op.Value("MULTIPLY")
+    e.arithmetic_operator.left.atom.literal.integer.value = 9
+    e2 = e.arithmetic_operator.right.atom.expression
+    e2.arithmetic_operator.operator = protocall_pb2.ArithmeticOperator.Op.Value("PLUS")
+    e2.arithmetic_operator.left.atom.literal.integer.value = 2
+    e2.arithmetic_operator.right.atom.literal.integer.value = 5
+
+    # if (1 > 2) { y = 0; } else { y = y * 1; }
+    s = p.statement.add()
+    c = s.conditional
+    c.if_scope.expression.comparison_operator.operator = protocall_pb2.ComparisonOperator.Op.Value("GREATER_THAN")
+    c.if_scope.expression.comparison_operator.left.atom.literal.integer.value = 1
+    c.if_scope.expression.comparison_operator.right.atom.literal.integer.value = 2
+    s2 = c.if_scope.scope.block.statement.add()
+    s2.assignment.field.component.add().name = 'y'
+    s2.assignment.expression.atom.literal.integer.value = 0
+    s2 = c.else_scope.block.statement.add()
+    s2.assignment.field.component.add().name = 'y'
+    e = s2.assignment.expression
+    e.arithmetic_operator.operator = protocall_pb2.ArithmeticOperator.Op.Value("MULTIPLY")
+    e.arithmetic_operator.left.atom.field.component.add().name = 'y'
+    e.arithmetic_operator.right.atom.literal.integer.value = 1
+
+    # return y; y = 0;
+    s = p.statement.add()
+    s.return_.expression.atom.field.component.add().name = 'y'
+    s = p.statement.add()
+    s.assignment.field.component.add().name = 'y'
+    s.assignment.expression.atom.literal.integer.value = 0
+
+    return p
+
+def test_optimizer():
+    p = create_constant_program()
+    o = optimizer.optimize(p)
+    print "Optimized:"
+    print dump.dump(o)
+    return o
+
+def test_transpiler(p):
+    source = transpiler.transpile(p)
+    print "Module:"
+    print source
+    module = transpiler.load(source)
+    result = module.run()
+    print "Result:"
+    print result
+    return result
+
+def test_profiler(pr):
+    pr.profiler = Profiler()
+    result = pr.execute(create_define())
+    report = pr.profiler.report()
+    print report
+    return pr.profiler, report
+
+def create_nested_call(name):
+    p = protocall_pb2.Block()
+    s = p.statement.add()
+    s.define.field.component.add().name = "outer"
+    s.define.scope.block.statement.add().call.field.component.add().name = name
+    s = p.statement.add()
+    s.call.field.component.add().name = "outer"
+    return p
+
+def test_protocall_stack(pr):
+    stacks = []
+    def capture(arguments, symbols):
+        stacks.append(protocall_stack(sys._getframe()))
+    pr.builtins['capture'] = capture
+    pr.execute(create_nested_call('capture'))
+    return stacks
+
+# The stack seen by a builtin called from a UDF that a subr calls.
+def test_subr_stack(pr):
+    stacks = []
+    def capture(arguments, symbols):
+        stacks.append(protocall_stack(sys._getframe()))
+        return arguments[0][1]
+    pr.builtins['capture'] = capture
+    scope = pratt_parser.parse_scope("""{
+      define inner { return capture(x=x); };
+      return map(a={1}, f="inner");
+    }""")
+    pr.execute(scope.block)
+    return stacks
+
+def test_sampler():
+    def sleep(arguments, symbols):
+        time.sleep(0.05)
+    pr = Protocall()
+    pr.builtins['sleep'] = sleep
+    sampler = Sampler(rate=1000)
+    sampler.start()
+    pr.execute(create_nested_call('sleep'))
+    sampler.stop()
+    print "\n".join(sampler.collapsed())
+    return sampler
+
+def test_diagnostics(level, pr):
+    sink = diagnostics.ListSink()
+    diagnostics.configure(level, sink)
+    try:
+        result = pr.execute(create_block())
+    finally:
+        diagnostics.configure(diagnostics.WARNING, diagnostics.TextSink())
+    return result, [(r["level"], r["event"]) for r in sink.records], sink.records
+
+def create_failing_call():
+    p = protocall_pb2.Block()
+    s = p.statement.add()
+    s.define.field.component.add().name = "outer"
+    b = s.define.scope.block
+    s = b.statement.add()
+    s.assignment.field.component.add().name = 'y'
+    s.assignment.expression.atom.literal.integer.value = 2
+    s = b.statement.add()
+    s.assignment.field.component.add().name = 'z'
+    e = s.assignment.expression.arithmetic_operator
+    e.operator = protocall_pb2.ArithmeticOperator.Op.Value("DIVIDE")
+    e.left.atom.field.component.add().name = 'y'
+    e.right.atom.field.component.add().name = 'undefined'
+    s = p.statement.add()
+    s.assignment.field.component.add().name = 'a'
+    s.assignment.expression.call.field.component.add().name = 'outer'
+    arg = s.assignment.expression.call.argument.add()
+    arg.identifier.name = 'x'
+    arg.expression.atom.literal.integer.value = 1
+    return p
+
+def test_production(pr):
+    p = create_failing_call()
+    try:
+        pr.execute(p)
+    except ExecutionError as e:
+        return e, p.statement[0].define.scope.block.statement[1]
+
+def create_array_loop(n):
+    p = protocall_pb2.Block()
+
+    s = p.statement.add()
+    s.assignment.field.component.add().name = 'a'
+    array = s.assignment.expression.atom.literal.array
+    array.element.add().atom.literal.integer.value = 0
+    array.element.add().atom.literal.integer.value = 0
+
+    s = p.statement.add()
+    s.assignment.field.component.add().name = 'i'
+    s.assignment.expression.atom.literal.integer.value = 0
+
+    s = p.statement.add()
+    es = s.while_.expression_scope
+    e = es.expression
+    e.comparison_operator.left.atom.field.component.add().name = 'i'
+    e.comparison_operator.right.atom.literal.integer.value = n
+    e.comparison_operator.operator = protocall_pb2.ComparisonOperator.Op.Value("LESS_THAN")
+
+    # Inside while loop
+    s = es.scope.block.statement.add()
+    s.call.field.component.add().name = "append"
+    arg = s.call.argument.add()
+    arg.identifier.name = 'a'
+    arg.expression.atom.field.component.add().name = 'a'
+    arg = s.call.argument.add()
+    arg.identifier.name = 'v'
+    arg.expression.atom.field.component.add().name = 'i'
+
+    s = es.scope.block.statement.add()
+    s.array_assignment.array_ref.field.component.add().name = 'a'
+    s.array_assignment.array_ref.index.value = 1
+    s.array_assignment.expression.atom.field.component.add().name = 'i'
+
+    s = es.scope.block.statement.add()
+    s.assignment.field.component.add().name = 'i'
+    e = s.assignment.expression
+    e.arithmetic_operator.left.atom.field.component.add().name = 'i'
+    e.arithmetic_operator.right.atom.literal.integer.value = 1
+    e.arithmetic_operator.operator = protocall_pb2.ArithmeticOperator.Op.Value("PLUS")
+
+    s = p.statement.add()
+    s.return_.expression.atom.field.component.add().name = 'a'
+    return p
+
+# a = {1, 2, 3}; b = a[0]; a[0] = b + 1; return a;
+def create_packed_array():
+    p = protocall_pb2.Block()
+
+    s = p.statement.add()
+    s.assignment.field.component.add().name = 'a'
+    s.assignment.expression.atom.literal.integer_array.value.extend([1, 2, 3])
+
+    s = p.statement.add()
+    s.assignment.field.component.add().name = 'b'
+    s.assignment.expression.atom.array_ref.field.component.add().name = 'a'
+    s.assignment.expression.atom.array_ref.index.value = 0
+
+    s = p.statement.add()
+    s.array_assignment.array_ref.field.component.add().name = 'a'
+    s.array_assignment.array_ref.index.value = 0
+    e = s.array_assignment.expression
+    e.arithmetic_operator.left.atom.field.component.add().name = 'b'
+    e.arithmetic_operator.right.atom.literal.integer.value = 1
+    e.arithmetic_operator.operator = protocall_pb2.ArithmeticOperator.Op.Value("PLUS")
+
+    s = p.statement.add()
+    s.return_.expression.atom.field.component.add().name = 'a'
+    return p
+
+# a = {0, ..., n - 1}; return filter(a=a, mask=a * 2 > n);
+def create_filter(n):
+    p = protocall_pb2.Block()
+
+    s = p.statement.add()
+    s.assignment.field.component.add().name = 'a'
+    s.assignment.expression.atom.literal.integer_array.value.extend(range(n))
+
+    s = p.statement.add()
+    call = s.return_.expression.call
+    call.field.component.add().name = 'filter'
+    arg = call.argument.add()
+    arg.identifier.name = 'a'
+    arg.expression.atom.field.component.add().name = 'a'
+    arg = call.argument.add()
+    arg.identifier.name = 'mask'
+    e = arg.expression.comparison_operator
+    e.operator = protocall_pb2.ComparisonOperator.Op.Value("GREATER_THAN")
+    e.left.arithmetic_operator.operator = protocall_pb2.ArithmeticOperator.Op.Value("MULTIPLY")
+    e.left.arithmetic_operator.left.atom.field.component.add().name = 'a'
+    e.left.arithmetic_operator.right.atom.literal.integer.value = 2
+    e.right.atom.literal.integer.value = n
+    return p
+
+def test_elementwise():
+    n = operators.NUMPY_THRESHOLD * 2
+    ints = range(-n, n)
+    nonzero = [i or 1 for i in ints]
+    floats = [i / 4.0 + 0.125 for i in ints]
+    mixed = [i if i % 2 else i / 2.0 for i in ints]
+    cases = [(ints, nonzero), (ints, 3), (-7, nonzero), (floats, 0.5), (mixed, nonzero),
+             (ints, floats), ([2 ** 40] * len(ints), nonzero), (ints[:4], nonzero[:4])]
+    results = []
+    for left, right in cases:
+        for function in operators.arithmetic_operators.values() + operators.comparison_operators.values():
+            results.append(function(left, right))
+    return results
+
+pipeline_program = """{
+  define square { return x * x; };
+  define odd { return ((x / 2) * 2) < x; };
+  define add { return acc + x; };
+  a = {1, 2, 3, 4, 5};
+  return reduce(a=filter(a=map(a=a, f="square"), f="odd"), f="add", initial=0);
+}"""
+
+# Returns the order in which the stages of map(a=..., f="first") filtered
+# by f="second" see the elements.
+def test_pipeline_order(pr):
+    calls = []
+    def first(arguments, symbols):
+        calls.append(("first", arguments[0][1]))
+        return arguments[0][1]
+    def second(arguments, symbols):
+        calls.append(("second", arguments[0][1]))
+        return True
+    pr.builtins['first'] = first
+    pr.builtins['second'] = second
+    scope = pratt_parser.parse_scope('{ return filter(a=map(a={1, 2}, f="first"), f="second"); }')
+    assert unbox(pr.execute(scope.block)) == [1, 2]
+    return calls
+
+# Runs four calls of a fake remote service, each taking latency seconds,
+# as spawned tasks.  Returns the sum of their results and the time taken.
+def test_tasks(pr, latency):
+    def fetch(arguments, symbols):
+        time.sleep(latency)
+        return arguments[0][1] * 2
+    pr.builtins['fetch'] = fetch
+    scope = pratt_parser.parse_scope("""{
+      a = spawn(f="fetch", x=1);
+      b = spawn(f="fetch", x=2);
+      c = spawn(f="fetch", x=3);
+      d = spawn(f="fetch", x=4);
+      return await(t=a) + await(t=b) + await(t=c) + await(t=d);
+    }""")
+    start = time.time()
+    result = unbox(pr.execute(scope.block))
+    return result, time.time() - start
+
+# Tasks that spawn and await tasks of their own, three levels deep.
+nested_tasks_program = """{
+  define leaf { return x * 2; };
+  define middle { t = spawn(f="leaf", x=x); return await(t=t) + 1; };
+  define top { t = spawn(f="middle", x=x); u = spawn(f="middle", x=x + 1); return await(t=t) + await(t=u); };
+  a = spawn(f="top", x=1);
+  b = spawn(f="top", x=10);
+  return await(t=a) + await(t=b);
+}"""
+
+# A fake People service whose Older method returns the person a year older
+# after latency seconds.  Counts the RpcRequests it handles.
+def create_people_server(latency=0):
+    def older(person):
+        time.sleep(latency)
+        person.id += 1
+        return person
+    server = services.Server()
+    server.add_method("People.Older", test_pb2.Person, test_pb2.Person, older)
+    server.rpc_requests = 0
+    handle = server.handle
+    def counting_handle(data, start=None):
+        server.rpc_requests += 1
+        return handle(data, start)
+    server.handle = counting_handle
+    return server
+
+# Calls People.Older from count threads at once.
+def test_concurrent_calls(s, count):
+    results = [None] * count
+    def call(i):
+        results[i] = s.call("People.Older", [("id", i), ("name", "x")]).id
+    threads = [threading.Thread(target=call, args=(i,)) for i in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+udf_server_program = """{
+  define older { request.id = request.id + 1; return request; };
+  define slow {
+    i = 0;
+    while (i < 20000) { i = i + 1; };
+    request.id = i;
+    return request;
+  };
+  define wrong { return 1; };
+}"""
+
+def create_udf_server(workers=2, max_queue=2, engine=COMPILED):
+    block = pratt_parser.parse_scope(udf_server_program).block
+    udf_server = server.UdfServer(block, workers=workers, max_queue=max_queue, engine=engine)
+    udf_server.add_method("People.Older", "older", test_pb2.Person, test_pb2.Person)
+    udf_server.add_method("People.Slow", "slow", test_pb2.Person, test_pb2.Person)
+    udf_server.add_method("People.Wrong", "wrong", test_pb2.Person, test_pb2.Person)
+    return udf_server
+
+def make_person(i):
+    person = test_pb2.Person()
+    person.id = i
+    person.name = "x"
+    return person
+
+# Calls f(x=x) through cache and returns the names of the calls made.
+def test_cache_calls(cache, xs):
+    made = []
+    def f(name, args):
+        made.append(args[0][1])
+        return "v" * 40
+    for x in xs:
+        assert cache.call("f", [("x", x)], f) == "v" * 40
+    return made
+
 class RuntimeTest(unittest.TestCase):
 
   def testEvaluate(self):
     assert test_evaluate().literal.integer.value == 90
 
   def testEvaluateArray(self):
-    assert test_evaluate_array().literal.array.element[0].atom.literal.integer.value == 10
+    assert list(test_evaluate_array().literal.integer_array.value) == [10]
 
   def testExecute(self):
     assert test_execute().atom.literal.integer.value == 135
@@ -528,5 +1015,530 @@ class RuntimeTest(unittest.TestCase):
   def testEvaluateProtoExpression(self):
     assert test_evaluate_proto_expression().literal.integer.value == 90
 
+  def testCompiledEngine(self):
+    assert test_compiled(create_block()).atom.literal.integer.value == 135
+    assert test_compiled(create_conditional(literal_false, literal_true)).atom.literal.integer.value == 20
+    assert test_compiled(create_conditional_expression(2, 1, "GREATER_THAN")).atom.literal.integer.value == 10
+    assert test_compiled(create_call3()).atom.literal.integer.value == 6
+    assert test_compiled(create_define()).atom.literal.integer.value == 8
+    assert test_compiled(create_program()).atom.literal.integer.value == 0
+    assert test_compiled(create_while()) == test_while()
+
+  def testCompiledCache(self):
+    # The program and the double_udf body are each compiled exactly once.
+    pr = test_compiled_cache()
+    assert len(pr.compiled) == 1
+    assert len(pr.compiled_functions) == 1
+
+  def testStackVM(self):
+    for create in (create_block, create_call2, create_call3, create_define, create_program):
+      assert test_stack_vm(create()) == Protocall().execute(create())
+    assert test_stack_vm(create_conditional(literal_false, literal_false)).atom.literal.integer.value == 30
+    assert test_stack_vm(create_conditional_expression(1, 2, "LESS_THAN")).atom.literal.integer.value == 10
+    assert test_stack_vm(create_while()) == test_while()
+
+  def testStackVMSerialized(self):
+    assert test_stack_vm_serialized(create_define()).atom.literal.integer.value == 8
+    assert test_stack_vm_serialized(create_program()).atom.literal.integer.value == 0
+
+  def testNativeValues(self):
+    assert test_native_values() == 90
+    assert unbox(box(7)) == 7
+    assert unbox(box("seven")) == "seven"
+    assert unbox(literal_true) is True
+    # Small integers and booleans box to shared constants.
+    assert box(7) is box(3 + 4)
+    assert box(1 == 1) is atom_true
+    assert box(100000).literal.integer.value == 100000
+
+  def testFrames(self):
+    scope, frame, slots, x = test_frames()
+    assert scope.names == ['x']
+    assert slots == [3]
+    assert x == 3
+    # Released frames are cleared and handed out again.
+    assert 'x' not in frame and 'unused' not in frame
+    assert scope.acquire() is frame
+
+  def testReturn(self):
+    # Statements after a return_ are not executed, in every engine.
+    p = create_constant_program()
+    assert Protocall().execute(p).atom.literal.integer.value == 63
+    assert Protocall(engine=COMPILED).execute(p).atom.literal.integer.value == 63
+    assert StackVM().execute(p).atom.literal.integer.value == 63
+
+  def testOptimizer(self):
+    o = test_optimizer()
+    assert len(o.statement) == 3
+    assert o.statement[0].assignment.expression.atom.literal.integer.value == 63
+    # y * 1 is kept, since y could be an array or a boolean.
+    assert o.statement[1].assignment.expression.arithmetic_operator.left.atom.field.component[0].name == 'y'
+    assert o.statement[2].HasField("return_")
+    p = create_constant_program()
+    assert optimizer.optimize_string(p.SerializeToString()) == o.SerializeToString()
+    assert Protocall(optimize=True).execute(p) == Protocall().execute(p)
+    for text, expected in (("{ a = {1, 2, 3}; b = a * 1; b[0] = 9; return a; }", [1, 2, 3]),
+                           ("{ a = {1, 2, 3}; b = 0 + a; b[0] = 9; return a; }", [1, 2, 3]),
+                           ("{ t = true; return t + 0; }", 1)):
+      block = pratt_parser.parse_scope(text).block
+      for pr in (Protocall(optimize=True), Protocall(engine=COMPILED, optimize=True), StackVM(optimize=True)):
+        result = unbox(pr.execute(block))
+        assert result == expected and type(result) is type(expected)
+
+  def testTranspiler(self):
+    for create in (create_block, create_call2, create_call3, create_define, create_program, create_constant_program):
+      assert box(test_transpiler(create())) == Protocall().execute(create()).atom
+    assert test_transpiler(create_conditional(literal_false, literal_true)) == 20
+    assert test_transpiler(create_conditional_expression(2, 1, "GREATER_THAN")) == 10
+    assert test_transpiler(create_while()) is None
+    # Unbound variables fail with KeyError, as in the runtime.
+    block = pratt_parser.parse_scope("{ define f { return y + 1; }; return f(x=1); }").block
+    module = transpiler.load(transpiler.transpile(block))
+    self.assertRaises(KeyError, module.run)
+    try:
+      Protocall(production=True).execute(block)
+      assert False
+    except ExecutionError as e:
+      assert e.report.error_type == "KeyError"
+    block = pratt_parser.parse_scope("{ p.id = 1; return 0; }").block
+    module = transpiler.load(transpiler.transpile(block))
+    self.assertRaises(KeyError, module.run)
+    block = pratt_parser.parse_scope('{ return People.Older(id=1, name="x"); }').block
+    self.assertRaises(RuntimeError, transpiler.transpile, block)
+
+  def testProfiler(self):
+    for pr in (Protocall(), Protocall(engine=COMPILED)):
+      profiler, report = test_profiler(pr)
+      assert profiler.udfs['double_udf'].count == 1
+      # The define, the call and the return_ inside double_udf.
+      assert len(profiler.statements) == 3
+      assert 'double_udf(x=4);' in report
+    profiler, report = test_profiler(StackVM())
+    assert profiler.udfs['double_udf'].count == 1
+    h = Histogram()
+    for seconds in (0.000001, 0.000003, 0.000003, 0.1):
+      h.add(seconds)
+    assert h.buckets[0] == 1 and h.buckets[2] == 2
+    assert h.percentile(0.5) == 0.000004
+    assert h.percentile(1.0) == 0.1
+
+  def testSampler(self):
+    for pr in (Protocall(), Protocall(engine=COMPILED), StackVM()):
+      assert test_protocall_stack(pr) == [('program', 'outer', 'capture')]
+      assert test_subr_stack(pr) == [('program', 'map', 'inner', 'capture')]
+    assert protocall_stack(sys._getframe()) is None
+    sampler = test_sampler()
+    assert sampler.samples[('program', 'outer', 'sleep')] > 0
+    assert sampler.collapsed()[-1].startswith('program;outer;sleep ')
+
+  def testMicroBenchmark(self):
+    baseline = {'a': [1.0, 1.1, 0.9, 1.05, 0.95] * 3, 'b': [1.0, 1.1, 0.9, 1.05, 0.95] * 3}
+    results = {'a': [2.0, 2.1, 1.9, 2.05, 1.95] * 3, 'b': [1.0, 1.1, 0.9, 1.05, 0.95] * 3, 'c': [1.0]}
+    rows = micro_benchmark.compare(baseline, results)
+    assert [row[0] for row in rows] == ['a', 'b']
+    assert rows[0][5] == 'regression' and rows[0][4] < 0.001
+    assert rows[1][5] == '' and rows[1][4] == 1.0
+    assert micro_benchmark.compare(results, baseline)[0][5] == 'improvement'
+    names = [name for name, setup in micro_benchmark.benchmarks]
+    assert 'invoke_udf' in names and 'symbols_lookup_depth_100' in names
+    for name, setup in micro_benchmark.benchmarks:
+      setup()()
+
+  def testDiagnostics(self):
+    for engine in ("interpreted", COMPILED):
+      result, events, records = test_diagnostics("warning", Protocall(engine=engine))
+      assert events == []
+      result, events, records = test_diagnostics("debug", Protocall(engine=engine))
+      assert result.atom.literal.integer.value == 135
+      assert events == [(diagnostics.DEBUG, "statement")] * 2
+      result, events, records = test_diagnostics(diagnostics.TRACE, Protocall(engine=engine))
+      assert events == [(diagnostics.DEBUG, "statement"), (diagnostics.TRACE, "assignment"),
+                        (diagnostics.DEBUG, "statement")]
+      assert records[1]["fields"]["value"] == 12
+    stream = StringIO.StringIO()
+    diagnostics.JsonSink(stream)(records[1])
+    record = json.loads(stream.getvalue())
+    assert record["level"] == "TRACE"
+    assert record["fields"]["field"] == 'component { name: "x" }'
+    # A bad PROTOCALL_LOG keeps the default level and warns.
+    self.assertRaises(ValueError, diagnostics.configure, "loud")
+    sink = diagnostics.ListSink()
+    diagnostics.configure(diagnostics.WARNING, sink)
+    try:
+      diagnostics.configure_from_environment({"PROTOCALL_LOG": "loud"})
+      assert diagnostics.threshold == diagnostics.WARNING
+      assert [r["event"] for r in sink.records] == ["bad_protocall_log"]
+    finally:
+      diagnostics.configure(diagnostics.WARNING, diagnostics.TextSink())
+
+  def testProduction(self):
+    for pr in (Protocall(production=True), Protocall(engine=COMPILED, production=True),
+               StackVM(production=True)):
+      e, statement = test_production(pr)
+      report = parse_report(e.serialize())
+      assert report.error_type == 'KeyError'
+      assert list(report.call_stack) == ['outer']
+      assert report.statement == statement
+      assert dict((l.name, unbox(l.value)) for l in report.local) == {'x': 1, 'y': 2}
+      # The failed call's frame is gone and the instance can run again.
+      assert len(pr.symbols.stack) == 1
+      assert pr.execute(create_define()).atom.literal.integer.value == 8
+
+  def testArrays(self):
+    expected = [0, 9999] + range(10000)
+    for pr in (Protocall(), Protocall(engine=COMPILED), StackVM()):
+      atom = pr.execute(create_array_loop(10000)).atom
+      # Arrays are only turned into Array protos when they are boxed.
+      assert len(atom.literal.integer_array.value) == 10002
+      assert unbox(atom) == expected
+    assert test_transpiler(create_array_loop(10000)) == expected
+    assert list(box([1, "a", [2]]).literal.array.element[2].atom.literal.integer_array.value) == [2]
+
+  def testPackedArrays(self):
+    p = create_packed_array()
+    for pr in (Protocall(), Protocall(engine=COMPILED), StackVM()):
+      # Every run starts from the literal, not from the last run's list.
+      for i in range(2):
+        assert unbox(pr.execute(p)) == [2, 2, 3]
+    assert unbox(test_stack_vm_serialized(p)) == [2, 2, 3]
+    assert test_transpiler(p) == [2, 2, 3]
+    assert dump.dump_expression(p.statement[0].assignment.expression) == "{1, 2, 3}"
+    assert list(box(range(1000)).literal.integer_array.value) == range(1000)
+    assert list(box([0.5, 1.5]).literal.double_array.value) == [0.5, 1.5]
+    assert box([1, "a"]).literal.HasField("array")
+    assert box([True, False]).literal.HasField("array")
+    assert list(box([1L, 2 ** 40]).literal.integer_array.value) == [1, 2 ** 40]
+    # A packed literal stays packed through a variable and return.
+    scope = pratt_parser.parse_scope("{ a = {1, 2, 3}; return a; }")
+    for pr in (Protocall(), Protocall(engine=COMPILED), StackVM()):
+      assert list(pr.execute(scope.block).atom.literal.integer_array.value) == [1, 2, 3]
+    packed = len(box(range(1000)).SerializeToString())
+    assert packed * 4 < len(box(range(999) + ["x"]).SerializeToString())
+
+  def testElementwise(self):
+    assert operators.plus([1, 2], [10, 20]) == [11, 22]
+    assert operators.divide([7, -7], 2) == [3, -4]
+    assert operators.less_than(2, [1, 2, 3]) == [False, False, True]
+    assert operators.equals([1, "a"], "a") == [False, True]
+    self.assertRaises(ValueError, operators.plus, [1, 2], [1])
+    self.assertRaises(ZeroDivisionError, operators.divide, range(100), 0)
+    # NumPy, when it is installed, gives exactly the pure Python results.
+    numpy = operators.numpy
+    vectorized = test_elementwise()
+    operators.numpy = None
+    try:
+      assert test_elementwise() == vectorized
+    finally:
+      operators.numpy = numpy
+    for pr in (Protocall(), Protocall(engine=COMPILED), StackVM()):
+      assert unbox(pr.execute(create_filter(100))) == range(51, 100)
+    assert test_transpiler(create_filter(100)) == range(51, 100)
+
+  def testPipeline(self):
+    block = pratt_parser.parse_scope(pipeline_program).block
+    for pr in (Protocall(), Protocall(engine=COMPILED), StackVM()):
+      assert unbox(pr.execute(block)) == 35
+      # The stages run element by element, not one after the other.
+      assert test_pipeline_order(pr) == [("first", 1), ("second", 1), ("first", 2), ("second", 2)]
+    assert test_transpiler(block) == 35
+
+  def testParallelMap(self):
+    scope = pratt_parser.parse_scope("""{
+      define square { return x * x; };
+      return parallel_map(a={1, 2, 3, 4, 5, 6, 7}, f="square", processes=2);
+    }""")
+    for pr in (Protocall(), Protocall(engine=COMPILED), StackVM()):
+      assert unbox(pr.execute(scope.block)) == [1, 4, 9, 16, 25, 36, 49]
+    # The pool, and the UDFs its workers were given, are reused.
+    pool = parallel.current
+    assert unbox(StackVM().execute(scope.block)) == [1, 4, 9, 16, 25, 36, 49]
+    assert parallel.current is pool
+    # Unchanged UDFs are not serialized again.
+    pr = Protocall()
+    pr.execute(scope.block)
+    serialized = parallel.serialized
+    pr.execute(scope.block)
+    assert parallel.serialized is serialized
+    # Calls with different UDFs at once each keep their own pool.
+    cube = pratt_parser.parse_scope("""{
+      define cube { return x * x * x; };
+      return parallel_map(a={1, 2, 3, 4, 5, 6, 7}, f="cube", processes=2);
+    }""")
+    results = {}
+    def run(name, block):
+      for i in range(3):
+        results[name, i] = unbox(Protocall().execute(block))
+    threads = [threading.Thread(target=run, args=("square", scope.block)),
+               threading.Thread(target=run, args=("cube", cube.block))]
+    for thread in threads:
+      thread.start()
+    for thread in threads:
+      thread.join()
+    assert [results["square", i] for i in range(3)] == [[1, 4, 9, 16, 25, 36, 49]] * 3
+    assert [results["cube", i] for i in range(3)] == [[1, 8, 27, 64, 125, 216, 343]] * 3
+    parallel.close_pool()
+    assert parallel.current is None
+    # Importing vm first still lists every subr for the bytecode compiler.
+    assert test_subrs_after_vm() == "[1, 4, 9]"
+    e = ExecutionError(parse_report(test_production(Protocall(production=True))[0].serialize()))
+    assert pickle.loads(pickle.dumps(e)).report == e.report
+
+  def testTasks(self):
+    for pr in (Protocall(concurrency=4), Protocall(engine=COMPILED, concurrency=4), StackVM(concurrency=4)):
+      result, seconds = test_tasks(pr, 0.2)
+      assert result == 2 + 4 + 6 + 8
+      # The four calls overlap.
+      assert seconds < 0.6
+    result, seconds = test_tasks(Protocall(concurrency=1), 0.1)
+    assert seconds >= 0.4
+    pr = Protocall(concurrency=1)
+    pr.udfs['fail'] = create_failing_call().statement[0].define.scope.block
+    task = tasks.start(pr, 'fail', [('x', 1)])
+    self.assertRaises(ExecutionError, task.wait)
+    # Nesting deeper than the concurrency limit does not deadlock: tasks that
+    # await unstarted tasks run them.
+    block = pratt_parser.parse_scope(nested_tasks_program).block
+    for pr in (Protocall(concurrency=1), Protocall(engine=COMPILED, concurrency=2), StackVM(concurrency=1)):
+      assert unbox(pr.execute(block)) == (3 + 5) + (21 + 23)
+    # The tasks' UDFs were compiled into the parent's table.
+    pr = Protocall(engine=COMPILED, concurrency=2)
+    pr.execute(block)
+    assert set(id(udf) for udf in pr.udfs.values()) <= set(pr.compiled_functions)
+
+  def testServices(self):
+    server = create_people_server()
+    s = services.Services()
+    s.add_method("People.Older", test_pb2.Person, test_pb2.Person, services.LoopbackChannel(server))
+    scope = pratt_parser.parse_scope("""{
+      p = People.Older(id=41, name="Ann");
+      q = People.Older(p=p);
+      return q.id;
+    }""")
+    for pr in (Protocall(services=s), Protocall(engine=COMPILED, services=s), StackVM(services=s)):
+      assert unbox(pr.execute(scope.block)) == 43
+
+    # Over a socket, calls one after another share one kept-alive connection.
+    listener = services.serve_socket(server)
+    try:
+      pool = services.ChannelPool(lambda: services.SocketChannel(listener.server_address), size=4)
+      s = services.Services()
+      s.add_method("People.Older", test_pb2.Person, test_pb2.Person, pool, timeout=5)
+      for i in range(5):
+        assert s.call("People.Older", [("id", i), ("name", "x")]).id == i + 1
+      assert pool.opened == 1
+      assert test_concurrent_calls(s, 4) == [1, 2, 3, 4]
+    finally:
+      listener.shutdown()
+
+  def testServiceBatchingAndTimeouts(self):
+    server = create_people_server()
+    s = services.Services()
+    s.add_method("People.Older", test_pb2.Person, test_pb2.Person, services.LoopbackChannel(server),
+                 batch=True, batch_window=0.2)
+    assert test_concurrent_calls(s, 4) == [1, 2, 3, 4]
+    assert server.rpc_requests == 1
+
+    s = services.Services()
+    s.add_method("People.Older", test_pb2.Person, test_pb2.Person,
+                 services.LoopbackChannel(create_people_server(latency=0.5)), timeout=0.05)
+    self.assertRaises(services.DeadlineExceeded, s.call, "People.Older", [("id", 1), ("name", "x")])
+    s.add_method("People.Missing", test_pb2.Person, test_pb2.Person, services.LoopbackChannel(server))
+    self.assertRaises(services.RpcError, s.call, "People.Missing", [("id", 1), ("name", "x")])
+
+    # A request that waited past its deadline in the server's queue fails
+    # without running.
+    slow = create_people_server(latency=0.3)
+    slow.tasks = tasks.TaskPool(1)
+    rpc = services.rpc_pb2.RpcRequest()
+    rpc.method = "People.Older"
+    rpc.request.append(make_person(1).SerializeToString())
+    busy = slow.submit(rpc.SerializeToString())
+    rpc.timeout = 0.1
+    late = services.rpc_pb2.RpcResponse.FromString(slow.submit(rpc.SerializeToString()).wait())
+    assert late.result[0].deadline_exceeded
+    busy.wait()
+    # So does a call that waits too long for a free channel.
+    pool = services.ChannelPool(lambda: services.LoopbackChannel(create_people_server(latency=0.3)), size=1)
+    patient = services.Services()
+    patient.add_method("People.Older", test_pb2.Person, test_pb2.Person, pool, timeout=5)
+    hasty = services.Services()
+    hasty.add_method("People.Older", test_pb2.Person, test_pb2.Person, pool, timeout=0.05)
+    thread = threading.Thread(target=patient.call, args=("People.Older", [("id", 1), ("name", "x")]))
+    thread.start()
+    time.sleep(0.05)
+    start = time.time()
+    self.assertRaises(services.DeadlineExceeded, hasty.call, "People.Older", [("id", 1), ("name", "x")])
+    assert time.time() - start < 0.2
+    thread.join()
+
+    # Failing to connect closes the channel, and a connect that times out is
+    # a DeadlineExceeded.
+    listener = socket.socket()
+    listener.bind(("127.0.0.1", 0))
+    channel = services.SocketChannel(listener.getsockname())
+    listener.close()
+    self.assertRaises(socket.error, channel.call, "", 1)
+    assert channel.sock is None
+    def create_connection(address, timeout):
+      raise socket.timeout("timed out")
+    connect = services.socket.create_connection
+    services.socket.create_connection = create_connection
+    try:
+      self.assertRaises(services.DeadlineExceeded, channel.call, "", 0.05)
+    finally:
+      services.socket.create_connection = connect
+    assert channel.sock is None
+    self.assertRaises(KeyError, Protocall().call_service, "People.Older", [])
+
+  def testLiveProto(self):
+    id_, atom = test_live_proto()
+    assert id_ == 7
+    # The Proto.value text is only produced when the message is boxed.
+    assert atom.literal.proto.field.component[0].name == "Person"
+    assert 'id: 7' in atom.literal.proto.value
+
+  def testUdfServer(self):
+    for engine in ("interpreted", COMPILED):
+      udf_server = create_udf_server(engine=engine)
+      s = services.Services()
+      for name in ("People.Older", "People.Wrong"):
+        s.add_method(name, test_pb2.Person, test_pb2.Person, services.LoopbackChannel(udf_server))
+      assert test_concurrent_calls(s, 4) == [1, 2, 3, 4]
+      scope = pratt_parser.parse_scope("""{
+        p = People.Older(id=41, name="Ann");
+        q = People.Older(p=p);
+        return q.id;
+      }""")
+      assert unbox(Protocall(services=s).execute(scope.block)) == 43
+      self.assertRaises(services.RpcError, s.call, "People.Wrong", [("id", 1), ("name", "x")])
+      # The worker that failed still serves requests.
+      assert test_concurrent_calls(s, 4) == [1, 2, 3, 4]
+      metrics = udf_server.metrics.snapshot()
+      assert metrics["completed"] == metrics["accepted"] == 11
+      assert metrics["in_flight"] == metrics["queued"] == 0
+      udf_server.close()
+    self.assertRaises(KeyError, create_udf_server().add_method, "People.Missing", "missing",
+                      test_pb2.Person, test_pb2.Person)
+
+    udf_server = create_udf_server()
+    listener = services.serve_socket(udf_server)
+    try:
+      s = services.Services()
+      s.add_method("People.Older", test_pb2.Person, test_pb2.Person,
+                   services.SocketChannel(listener.server_address), timeout=5)
+      assert s.call("People.Older", [("id", 1), ("name", "x")]).id == 2
+    finally:
+      listener.shutdown()
+
+  def testUdfServerAdmission(self):
+    udf_server = create_udf_server(workers=1, max_queue=1)
+    result = server.load_test(udf_server, "People.Slow", make_person, calls=16, clients=8)
+    assert result.calls == 16
+    assert result.ok + result.overloaded == 16
+    assert result.ok >= 2 and result.overloaded >= 1
+    metrics = udf_server.metrics.snapshot()
+    assert metrics["rejected"] == result.overloaded
+    assert metrics["completed"] == result.ok
+    # Admitted requests wait until the worker picks them up.
+    assert metrics["max_queued"] <= 2
+    assert udf_server.metrics.lines() and result.lines()
+    udf_server.close()
+
+  def testCallCache(self):
+    people = create_people_server()
+    s = services.Services()
+    s.add_method("People.Older", test_pb2.Person, test_pb2.Person, services.LoopbackChannel(people))
+    cache = CallCache(["People.Older", "double"])
+    scope = pratt_parser.parse_scope("""{
+      i = 0;
+      while (i < 5) {
+        p = People.Older(id=41, name="Ann");
+        p.id = 0;
+        i = i + 1;
+      };
+      p = People.Older(id=41, name="Ann");
+      return p.id + double(x=i) + double(x=5);
+    }""")
+    for pr in (Protocall(services=s, cache=cache), Protocall(engine=COMPILED, services=s, cache=cache),
+               StackVM(services=s, cache=cache)):
+      # Changing a response does not change the cached one.
+      assert unbox(pr.execute(scope.block)) == 62
+    assert people.rpc_requests == 1
+    stats = cache.stats()
+    assert stats["misses"] == 2
+    assert stats["hits"] == 3 * 8 - 2
+    assert stats["entries"] == 2
+
+    # Identical concurrent calls share one request.
+    people = create_people_server(latency=0.2)
+    s = services.Services()
+    s.add_method("People.Older", test_pb2.Person, test_pb2.Person, services.LoopbackChannel(people))
+    pr = Protocall(services=s, cache=CallCache(["People.Older"]))
+    results = []
+    def call():
+      results.append(pr.call_service("People.Older", [("id", 1), ("name", "x")]).id)
+    threads = [threading.Thread(target=call) for i in range(4)]
+    for thread in threads:
+      thread.start()
+    for thread in threads:
+      thread.join()
+    assert results == [2, 2, 2, 2]
+    assert people.rpc_requests == 1
+    assert pr.cache.stats()["shared"] == 3
+
+    # Non-ASCII strings and messages, whose names come from the proto as
+    # unicode, make keys too.
+    people = create_people_server()
+    s = services.Services()
+    s.add_method("People.Older", test_pb2.Person, test_pb2.Person, services.LoopbackChannel(people))
+    echoes = []
+    def echo(arguments, symbols):
+      echoes.append(arguments[0][1])
+      return arguments[0][1]
+    scope = pratt_parser.parse_scope(u"""{
+      a = echo(x="h\xe9");
+      b = echo(x="h\xe9");
+      p = People.Older(id=200, name="x");
+      q = People.Older(p=p);
+      r = People.Older(p=p);
+      return r.id;
+    }""")
+    for pr in (Protocall(production=True), Protocall(engine=COMPILED, production=True),
+               StackVM(production=True)):
+      pr.services = s
+      pr.cache = CallCache(["echo", "People.Older"])
+      pr.builtins["echo"] = echo
+      assert unbox(pr.execute(scope.block)) == 202
+      assert pr.cache.stats()["hits"] == 2
+    assert len(echoes) == 3 and people.rpc_requests == 6
+
+  def testCallCacheEviction(self):
+    now = [0.0]
+    cache = CallCache(["f"], max_entries=2, ttl=10, clock=lambda: now[0])
+    assert test_cache_calls(cache, [1, 2, 1, 3, 2]) == [1, 2, 3, 2]
+    assert cache.stats()["evictions"] == 2
+    now[0] = 11
+    assert test_cache_calls(cache, [2]) == [2]
+    assert cache.stats()["expirations"] == 1
+
+    cache = CallCache(["f"], max_bytes=80)
+    assert test_cache_calls(cache, [1, 2, 2, 1]) == [1, 2, 1]
+    assert cache.stats()["bytes"] <= 80
+    assert test_cache_calls(CallCache(["f"], max_bytes=10), [1, 1]) == [1, 1]
+
+    # Messages are keyed by content; tasks cannot be keyed.
+    cache = CallCache(["f"])
+    assert test_cache_calls(cache, [make_person(1), make_person(1), [1, 2], [1, 2], [1, "2"]]) == [
+        make_person(1), [1, 2], [1, "2"]]
+    assert test_cache_calls(cache, [tasks.Task()] * 2) and cache.stats()["uncacheable"] == 2
+    # str and unicode with the same text are the same argument.
+    assert test_cache_calls(cache, ["abc", u"abc", u"\xe9", "\xc3\xa9", "\xff", u"\xff"]) == [
+        "abc", u"\xe9", "\xff", u"\xff"]
+    # Errors are not cached.
+    def fail(name, args):
+      raise ValueError(name)
+    self.assertRaises(ValueError, cache.call, "f", [("x", 9)], fail)
+    assert test_cache_calls(cache, [9]) == [9]
+
 if __name__ == '__main__':
   unittest.main()
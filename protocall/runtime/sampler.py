@@ -0,0 +1,125 @@
+# Copyright 2016 Google Inc. All Rights Reserved.
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import sys
+import thread
+import threading
+import types
+import subrs
+from vm import Protocall
+from stack_vm import StackVM
+
+# A sampling profiler for protocall programs.  A background thread wakes up
+# rate times a second, looks at the Python stack of the thread running the
+# program and reduces it to the protocall call stack: the UDFs, builtins
+# and subrs being run.  Nothing is added to the engines, so the program
+# pays only for the samples themselves, and a low rate keeps the sampler
+# cheap enough to leave on.
+#
+# Samples are written in the collapsed stack format read by flamegraph.pl:
+# one "program;f;g count" line per distinct stack.
+
+ROOT = "program"
+
+execute_code = Protocall.execute.im_func.func_code
+run_function_code = Protocall.run_function.im_func.func_code
+run_program_code = StackVM.run_program.im_func.func_code
+stack_run_function_code = StackVM.run_function.im_func.func_code
+
+subr_codes = dict((getattr(subrs, name).func_code, name) for name in dir(subrs)
+                  if isinstance(getattr(subrs, name), types.FunctionType))
+
+# Returns the protocall call stack of a Python frame, outermost first, or
+# None if the frame is not running a protocall program.  UDFs and builtins
+# are found in Protocall.run_function, which every engine calls them
+# through, except for StackVM UDFs, which are read from run_program's own
+# frame stack.  A StackVM UDF called by a subr runs in a run_program of its
+# own, whose bottom frame is named by the StackVM.run_function that started
+# it.
+def protocall_stack(frame):
+  names = []
+  running = False
+  inner = None
+  while frame is not None:
+    code = frame.f_code
+    if code is run_function_code:
+      names.append(frame.f_locals["name"])
+    elif code is stack_run_function_code:
+      # Builtins are passed on to, and named by, Protocall.run_function.
+      if inner is not run_function_code:
+        names.append(frame.f_locals["name"])
+    elif code is run_program_code:
+      running = True
+      f_locals = frame.f_locals
+      frames = f_locals.get("frames")
+      if frames:
+        names.append(f_locals["frame"].code.name)
+        names.extend(f.code.name for f in reversed(frames[1:]))
+    elif code is execute_code:
+      running = True
+    elif code in subr_codes:
+      names.append(subr_codes[code])
+    inner = code
+    frame = frame.f_back
+  if not running:
+    return None
+  names.append(ROOT)
+  names.reverse()
+  return tuple(names)
+
+class Sampler:
+  def __init__(self, rate=100, thread_id=None):
+    self.interval = 1.0 / rate
+    # Samples the thread that creates the Sampler unless told otherwise.
+    if thread_id is None:
+      thread_id = thread.get_ident()
+    self.thread_id = thread_id
+    # Keyed by stack tuple.
+    self.samples = {}
+    self.stopped = threading.Event()
+    self.thread = None
+
+  def start(self):
+    self.stopped.clear()
+    self.thread = threading.Thread(target=self.run, name="protocall-sampler")
+    self.thread.daemon = True
+    self.thread.start()
+
+  def stop(self):
+    self.stopped.set()
+    if self.thread is not None:
+      self.thread.join()
+      self.thread = None
+
+  def run(self):
+    while not self.stopped.wait(self.interval):
+      self.sample()
+
+  def sample(self):
+    frame = sys._current_frames().get(self.thread_id)
+    if frame is None:
+      return
+    stack = protocall_stack(frame)
+    del frame
+    if stack is not None:
+      self.samples[stack] = self.samples.get(stack, 0) + 1
+
+  def reset(self):
+    self.samples = {}
+
+  def collapsed(self):
+    return ["%s %d" % (";".join(stack), count) for stack, count in sorted(self.samples.items())]
+
+  def write(self, f):
+    for line in self.collapsed():
+      f.write(line + "\n")
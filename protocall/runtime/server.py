@@ -0,0 +1,247 @@
+# Copyright 2016 Google Inc. All Rights Reserved.
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import Queue
+import threading
+import time
+from protocall.proto import rpc_pb2
+from profiler import Histogram
+from services import Server, Method, LoopbackChannel, RpcError, Overloaded
+from tasks import Task
+from value import symbol_value
+from vm import Protocall, COMPILED
+
+# Services implemented in protocall.  A UdfServer runs a program, usually a
+# list of defines, and serves each method with one of its UDFs:
+#
+#   define older { request.id = request.id + 1; return request; };
+#
+#   server = UdfServer(program, workers=4)
+#   server.add_method("People.Older", "older", Person, Person)
+#
+# The UDF is called with the request message bound to request, and returns
+# the response message.  It can be served in process with a LoopbackChannel
+# or over a socket with services.serve_socket.
+#
+# Requests are run by a fixed set of worker threads.  Every worker has a
+# Protocall of its own, in production mode, that ran the program and
+# compiled its UDFs when the worker started, so a request only costs the
+# UDF call and the fresh frame it runs in.  Workers share the parsed program
+# but nothing mutable.
+#
+# Admission control: a server holds at most workers + max_queue requests,
+# running or waiting for a worker.  Requests beyond that are answered at
+# once with an error that callers see as services.Overloaded, rather than
+# waiting in an unbounded queue until their deadlines pass.
+
+class Metrics:
+  def __init__(self):
+    self.lock = threading.Lock()
+    # Requests admitted and not finished, and those of them that wait for a
+    # worker.
+    self.in_flight = 0
+    self.queued = 0
+    self.max_queued = 0
+    self.accepted = 0
+    self.rejected = 0
+    self.completed = 0
+    # Seconds from arrival until a worker picked the request up, and until
+    # its response was ready.
+    self.wait = Histogram()
+    self.latency = Histogram()
+
+  def snapshot(self):
+    with self.lock:
+      return {"in_flight": self.in_flight, "queued": self.queued,
+              "max_queued": self.max_queued, "accepted": self.accepted,
+              "rejected": self.rejected, "completed": self.completed}
+
+  def lines(self):
+    s = self.snapshot()
+    lines = ["accepted %(accepted)d, rejected %(rejected)d, completed %(completed)d, "
+             "queued %(queued)d (max %(max_queued)d)" % s]
+    for title, h in (("queue wait", self.wait), ("latency", self.latency)):
+      lines.append("%-10s mean %8.1fus p50 %8.1fus p99 %8.1fus max %8.1fus" % (
+        title, h.mean() * 1e6, h.percentile(0.5) * 1e6, h.percentile(0.99) * 1e6, h.max * 1e6))
+    return lines
+
+class UdfServer(Server):
+  def __init__(self, program, workers=4, max_queue=16, engine=COMPILED):
+    Server.__init__(self)
+    self.program = program
+    self.engine = engine
+    self.workers = workers
+    self.max_queue = max_queue
+    self.metrics = Metrics()
+    self.queue = Queue.Queue()
+    self.local = threading.local()
+    self.udfs = None
+    self.error = None
+    self.threads = []
+    started = []
+    for i in range(workers):
+      ready = threading.Event()
+      thread = threading.Thread(target=self.work, args=(ready,), name="protocall-server-%d" % i)
+      thread.daemon = True
+      thread.start()
+      self.threads.append(thread)
+      started.append(ready)
+    for ready in started:
+      ready.wait()
+    if self.error is not None:
+      self.close()
+      raise self.error
+
+  def add_method(self, name, udf, request_class, response_class):
+    if udf not in self.udfs:
+      raise KeyError, udf
+    def handler(request):
+      return self.call(udf, request, response_class)
+    Server.add_method(self, name, request_class, response_class, handler)
+
+  def submit(self, data):
+    start = time.time()
+    metrics = self.metrics
+    with metrics.lock:
+      if metrics.in_flight >= self.workers + self.max_queue:
+        metrics.rejected += 1
+        return self.rejected(data)
+      metrics.accepted += 1
+      metrics.in_flight += 1
+      metrics.queued += 1
+      metrics.max_queued = max(metrics.max_queued, metrics.queued)
+    task = Task()
+    self.queue.put((task, data, start))
+    return task
+
+  def handle(self, data, start=None):
+    return self.submit(data).wait()
+
+  # A finished task with the Overloaded response to the RpcRequest data.
+  def rejected(self, data):
+    request = rpc_pb2.RpcRequest.FromString(data)
+    response = rpc_pb2.RpcResponse()
+    for i in range(len(request.request)):
+      result = response.result.add()
+      result.error = "server overloaded: %d requests in flight" % self.metrics.in_flight
+      result.overloaded = True
+    task = Task()
+    task.result = response.SerializeToString()
+    task.done.set()
+    return task
+
+  def work(self, ready):
+    try:
+      pr = Protocall(engine=self.engine, production=True)
+      pr.execute(self.program)
+      if self.engine == COMPILED:
+        for name in pr.udfs:
+          pr.compile_function(pr.udfs[name])
+      self.local.protocall = pr
+      if self.udfs is None:
+        self.udfs = set(pr.udfs)
+    except Exception as e:
+      self.error = e
+      return
+    finally:
+      ready.set()
+    metrics = self.metrics
+    while True:
+      item = self.queue.get()
+      if item is None:
+        return
+      task, data, start = item
+      with metrics.lock:
+        metrics.queued -= 1
+        metrics.wait.add(time.time() - start)
+      task.run(Server.handle, (self, data, start))
+      with metrics.lock:
+        metrics.in_flight -= 1
+        metrics.completed += 1
+        metrics.latency.add(time.time() - start)
+
+  # Runs udf on request in this worker's Protocall.
+  def call(self, udf, request, response_class):
+    pr = self.local.protocall
+    depth = len(pr.symbols.stack)
+    try:
+      response = symbol_value(pr.call_function(udf, [("request", request)]))
+    finally:
+      # A failing interpreted call leaves its frame behind.
+      del pr.symbols.stack[depth:]
+      pr.returning = False
+    if not isinstance(response, response_class):
+      raise TypeError("%s returned %r, not a %s" % (udf, response, response_class.DESCRIPTOR.full_name))
+    return response
+
+  # Stops the workers once they finish the requests already queued.
+  def close(self):
+    for thread in self.threads:
+      self.queue.put(None)
+    for thread in self.threads:
+      thread.join()
+    self.threads = []
+
+class LoadTest:
+  def __init__(self):
+    self.lock = threading.Lock()
+    self.calls = 0
+    self.ok = 0
+    self.overloaded = 0
+    self.errors = 0
+    self.seconds = 0.0
+    self.latency = Histogram()
+
+  def lines(self):
+    lines = ["%d calls in %.3fs, %.1f calls/s: %d ok, %d overloaded, %d errors" % (
+      self.calls, self.seconds, self.calls / max(self.seconds, 1e-9), self.ok,
+      self.overloaded, self.errors)]
+    lines.append("latency mean %.1fus p50 %.1fus p99 %.1fus max %.1fus" % (
+      self.latency.mean() * 1e6, self.latency.percentile(0.5) * 1e6,
+      self.latency.percentile(0.99) * 1e6, self.latency.max * 1e6))
+    return lines + self.latency.lines()
+
+# Calls method of server calls times, from clients threads at once, over a
+# LoopbackChannel, and returns a LoadTest with what happened.  request(i)
+# makes the request message of the i-th call.
+def load_test(server, method, request, calls=1000, clients=8, timeout=None):
+  request_class, response_class, handler = server.methods[method]
+  m = Method(method, request_class, response_class, LoopbackChannel(server), timeout)
+  result = LoadTest()
+  counter = iter(xrange(calls))
+  def client():
+    while True:
+      with result.lock:
+        i = next(counter, None)
+      if i is None:
+        return
+      start = time.time()
+      try:
+        m.call(request(i))
+        outcome = "ok"
+      except Overloaded:
+        outcome = "overloaded"
+      except RpcError:
+        outcome = "errors"
+      with result.lock:
+        result.calls += 1
+        setattr(result, outcome, getattr(result, outcome) + 1)
+        result.latency.add(time.time() - start)
+  threads = [threading.Thread(target=client) for i in range(clients)]
+  start = time.time()
+  for thread in threads:
+    thread.start()
+  for thread in threads:
+    thread.join()
+  result.seconds = time.time() - start
+  return result
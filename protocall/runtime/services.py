@@ -0,0 +1,328 @@
+# Copyright 2016 Google Inc. All Rights Reserved.
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import Queue
+import SocketServer
+import socket
+import struct
+import sys
+import threading
+import time
+from google.protobuf.message import Message
+from protocall.proto import rpc_pb2
+from tasks import TaskPool
+
+# Calls to remote services.  A Call whose field has two components,
+#
+#   response = Greeter.Hello(name="x");
+#
+# is looked up as the method "Greeter.Hello" in the Protocall's Services.
+# Its arguments become the fields of the method's request message, or, for
+# a single argument that already is a request message, the request itself.
+# The response message is the value of the call.
+#
+# Requests travel as rpc_pb2.RpcRequest over a channel: a LoopbackChannel
+# to a Server in the same process, or a SocketChannel to a Server behind
+# serve_socket.  A ChannelPool keeps several channels open and reuses them.
+# Methods added with batch=True send requests made concurrently, for example
+# by spawned tasks, together in one RpcRequest.  Every method can have a
+# timeout, after which its calls raise DeadlineExceeded.
+
+class RpcError(Exception):
+  pass
+
+class DeadlineExceeded(RpcError):
+  pass
+
+class Overloaded(RpcError):
+  pass
+
+# Server side
+
+# Runs the methods added to it on serialized RpcRequests.  Handlers take a
+# request message and return a response message.
+class Server:
+  def __init__(self, concurrency=8):
+    self.methods = {}
+    # Runs handle for LoopbackChannels.
+    self.tasks = TaskPool(concurrency)
+
+  def add_method(self, name, request_class, response_class, handler):
+    self.methods[name] = (request_class, response_class, handler)
+
+  # Queues handle for a LoopbackChannel and returns its tasks.Task.
+  def submit(self, data):
+    return self.tasks.submit(self.handle, data, time.time())
+
+  # start is when the request arrived, if it waited before being handled.
+  def handle(self, data, start=None):
+    if start is None:
+      start = time.time()
+    request = rpc_pb2.RpcRequest.FromString(data)
+    response = rpc_pb2.RpcResponse()
+    method = self.methods.get(request.method)
+    for data in request.request:
+      result = response.result.add()
+      if method is None:
+        result.error = "unknown method %s" % request.method
+      elif request.HasField("timeout") and time.time() - start > request.timeout:
+        result.error = "deadline exceeded before %s started" % request.method
+        result.deadline_exceeded = True
+      else:
+        request_class, response_class, handler = method
+        try:
+          result.response = handler(request_class.FromString(data)).SerializeToString()
+        except Exception as e:
+          result.error = "%s: %s" % (e.__class__.__name__, e)
+    return response.SerializeToString()
+
+# Frames are a 4-byte big-endian length followed by that many bytes.
+def write_frame(sock, data):
+  sock.sendall(struct.pack(">I", len(data)) + data)
+
+def read_frame(f):
+  header = f.read(4)
+  if len(header) < 4:
+    return None
+  n = struct.unpack(">I", header)[0]
+  data = f.read(n)
+  if len(data) < n:
+    return None
+  return data
+
+class FrameHandler(SocketServer.StreamRequestHandler):
+  # Serves one connection, for as many requests as the client sends.
+  def handle(self):
+    while True:
+      data = read_frame(self.rfile)
+      if data is None:
+        return
+      write_frame(self.connection, self.server.rpc_server.handle(data))
+
+class ThreadingServer(SocketServer.ThreadingMixIn, SocketServer.TCPServer):
+  daemon_threads = True
+  allow_reuse_address = True
+
+# Serves server on address, from a daemon thread, and returns the
+# SocketServer; its server_address is where it listens and its shutdown
+# method stops it.
+def serve_socket(server, address=("127.0.0.1", 0)):
+  listener = ThreadingServer(address, FrameHandler)
+  listener.rpc_server = server
+  thread = threading.Thread(target=listener.serve_forever, name="protocall-rpc-server")
+  thread.daemon = True
+  thread.start()
+  return listener
+
+# Client side.  A channel's call takes a serialized RpcRequest and returns
+# the serialized RpcResponse, or raises DeadlineExceeded after timeout
+# seconds.
+
+# Calls a Server in this process.  The server runs the request on its own
+# threads, so that timeouts behave as they do over a network.
+class LoopbackChannel:
+  def __init__(self, server):
+    self.server = server
+
+  def call(self, data, timeout=None):
+    task = self.server.submit(data)
+    if timeout is not None and not task.done.wait(timeout):
+      raise DeadlineExceeded("no response in %gs" % timeout)
+    return task.wait()
+
+# A connection to a serve_socket server, opened on first use and kept open
+# between calls.  A connection that fails or times out is closed, and the
+# next call opens a new one.
+class SocketChannel:
+  def __init__(self, address):
+    self.address = address
+    self.sock = None
+
+  def call(self, data, timeout=None):
+    try:
+      if self.sock is None:
+        self.sock = socket.create_connection(self.address, timeout)
+        self.file = self.sock.makefile("rb")
+      self.sock.settimeout(timeout)
+      write_frame(self.sock, data)
+      response = read_frame(self.file)
+    except socket.timeout:
+      self.close()
+      raise DeadlineExceeded("no response in %gs" % timeout)
+    except socket.error:
+      self.close()
+      raise
+    if response is None:
+      self.close()
+      raise RpcError("connection to %s:%d closed" % self.address)
+    return response
+
+  def close(self):
+    if self.sock is not None:
+      self.file.close()
+      self.sock.close()
+    self.sock = None
+
+# Opens up to size channels with factory, as concurrent calls need them,
+# and gives each to one call at a time.
+class ChannelPool:
+  def __init__(self, factory, size=4):
+    self.factory = factory
+    self.size = size
+    self.idle = Queue.LifoQueue()
+    self.opened = 0
+    self.lock = threading.Lock()
+
+  def call(self, data, timeout=None):
+    start = time.time()
+    channel = self.acquire(timeout)
+    if timeout is not None:
+      timeout = max(0.0, timeout - (time.time() - start))
+    try:
+      return channel.call(data, timeout)
+    finally:
+      self.idle.put(channel)
+
+  # Waits up to timeout seconds for a channel when all of them are busy.
+  def acquire(self, timeout=None):
+    try:
+      return self.idle.get_nowait()
+    except Queue.Empty:
+      pass
+    with self.lock:
+      if self.opened < self.size:
+        self.opened += 1
+        return self.factory()
+    try:
+      return self.idle.get(timeout=timeout)
+    except Queue.Empty:
+      raise DeadlineExceeded("no free channel in %gs" % timeout)
+
+class Batch:
+  def __init__(self):
+    self.requests = []
+    self.full = threading.Event()
+    self.done = threading.Event()
+    self.results = None
+    self.error = None
+
+# Collects the requests made while a batch is open into one send.  The
+# first caller opens the batch, waits up to window seconds or until it
+# holds max_size requests, and sends it; the others wait for its results.
+class Batcher:
+  def __init__(self, send, window=0.001, max_size=64):
+    self.send = send
+    self.window = window
+    self.max_size = max_size
+    self.lock = threading.Lock()
+    self.open = None
+
+  def call(self, data):
+    with self.lock:
+      batch = self.open
+      leader = batch is None
+      if leader:
+        batch = self.open = Batch()
+      index = len(batch.requests)
+      batch.requests.append(data)
+      if len(batch.requests) >= self.max_size:
+        self.open = None
+        batch.full.set()
+    if leader:
+      batch.full.wait(self.window)
+      with self.lock:
+        if self.open is batch:
+          self.open = None
+      try:
+        batch.results = self.send(batch.requests)
+      except Exception:
+        batch.error = sys.exc_info()
+      batch.done.set()
+    else:
+      while not batch.done.wait(3600):
+        pass
+    if batch.error is not None:
+      error_type, error, tb = batch.error
+      raise error_type, error, tb
+    return batch.results[index]
+
+class Method:
+  def __init__(self, name, request_class, response_class, channel, timeout=None,
+               batch=False, batch_window=0.001, max_batch=64):
+    self.name = name
+    self.request_class = request_class
+    self.response_class = response_class
+    self.channel = channel
+    self.timeout = timeout
+    self.batcher = None
+    if batch:
+      self.batcher = Batcher(self.send, batch_window, max_batch)
+
+  def call(self, request):
+    data = request.SerializeToString()
+    if self.batcher is not None:
+      result = self.batcher.call(data)
+    else:
+      result = self.send([data])[0]
+    if result.HasField("error"):
+      if result.overloaded:
+        raise Overloaded("%s: %s" % (self.name, result.error))
+      if result.deadline_exceeded:
+        raise DeadlineExceeded("%s: %s" % (self.name, result.error))
+      raise RpcError("%s: %s" % (self.name, result.error))
+    return self.response_class.FromString(result.response)
+
+  # Sends serialized requests in one RpcRequest and returns their
+  # RpcResults.
+  def send(self, requests):
+    rpc = rpc_pb2.RpcRequest()
+    rpc.method = self.name
+    rpc.request.extend(requests)
+    if self.timeout is not None:
+      rpc.timeout = self.timeout
+    response = rpc_pb2.RpcResponse.FromString(self.channel.call(rpc.SerializeToString(), self.timeout))
+    if len(response.result) != len(requests):
+      raise RpcError("%s: %d results for %d requests" % (self.name, len(response.result), len(requests)))
+    return list(response.result)
+
+  # The request message for a call with arguments args, a list of (name,
+  # value) pairs.
+  def request(self, args):
+    if len(args) == 1 and isinstance(args[0][1], self.request_class):
+      return args[0][1]
+    request = self.request_class()
+    for key, v in args:
+      field = getattr(request, key)
+      if isinstance(field, Message):
+        field.CopyFrom(v)
+      elif isinstance(v, list):
+        del field[:]
+        field.extend(v)
+      else:
+        setattr(request, key, v)
+    return request
+
+# The methods a Protocall can call, by "Service.Method" name.
+class Services:
+  def __init__(self):
+    self.methods = {}
+
+  def add_method(self, name, request_class, response_class, channel, **options):
+    self.methods[name] = Method(name, request_class, response_class, channel, **options)
+
+  def __contains__(self, name):
+    return name in self.methods
+
+  def call(self, name, args):
+    method = self.methods[name]
+    return method.call(method.request(args))
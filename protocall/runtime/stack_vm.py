@@ -0,0 +1,175 @@
+# Copyright 2016 Google Inc. All Rights Reserved.
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+from protocall.proto import protocall_pb2
+import bytecode
+from bytecode import LOAD_CONST, LOAD_NAME, LOAD_FIELD, LOAD_ARRAY_REF, STORE_NAME, STORE_FIELD, STORE_ARRAY_REF, BUILD_ARRAY, ARITHMETIC, COMPARE, CALL, CALL_SUBR, JUMP, JUMP_IF_FALSE, SET_RESULT, SET_RETURN, CLEAR_RESULT, DEFINE, RETURN, LOAD_PROTO, LOAD_ARRAY
+from vm import Protocall
+from profiler import clock
+from truth import is_true
+from value import expression, symbol_value, copy_message
+from operators import arithmetic_operators, comparison_operators
+
+class Frame:
+  def __init__(self, code):
+    self.code = code
+    self.pc = 0
+    self.stack = []
+    self.result = None
+    # Start time of a UDF call, when profiling.
+    self.start = None
+
+# Runs bytecode.Program objects in a single dispatch loop.  UDF calls push a
+# Frame on an explicit frame stack rather than recursing in Python, and UDFs
+# are kept in self.udfs as bytecode.Code objects.  With a profiler, UDF and
+# builtin calls are timed but statements are not, since the dispatch loop
+# does not track statement boundaries.
+class StackVM(Protocall):
+  def compile(self, block):
+    entry = self.compiled.get(id(block))
+    if entry is None:
+      entry = (block, bytecode.compile_program(block, frozenset(self.subrs)))
+      self.compiled[id(block)] = entry
+    return entry[1]
+
+  def run_block(self, block):
+    return self.run_program(self.compile(block))
+
+  # UDFs called from outside the dispatch loop, by subrs, get a dispatch
+  # loop of their own.
+  def run_function(self, name, args):
+    function = self.udfs.get(name)
+    if name in self.builtins or not isinstance(function, bytecode.Code):
+      return Protocall.run_function(self, name, args)
+    self.symbols.push_frame(dict(args))
+    try:
+      return self.run_program(bytecode.Program([function]))
+    finally:
+      self.symbols.pop_frame()
+
+  def run(self, program):
+    result = self.run_program(program)
+    if result is None:
+      return None
+    return expression(result)
+
+  def run_program(self, program):
+    codes = program.code
+    symbols = self.symbols
+    frames = []
+    frame = Frame(codes[0])
+    while True:
+      code = frame.code
+      ops, args, stack = code.ops, code.args, frame.stack
+      constants, names = code.constants, code.names
+      pc = frame.pc
+      try:
+        while True:
+          op = ops[pc]
+          arg = args[pc]
+          pc += 1
+          if op == LOAD_NAME:
+            stack.append(symbols.lookup_local_key(names[arg]))
+          elif op == LOAD_CONST:
+            stack.append(constants[arg])
+          elif op == ARITHMETIC or op == COMPARE:
+            right = stack.pop()
+            left = stack.pop()
+            if op == ARITHMETIC:
+              stack.append(arithmetic_operators[arg](left, right))
+            else:
+              stack.append(comparison_operators[arg](left, right))
+          elif op == JUMP_IF_FALSE:
+            if not is_true(stack.pop()):
+              pc = arg
+          elif op == JUMP:
+            pc = arg
+          elif op == STORE_NAME:
+            v = symbol_value(stack.pop())
+            symbols.add_local_key(names[arg], v)
+            stack.append(v)
+          elif op == SET_RESULT:
+            frame.result = stack.pop()
+          elif op == SET_RETURN:
+            frame.result = stack.pop()
+            # Every code ends with its RETURN.
+            pc = len(ops) - 1
+          elif op == CLEAR_RESULT:
+            frame.result = None
+          elif op == CALL:
+            name, arg_names = code.call_sites[arg]
+            n = len(arg_names)
+            call_args = zip(arg_names, stack[len(stack)-n:])
+            del stack[len(stack)-n:]
+            if name in self.builtins:
+              stack.append(self.call_function(name, call_args))
+            elif name in self.udfs:
+              symbols.push_frame(dict(call_args))
+              frame.pc = pc
+              frames.append(frame)
+              frame = Frame(self.udfs[name])
+              if self.profiler is not None:
+                frame.start = clock()
+              break
+            else:
+              stack.append(self.call_service(name, [(key, symbol_value(v)) for key, v in call_args]))
+          elif op == RETURN:
+            if not frames:
+              return frame.result
+            result = frame.result
+            if frame.start is not None:
+              self.profiler.call(code.name, False, clock() - frame.start)
+            symbols.pop_frame()
+            frame = frames.pop()
+            frame.stack.append(result)
+            break
+          elif op == LOAD_FIELD:
+            stack.append(symbols.lookup_local(code.fields[arg]))
+          elif op == LOAD_ARRAY_REF:
+            field, index = code.array_refs[arg]
+            stack.append(symbols.lookup_local(field)[index])
+          elif op == STORE_FIELD:
+            v = symbol_value(stack.pop())
+            symbols.add_local_symbol(code.fields[arg], v)
+            stack.append(v)
+          elif op == STORE_ARRAY_REF:
+            field, index = code.array_refs[arg]
+            symbols.lookup(field)[index] = symbol_value(stack[-1])
+          elif op == BUILD_ARRAY:
+            array = [symbol_value(e) for e in stack[len(stack)-arg:]]
+            del stack[len(stack)-arg:]
+            stack.append(array)
+          elif op == CALL_SUBR:
+            call = code.subr_calls[arg]
+            function = self.subrs[call.field.component[0].name]
+            stack.append(function(self, call.argument, symbols))
+          elif op == LOAD_PROTO:
+            stack.append(copy_message(constants[arg]))
+          elif op == LOAD_ARRAY:
+            stack.append(list(constants[arg]))
+          elif op == DEFINE:
+            self.udfs[codes[arg].name] = codes[arg]
+          else:
+            raise RuntimeError(bytecode.opcode_names.get(op, op))
+      except Exception as e:
+        # Like Protocall.execute, report the innermost failing statement and
+        # carry on with the statement after it.
+        entry = code.statement_at(pc - 1)
+        if entry is None:
+          raise
+        start, end, statement = entry
+        if statement is None:
+          statement = protocall_pb2.Statement()
+        self.statement_failed(statement)
+        del stack[:]
+        frame.pc = end
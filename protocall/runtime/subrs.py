@@ -11,6 +11,10 @@
 # WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 # See the License for the specific language governing permissions and
 # limitations under the License.
+from parallel import parallel_map
+from pipeline import map, filter, reduce
+from tasks import spawn, await_ as await
+
 def print_symbols(protocall, arguments, symbols):
     print "Symbols:"
     print symbols.dump()
@@ -12,14 +12,93 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-from protos import parse_proto
-from google.protobuf import text_format
+from value import unbox
 from google.protobuf.message import Message
 
+# Marks a slot that has not been assigned yet.
+UNBOUND = object()
+
+# The slot layout of one resolved Block: every name the block refers to gets
+# a fixed index into the slots of its Frames.  Released frames are kept for
+# reuse, so deep UDF recursion does not allocate a frame per call.
+class Scope:
+    def __init__(self, names=None):
+        self.names = []
+        self.index = {}
+        self.pool = []
+        for name in names or []:
+            self.slot(name)
+
+    def slot(self, name):
+        if name not in self.index:
+            self.index[name] = len(self.names)
+            self.names.append(name)
+        return self.index[name]
+
+    def acquire(self):
+        # A single pop, since tasks may share compiled UDFs across threads.
+        try:
+            return self.pool.pop()
+        except IndexError:
+            return Frame(self)
+
+    def release(self, frame):
+        frame.clear()
+        self.pool.append(frame)
+
+# A frame whose locals live in a list indexed by Scope slot.  Compiled code
+# reads and writes frame.slots directly; the dict interface below keeps
+# Symbols, subrs and builtins working on it by name.
+class Frame(object):
+    __slots__ = ("scope", "slots", "extra")
+
+    def __init__(self, scope):
+        self.scope = scope
+        self.slots = [UNBOUND] * len(scope.names)
+        # Names bound in the frame that the block never refers to, such as
+        # unused arguments.
+        self.extra = {}
+
+    def clear(self):
+        slots = self.slots
+        for i in range(len(slots)):
+            slots[i] = UNBOUND
+        self.extra.clear()
+
+    def __getitem__(self, key):
+        i = self.scope.index.get(key)
+        if i is not None and self.slots[i] is not UNBOUND:
+            return self.slots[i]
+        return self.extra[key]
+
+    def __setitem__(self, key, value):
+        i = self.scope.index.get(key)
+        if i is None:
+            self.extra[key] = value
+        else:
+            self.slots[i] = value
+
+    def __contains__(self, key):
+        i = self.scope.index.get(key)
+        if i is not None and self.slots[i] is not UNBOUND:
+            return True
+        return key in self.extra
+
+    def keys(self):
+        return [name for name, v in zip(self.scope.names, self.slots) if v is not UNBOUND] + self.extra.keys()
+
+    def items(self):
+        return [(key, self[key]) for key in self.keys()]
+
+    def __repr__(self):
+        return repr(dict(self.items()))
+
 class Symbols:
     def __init__(self, initial=None):
         if not initial:
             initial = {}
+        for key in initial:
+            initial[key] = unbox(initial[key])
         self.stack = [initial]
 
     def push_frame(self, symbols=None):
@@ -41,10 +120,9 @@ class Symbols:
     def add_global_symbol(self, key, value):
         self.stack[0][key] = value
 
-    def traverse_atom(self, atom, components):
-        value = atom.literal.proto.value
-        field = ".".join([component.name for component in atom.literal.proto.field.component])
-        base = parse_proto(value, field)
+    # Proto-valued symbols hold live message objects, which nested field
+    # writes mutate in place.
+    def traverse_atom(self, base, components):
         p = base
         parent = None
         for component in components:
@@ -52,7 +130,6 @@ class Symbols:
                 parent = p
                 p = getattr(p, component)
             else:
-                import pdb; pdb.set_trace()
                 raise RuntimeError("did not find component %s in proto %s" % (component, p))
         return parent, base, p
 
@@ -60,25 +137,25 @@ class Symbols:
         if len(field.component) == 1:
           self.stack[-1][field.component[0].name] = value
         else:
-          components = list(reversed([component.name for component in field.component]))
-          atom = self.lookup_local_key(components.pop())
-          parent, base, p = self.traverse_atom(atom, components)
+          components = [component.name for component in field.component]
+          base = self.lookup_local_key(components[0])
+          parent, base, p = self.traverse_atom(base, components[1:])
           if isinstance(p, Message):
-            result = parse_proto(value.literal.proto.value, value.literal.proto.field.component[0].name)
-            getattr(parent, field.component[-1].name).CopyFrom(result)
-            self.stack[-1][field.component[0].name].literal.proto.value = text_format.MessageToString(base)
+            p.CopyFrom(value)
           else:
-            setattr(parent, field.component[-1].name, value)
-            self.stack[-1][field.component[0].name].literal.proto.value = text_format.MessageToString(base)
+            setattr(parent, components[-1], value)
+
+    def add_local_key(self, key, value):
+        self.stack[-1][key] = value
 
     def lookup(self, field):
         if len(field.component) == 1:
           key = field.component[0].name
           return self.lookup_key(key)
         else:
-          components = list(reversed([component.name for component in field.component]))
-          atom = self.lookup_key(components.pop())
-          parent, base, p = self.traverse_atom(atom, components)
+          components = [component.name for component in field.component]
+          base = self.lookup_key(components[0])
+          parent, base, p = self.traverse_atom(base, components[1:])
 
         return p
 
@@ -93,9 +170,9 @@ class Symbols:
         if len(field.component) == 1:
           key = field.component[0].name
           return self.lookup_local_key(key)
-        components = list(reversed([component.name for component in field.component]))
-        atom = self.lookup_local_key(components.pop())
-        parent, base, p = self.traverse_atom(atom, components)
+        components = [component.name for component in field.component]
+        base = self.lookup_local_key(components[0])
+        parent, base, p = self.traverse_atom(base, components[1:])
         return p
 
     def lookup_local_key(self, key):
@@ -0,0 +1,137 @@
+# Copyright 2016 Google Inc. All Rights Reserved.
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import Queue
+import sys
+import threading
+from value import symbol_value
+
+# The spawn and await subrs:
+#
+#   t = spawn(f="name", x=1, ...);   starts name(x=1, ...) and returns a task
+#   v = await(t=t);                  waits for the task and returns its result
+#
+# so that calls which spend their time waiting, such as calls to remote
+# services, overlap instead of running one after the other.  Tasks run on a
+# pool of at most Protocall.concurrency threads per Protocall; tasks beyond
+# that wait in a queue.  A spawned call runs in a Protocall of its own, with
+# its own symbols but the same UDFs, compiled code and builtins, in
+# production mode, so a failure is raised by await rather than stopping the
+# task.  A task that awaits a task no thread has started yet runs it itself,
+# so tasks that spawn and await tasks cannot use up the pool's threads
+# waiting for work that has no thread to run on.
+
+DEFAULT_CONCURRENCY = 8
+
+class Task:
+  def __init__(self):
+    self.done = threading.Event()
+    self.result = None
+    self.error = None
+    # (fn, args) of a task waiting in a TaskPool's queue, and the lock taken
+    # by the thread that runs it.
+    self.pending = None
+    self.claimed = threading.Lock()
+
+  # Runs the pending call, unless another thread already took it.
+  def start(self):
+    if self.claimed.acquire(False) and self.pending is not None:
+      fn, args = self.pending
+      self.pending = None
+      self.run(fn, args)
+
+  def run(self, fn, args):
+    try:
+      self.result = fn(*args)
+    except Exception:
+      self.error = sys.exc_info()
+    finally:
+      self.done.set()
+
+  def wait(self):
+    # Event.wait without a timeout cannot be interrupted.
+    while not self.done.wait(3600):
+      pass
+    if self.error is not None:
+      error_type, error, tb = self.error
+      raise error_type, error, tb
+    return self.result
+
+  def __repr__(self):
+    return "<Task %s>" % ("done" if self.done.is_set() else "running")
+
+# Runs submitted functions on up to size daemon threads, started as they
+# are needed.
+class TaskPool:
+  def __init__(self, size):
+    self.size = size
+    self.queue = Queue.Queue()
+    self.threads = []
+    self.lock = threading.Lock()
+    self.local = threading.local()
+
+  def submit(self, fn, *args):
+    task = Task()
+    task.pending = (fn, args)
+    self.queue.put(task)
+    with self.lock:
+      if len(self.threads) < self.size:
+        thread = threading.Thread(target=self.work, name="protocall-task-%d" % len(self.threads))
+        thread.daemon = True
+        thread.start()
+        self.threads.append(thread)
+    return task
+
+  def work(self):
+    self.local.worker = True
+    while True:
+      self.queue.get().start()
+
+  # task.wait(), except that one of the pool's own threads runs the task
+  # itself if it has not started, rather than blocking until another thread
+  # is free to.
+  def wait(self, task):
+    if getattr(self.local, "worker", False):
+      task.start()
+    return task.wait()
+
+def start(protocall, name, args):
+  if protocall.task_pool is None:
+    protocall.task_pool = TaskPool(protocall.concurrency)
+  return protocall.task_pool.submit(run_task, protocall, name, args)
+
+def run_task(protocall, name, args):
+  child = protocall.__class__(engine=protocall.engine, production=True,
+                              concurrency=protocall.concurrency)
+  child.udfs = protocall.udfs
+  # UDFs compiled by any task, or by the parent, are compiled once.
+  child.compiled = protocall.compiled
+  child.compiled_functions = protocall.compiled_functions
+  child.builtins = protocall.builtins
+  child.subrs = protocall.subrs
+  child.services = protocall.services
+  child.cache = protocall.cache
+  # Tasks spawned by the task count against the same limit.
+  child.task_pool = protocall.task_pool
+  return symbol_value(child.call_function(name, args))
+
+def spawn(protocall, arguments, symbols):
+  name = symbol_value(protocall.eval(arguments[0].expression))
+  args = [(arg.identifier.name, symbol_value(protocall.eval(arg.expression))) for arg in arguments[1:]]
+  return start(protocall, name, args)
+
+def await_(protocall, arguments, symbols):
+  task = symbol_value(protocall.eval(arguments[0].expression))
+  if protocall.task_pool is not None:
+    return protocall.task_pool.wait(task)
+  return task.wait()
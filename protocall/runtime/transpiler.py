@@ -0,0 +1,292 @@
+# Copyright 2016 Google Inc. All Rights Reserved.
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+from protocall.proto import protocall_pb2
+from google.protobuf.message import Message
+import builtins as builtins_
+import subrs as subrs_
+from symbols import Symbols, UNBOUND
+from resolver import resolve_block
+from truth import is_true
+from operators import arithmetic_operators, comparison_operators, plus, minus, multiply, divide, equals, less_than, greater_than
+from value import box, unbox, expression, symbol_value, copy_message
+from protos import parse_proto
+
+# Translates a protocall Block into the source of a Python module.  Every
+# define becomes a module-level function, protocall variables become Python
+# locals (prefixed with v_), and while/if become Python while/if.  Builtins
+# and subrs are called directly.  Arithmetic and comparisons call the
+# functions in operators, which also work element by element on arrays.
+#
+# Unlike the runtime, generated code does not stop at a failing statement
+# to report it; the exception propagates to the caller.  Defines take
+# effect when the module is imported rather than when the define statement
+# is reached, and every UDF name may be defined only once.  Service calls,
+# Service.Method(...), cannot be transpiled.
+#
+# The functions below this comment are the support library the generated
+# modules call into.
+
+def run_builtin(name, args):
+  return symbol_value(getattr(builtins_, name)(args, Symbols(dict(args))))
+
+# The subr gets a Protocall whose UDFs are the module's udf_ functions.
+def run_subr(name, call, frame, module):
+  from vm import Protocall
+  symbols = Symbols(dict((key[2:], v) for key, v in frame.items()
+                         if key.startswith("v_") and v is not UNBOUND))
+  pr = Protocall(symbols)
+  for key, function in module.items():
+    if key.startswith("udf_"):
+      pr.udfs[key[4:]] = udf_builtin(function)
+  return symbol_value(getattr(subrs_, name)(pr, call.argument, symbols))
+
+# Wraps a generated UDF in the calling convention of builtins.
+def udf_builtin(function):
+  return lambda args, symbols: function(**dict(("v_" + key, v) for key, v in args))
+
+def undefined(name):
+  raise KeyError, name
+
+# Raised on reading a variable that was never assigned, as Symbols does.
+def unbound(name):
+  raise KeyError, name
+
+def array(values):
+  return [symbol_value(v) for v in values]
+
+def element(a, index):
+  return a[index]
+
+def set_element(a, index, v):
+  a[index] = symbol_value(v)
+
+def set_field(base, components, v):
+  for component in components[:-1]:
+    base = getattr(base, component)
+  if isinstance(getattr(base, components[-1]), Message):
+    getattr(base, components[-1]).CopyFrom(v)
+  else:
+    setattr(base, components[-1], v)
+
+default_builtins = frozenset(name for name in dir(builtins_) if not name.startswith("_"))
+default_subrs = frozenset(name for name in dir(subrs_) if not name.startswith("_"))
+
+class Transpiler:
+  def __init__(self, builtin_names=default_builtins, subr_names=default_subrs):
+    self.builtin_names = builtin_names
+    self.subr_names = subr_names
+    self.lines = []
+    self.indent = 0
+    # Module-level constants: proto literal messages and the Call protos
+    # passed to subrs.
+    self.constants = []
+    self.udfs = {}
+
+  def transpile(self, block):
+    self.collect_defines(block)
+    functions = []
+    for name in sorted(self.udfs):
+      functions.append(self.function("udf_" + name, self.udfs[name]))
+    functions.append(self.function("main", block))
+    lines = [
+      "# Generated by protocall.runtime.transpiler.",
+      "from protocall.proto import protocall_pb2",
+      "from protocall.runtime import transpiler as _rt",
+      "",
+      "_UNBOUND = _rt.UNBOUND",
+    ]
+    for i, (kind, constant) in enumerate(self.constants):
+      if kind == "proto":
+        text, name = constant
+        lines.append("_c%d = _rt.parse_proto(%r, %r)" % (i, text, name))
+      else:
+        lines.append("_c%d = protocall_pb2.Call.FromString(%r)" % (i, constant.SerializeToString()))
+    lines.append("")
+    for function in functions:
+      lines.extend(function)
+      lines.append("")
+    lines.extend([
+      "def run(symbols=None):",
+      "  args = dict(('v_' + key, _rt.unbox(v)) for key, v in (symbols or {}).items())",
+      "  return main(**args)",
+      "",
+      "if __name__ == '__main__':",
+      "  result = run()",
+      "  if result is None:",
+      "    print None",
+      "  else:",
+      "    print _rt.expression(result)",
+    ])
+    return "\n".join(lines) + "\n"
+
+  def collect_defines(self, block):
+    for statement in block.statement:
+      if statement.HasField("define"):
+        name = statement.define.field.component[0].name
+        if name in self.udfs:
+          raise RuntimeError("%s is defined more than once" % name)
+        self.udfs[name] = statement.define.scope.block
+        self.collect_defines(statement.define.scope.block)
+      elif statement.HasField("conditional"):
+        conditional = statement.conditional
+        for expression_scope in [conditional.if_scope] + list(conditional.elif_scope):
+          self.collect_defines(expression_scope.scope.block)
+        self.collect_defines(conditional.else_scope.block)
+      elif statement.HasField("while_"):
+        self.collect_defines(statement.while_.expression_scope.scope.block)
+
+  def function(self, name, block):
+    self.lines = []
+    self.indent = 1
+    names = resolve_block(block).names
+    parameters = ["v_%s=_UNBOUND" % n for n in names] + ["**_args"]
+    self.emit("_result = None")
+    self.block(block)
+    self.emit("return _result")
+    return ["def %s(%s):" % (name, ", ".join(parameters))] + self.lines
+
+  def emit(self, line):
+    self.lines.append("  " * self.indent + line)
+
+  def block(self, block):
+    for statement in block.statement:
+      self.statement(statement)
+
+  def nested_block(self, block):
+    self.indent += 1
+    if not len(block.statement):
+      # A taken branch with no statements still produces a None result.
+      self.emit("_result = None")
+    elif block.statement[0].HasField("conditional"):
+      self.emit("_result = None")
+    self.block(block)
+    self.indent -= 1
+
+  def statement(self, statement):
+    if statement.HasField("assignment"):
+      field = statement.assignment.field
+      e = self.expression(statement.assignment.expression)
+      if len(field.component) == 1:
+        self.emit("v_%s = _result = %s" % (field.component[0].name, e))
+      else:
+        components = tuple(component.name for component in field.component)
+        self.emit("_result = %s" % e)
+        self.emit("_rt.set_field(%s, %r, _result)" % (self.variable(components[0]), components[1:]))
+    elif statement.HasField("array_assignment"):
+      array_ref = statement.array_assignment.array_ref
+      self.emit("_result = %s" % self.expression(statement.array_assignment.expression))
+      self.emit("_rt.set_element(%s, %d, _result)" % (self.field(array_ref.field), array_ref.index.value))
+    elif statement.HasField("call"):
+      self.emit("_result = %s" % self.call(statement.call))
+    elif statement.HasField("conditional"):
+      conditional = statement.conditional
+      self.emit("if %s:" % self.condition(conditional.if_scope.expression))
+      self.nested_block(conditional.if_scope.scope.block)
+      for expression_scope in conditional.elif_scope:
+        self.emit("elif %s:" % self.condition(expression_scope.expression))
+        self.nested_block(expression_scope.scope.block)
+      if len(conditional.else_scope.block.statement):
+        self.emit("else:")
+        self.nested_block(conditional.else_scope.block)
+    elif statement.HasField("return_"):
+      self.emit("return %s" % self.expression(statement.return_.expression))
+    elif statement.HasField("while_"):
+      expression_scope = statement.while_.expression_scope
+      self.emit("while %s:" % self.condition(expression_scope.expression))
+      self.indent += 1
+      if len(expression_scope.scope.block.statement):
+        self.block(expression_scope.scope.block)
+      else:
+        self.emit("pass")
+      self.indent -= 1
+      self.emit("_result = None")
+    elif statement.HasField("define"):
+      self.emit("_result = None")
+    else:
+      raise RuntimeError(str(statement))
+
+  def condition(self, e):
+    # Comparisons always produce a bool; anything else goes through is_true
+    # so that non-boolean conditions fail as they do in the runtime.
+    if e.HasField("comparison_operator"):
+      return self.expression(e)
+    return "_rt.is_true(%s)" % self.expression(e)
+
+  def call(self, call):
+    if len(call.field.component) != 1:
+      name = ".".join([component.name for component in call.field.component])
+      raise RuntimeError("service call %s is not supported by the transpiler" % name)
+    name = call.field.component[0].name
+    if name in self.subr_names:
+      self.constants.append(("call", call))
+      return "_rt.run_subr(%r, _c%d, locals(), globals())" % (name, len(self.constants) - 1)
+    args = [(arg.identifier.name, self.expression(arg.expression)) for arg in call.argument]
+    if name in self.builtin_names:
+      return "_rt.run_builtin(%r, [%s])" % (name, ", ".join("(%r, %s)" % arg for arg in args))
+    elif name in self.udfs:
+      return "udf_%s(%s)" % (name, ", ".join("v_%s=%s" % arg for arg in args))
+    return "_rt.undefined(%r)" % name
+
+  def field(self, field):
+    return ".".join([self.variable(field.component[0].name)] + [component.name for component in field.component[1:]])
+
+  # Reads a variable, failing with KeyError when it is unbound.
+  def variable(self, name):
+    return "(v_%s if v_%s is not _UNBOUND else _rt.unbound(%r))" % (name, name, name)
+
+  def expression(self, e):
+    if e.HasField("atom"):
+      return self.atom(e.atom)
+    elif e.HasField("call"):
+      return self.call(e.call)
+    elif e.HasField("arithmetic_operator"):
+      operator = e.arithmetic_operator
+      return "_rt.%s(%s, %s)" % (arithmetic_operators[operator.operator].__name__,
+                                 self.expression(operator.left), self.expression(operator.right))
+    elif e.HasField("comparison_operator"):
+      operator = e.comparison_operator
+      return "_rt.%s(%s, %s)" % (comparison_operators[operator.operator].__name__,
+                                 self.expression(operator.left), self.expression(operator.right))
+    else:
+      raise RuntimeError(str(e))
+
+  def atom(self, atom):
+    if atom.HasField("literal"):
+      literal = atom.literal
+      kind = literal.WhichOneof("literal")
+      if kind == "array":
+        return "_rt.array([%s])" % ", ".join(self.expression(element) for element in literal.array.element)
+      elif kind == "proto":
+        name = ".".join([component.name for component in literal.proto.field.component])
+        self.constants.append(("proto", (literal.proto.value, name)))
+        return "_rt.copy_message(_c%d)" % (len(self.constants) - 1)
+      return repr(unbox(literal))
+    elif atom.HasField("expression"):
+      return self.expression(atom.expression)
+    elif atom.HasField("field"):
+      return self.field(atom.field)
+    elif atom.HasField("array_ref"):
+      return "_rt.element(%s, %d)" % (self.field(atom.array_ref.field), atom.array_ref.index.value)
+    else:
+      raise RuntimeError(str(atom))
+
+def transpile(block):
+  return Transpiler().transpile(block)
+
+# Executes the source returned by transpile as a new module.
+def load(source, name="protocall_program"):
+  import imp
+  module = imp.new_module(name)
+  exec compile(source, name, "exec") in module.__dict__
+  return module
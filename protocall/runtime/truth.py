@@ -14,6 +14,8 @@
 from protocall.proto import protocall_pb2
 
 def is_true(arg):
+    if arg is True or arg is False:
+        return arg
     if not arg.literal.HasField("boolean"):
         raise RuntimeError
     return arg.literal.boolean.value
@@ -28,3 +30,8 @@ literal_true = protocall_pb2.Literal()
 literal_true.boolean.CopyFrom(true)
 literal_false = protocall_pb2.Literal()
 literal_false.boolean.CopyFrom(false)
+
+atom_true = protocall_pb2.Atom()
+atom_true.literal.CopyFrom(literal_true)
+atom_false = protocall_pb2.Atom()
+atom_false.literal.CopyFrom(literal_false)
@@ -13,6 +13,10 @@
 # limitations under the License.
 from protocall.proto import protocall_pb2
 from google.protobuf import message
+from google.protobuf import text_format
+from protos import parse_proto, message_name
+from truth import atom_true, atom_false
+import diagnostics
 def value(literal):
     if isinstance(literal, protocall_pb2.Expression) and literal.HasField("atom"):
         result = value(literal.atom.literal)
@@ -26,15 +30,23 @@ def value(literal):
         result = literal.integer.value
     elif isinstance(literal, protocall_pb2.Literal) and literal.HasField("string"):
         result = literal.string.value
+    elif isinstance(literal, protocall_pb2.Literal) and literal.HasField("boolean"):
+        result = literal.boolean.value
     elif isinstance(literal, protocall_pb2.Literal) and literal.HasField("array"):
         result = '[ ' + ", ".join([str(value(element)) for element in literal.array.element]) + ' ]'
+    elif isinstance(literal, protocall_pb2.Literal) and literal.HasField("integer_array"):
+        result = value(list(literal.integer_array.value))
+    elif isinstance(literal, protocall_pb2.Literal) and literal.HasField("double_array"):
+        result = value(list(literal.double_array.value))
     elif isinstance(literal, protocall_pb2.Literal) and literal.HasField("proto"):
-        print "XXX"
-        print "literal:", literal
         result = literal.proto
+    elif isinstance(literal, protocall_pb2.Array):
+        result = '[ ' + ", ".join([str(value(element)) for element in literal.element]) + ' ]'
     elif isinstance(literal, protocall_pb2.Atom):
         result = value(literal.literal)
-    elif isinstance(literal, int):
+    elif isinstance(literal, list):
+        result = '[ ' + ", ".join([str(value(element)) for element in literal]) + ' ]'
+    elif isinstance(literal, (int, long)):
         result = literal
     elif isinstance(literal, str):
         result = literal
@@ -43,13 +55,121 @@ def value(literal):
     elif isinstance(literal, float):
         result = literal
     elif isinstance(literal, message.Message):
-        print "YYY"
         result = literal
-    elif isinstance(literal, None):
-        print "Warning: None value."
+    elif literal is None:
+        diagnostics.warning("none_value")
         result = None
     else:
-        print literal.__class__
-        import pdb; pdb.set_trace()
-        raise RuntimeError
+        raise RuntimeError(literal.__class__)
     return result
+
+# The runtime carries plain Python values (ints, strings, bools, lists for
+# arrays, and messages) and only boxes them into Atom protos at its
+# boundaries.
+
+def unbox(atom):
+    if isinstance(atom, protocall_pb2.Expression):
+        if not atom.HasField("atom"):
+            return atom
+        atom = atom.atom
+    if isinstance(atom, protocall_pb2.Atom):
+        if not atom.HasField("literal"):
+            return atom
+        literal = atom.literal
+    elif isinstance(atom, protocall_pb2.Literal):
+        literal = atom
+        atom = None
+    elif isinstance(atom, protocall_pb2.Array):
+        return unbox_array(atom)
+    else:
+        return atom
+    kind = literal.WhichOneof("literal")
+    if kind == "integer":
+        return literal.integer.value
+    elif kind == "string":
+        return literal.string.value
+    elif kind == "boolean":
+        return literal.boolean.value
+    elif kind == "array":
+        return unbox_array(literal.array)
+    elif kind == "integer_array":
+        return list(literal.integer_array.value)
+    elif kind == "double_array":
+        return list(literal.double_array.value)
+    elif kind == "proto":
+        # Parsed once, here; the message is then read and mutated in place.
+        name = ".".join([component.name for component in literal.proto.field.component])
+        return parse_proto(literal.proto.value, name)
+    raise RuntimeError(str(literal))
+
+def unbox_array(array):
+    return [unbox(element) for element in array.element]
+
+def _integer_atom(v):
+    a = protocall_pb2.Atom()
+    a.literal.integer.value = v
+    return a
+
+small_integers = [_integer_atom(v) for v in range(-5, 257)]
+
+def box(v):
+    if isinstance(v, bool):
+        if v:
+            return atom_true
+        return atom_false
+    elif isinstance(v, (int, long)):
+        if -5 <= v <= 256:
+            return small_integers[v + 5]
+        return _integer_atom(v)
+    elif isinstance(v, basestring):
+        a = protocall_pb2.Atom()
+        a.literal.string.value = v
+        return a
+    elif v is None or isinstance(v, protocall_pb2.Atom):
+        return v
+    elif isinstance(v, protocall_pb2.Expression):
+        return v.atom
+    elif isinstance(v, list):
+        # Homogeneous numeric lists are packed.
+        a = protocall_pb2.Atom()
+        # Repeated int64 fields give back longs.
+        if all(isinstance(e, (int, long)) and not isinstance(e, bool) for e in v):
+            a.literal.integer_array.value.extend(v)
+        elif all(type(e) is float for e in v):
+            a.literal.double_array.value.extend(v)
+        else:
+            for e in v:
+                a.literal.array.element.add().atom.CopyFrom(box(e))
+        return a
+    elif isinstance(v, protocall_pb2.Array):
+        a = protocall_pb2.Atom()
+        a.literal.array.CopyFrom(v)
+        return a
+    elif isinstance(v, protocall_pb2.Literal):
+        a = protocall_pb2.Atom()
+        a.literal.CopyFrom(v)
+        return a
+    elif isinstance(v, message.Message):
+        # Proto.value text is only produced when a message leaves the runtime.
+        a = protocall_pb2.Atom()
+        a.literal.proto.field.component.add().name = message_name(v)
+        a.literal.proto.value = text_format.MessageToString(v)
+        return a
+    raise TypeError(v.__class__)
+
+def expression(result):
+    if isinstance(result, protocall_pb2.Expression):
+        return result
+    e = protocall_pb2.Expression()
+    e.atom.CopyFrom(box(result))
+    return e
+
+def symbol_value(e):
+    if isinstance(e, (protocall_pb2.Expression, protocall_pb2.Atom, protocall_pb2.Literal)):
+        return unbox(e)
+    return e
+
+def copy_message(m):
+    c = m.__class__()
+    c.CopyFrom(m)
+    return c
@@ -17,12 +17,24 @@ from protocall.proto import protocall_pb2
 from google.protobuf import text_format
 import subrs
 import builtins
+import compiler
+import optimizer
+import diagnostics
+from errors import ExecutionError, execution_error
+from profiler import clock
+from tasks import DEFAULT_CONCURRENCY
 from truth import is_true
 from symbols import Symbols
+from value import box, unbox, expression, symbol_value
 from operators import arithmetic_operators, comparison_operators
 
+INTERPRETED = "interpreted"
+COMPILED = "compiled"
+
 class Protocall:
-  def __init__(self, symbols=None, tracing=False):
+  def __init__(self, symbols=None, tracing=False, engine=INTERPRETED, optimize=False,
+               profiler=None, production=False, concurrency=DEFAULT_CONCURRENCY, services=None,
+               cache=None):
     if symbols is not None:
       self.symbols = symbols
     else:
@@ -31,69 +43,141 @@ class Protocall:
     self.builtins = dict([(name, getattr(builtins, name)) for name in dir(builtins) if not name.startswith("_")])
     self.udfs = {}
     self.tracing = tracing
+    # Set by a return_ statement until the enclosing UDF call or program
+    # finishes, so that the blocks it is nested in stop executing.
+    self.returning = False
+    if engine not in (INTERPRETED, COMPILED):
+      raise ValueError(engine)
+    self.engine = engine
+    # Compiled closures, keyed by id() of the Block they were compiled from.
+    # The Block is kept in the entry so its id cannot be reused.
+    self.compiled = {}
+    # Likewise for UDF bodies, compiled to run in slot frames.
+    self.compiled_functions = {}
+    # Blocks passed to execute are rewritten by optimizer.optimize first.
+    self.optimize = optimize
+    self.optimized = {}
+    # A profiler.Profiler, or None to run without profiling.
+    self.profiler = profiler
+    # In production mode a failing statement raises errors.ExecutionError
+    # instead of stopping in pdb.
+    self.production = production
+    # The most calls started by the spawn subr that run at once, and the
+    # tasks.TaskPool that runs them, started by the first spawn.
+    self.concurrency = concurrency
+    self.task_pool = None
+    # A services.Services, for calls of the form Service.Method(...).
+    self.services = services
+    # A cache.CallCache for the builtin and service calls it names.
+    self.cache = cache
 
   def enable_tracing(self):
     self.tracing = True
   def disable_tracing(self):
     self.tracing = False
 
+  def trace(self, statement):
+    print "hit ENTER for statement:"
+    print text_format.MessageToString(statement, as_one_line=True)
+    print "with local variables:",
+    print self.symbols.locals()
+    line = sys.stdin.readline().strip()
+
+  # Called from the except clause around every statement.
+  def statement_failed(self, statement):
+    if self.production:
+      error_type, error, tb = sys.exc_info()
+      if isinstance(error, ExecutionError):
+        raise error_type, error, tb
+      raise execution_error(self, statement), None, tb
+    print "Execution failed at line:"
+    print text_format.MessageToString(statement, as_one_line=True)
+    import pdb; pdb.set_trace()
+
+  def compile(self, block):
+    entry = self.compiled.get(id(block))
+    if entry is None:
+      entry = (block, compiler.compile_block(block))
+      self.compiled[id(block)] = entry
+    return entry[1]
+
+  def compile_function(self, block):
+    entry = self.compiled_functions.get(id(block))
+    if entry is None:
+      entry = (block, compiler.compile_function(block))
+      self.compiled_functions[id(block)] = entry
+    return entry[1]
+
+  def optimized_block(self, block):
+    entry = self.optimized.get(id(block))
+    if entry is None:
+      entry = (block, optimizer.optimize(block))
+      self.optimized[id(block)] = entry
+    return entry[1]
+
   def execute(self, block):
+    if self.optimize:
+      block = self.optimized_block(block)
+    depth = len(self.symbols.stack)
+    try:
+      result = self.run_block(block)
+    finally:
+      # An ExecutionError leaves the frames of the UDFs it passed through.
+      del self.symbols.stack[depth:]
+      self.returning = False
+    if result is None:
+      return None
+    return expression(result)
+
+  def run_block(self, block):
+    if self.engine == COMPILED:
+      return self.compile(block)(self)
+    result = None
+    debug = diagnostics.enabled(diagnostics.DEBUG)
+    trace = diagnostics.enabled(diagnostics.TRACE)
     for statement in block.statement:
-      print "statement:", statement
+      if debug:
+        diagnostics.debug("statement", statement=statement)
       if self.tracing:
-        print "hit ENTER for statement:"
-        print text_format.MessageToString(statement, as_one_line=True)
-        print "with local variables:",
-        print self.symbols.locals()
-        line = sys.stdin.readline().strip()
+        self.trace(statement)
+      if self.profiler is not None:
+        start = clock()
       try:
         if statement.HasField("assignment"):
           result = self.assignment(statement)
+          if trace:
+            diagnostics.trace("assignment", field=statement.assignment.field, value=result)
         elif statement.HasField("array_assignment"):
           result = self.array_assignment(statement)
         elif statement.HasField("call"):
           result = self.invoke(statement.call)
         elif statement.HasField("conditional"):
-          e_result = self.evaluate(statement.conditional.if_scope.expression)
+          e_result = self.eval(statement.conditional.if_scope.expression)
           if is_true(e_result):
-            result = self.execute(statement.conditional.if_scope.scope.block)
+            result = self.run_block(statement.conditional.if_scope.scope.block)
           else:
             for expression_scope in statement.conditional.elif_scope:
-              e_result = self.evaluate(expression_scope.expression)
+              e_result = self.eval(expression_scope.expression)
               if is_true(e_result):
-                result = self.execute(expression_scope.scope.block)
+                result = self.run_block(expression_scope.scope.block)
                 break
             else:
               if len(statement.conditional.else_scope.block.statement):
-                result = self.execute(statement.conditional.else_scope.block)
+                result = self.run_block(statement.conditional.else_scope.block)
         elif statement.HasField("return_"):
-          e_result = self.evaluate(statement.return_.expression)
-          if isinstance(e_result, protocall_pb2.Expression):
-            result = e_result
-          elif isinstance(e_result, protocall_pb2.Atom):
-            result = protocall_pb2.Expression()
-            result.atom.CopyFrom(e_result)
-          elif isinstance(e_result, protocall_pb2.Array):
-            result = protocall_pb2.Expression()
-            result.atom.CopyFrom(e_result)
-          elif isinstance(e_result, int):
-            result = protocall_pb2.Expression()
-            result.atom.literal.integer.value = e_result
-          elif isinstance(e_result, str):
-            result = protocall_pb2.Expression()
-            result.atom.literal.string.value = e_result
-          else:
-            print e_result.__class__
-            raise RuntimeError
-          ## Should call return here
+          result = self.eval(statement.return_.expression)
+          self.returning = True
         elif statement.HasField("while_"):
+          result = None
           while True:
-            e_result = self.evaluate(statement.while_.expression_scope.expression)
+            e_result = self.eval(statement.while_.expression_scope.expression)
             if is_true(e_result):
-              self.execute(statement.while_.expression_scope.scope.block)
+              r = self.run_block(statement.while_.expression_scope.scope.block)
+              if self.returning:
+                result = r
+                break
             else:
               break
-          result = None
         elif statement.HasField("define"):
           ## Only support definition of top-level fields
           identifier = statement.define.field.component[0].name
@@ -102,121 +186,111 @@ class Protocall:
         else:
           raise RuntimeError(str(statement))
       except Exception as e:
-        print "Execution failed at line:"
-        print text_format.MessageToString(statement, as_one_line=True)
-        import pdb; pdb.set_trace()
-        print "foo"
+        self.statement_failed(statement)
+      if self.profiler is not None:
+        self.profiler.statement(statement, clock() - start)
+      if self.returning:
+        break
     return result
 
   def handle_atom(self, atom):
     if atom.HasField("literal"):
-      result = atom
+      result = unbox(atom)
     elif atom.HasField("expression"):
-      result = self.evaluate(atom.expression)
+      result = self.eval(atom.expression)
     elif atom.HasField("field"):
       result = self.symbols.lookup_local(atom.field)
     elif atom.HasField("array_ref"):
-      array = self.symbols.lookup_local(atom.array_ref.field)
-      result = self.evaluate(array.element[atom.array_ref.index.value])
+      result = self.symbols.lookup_local(atom.array_ref.field)[atom.array_ref.index.value]
     else:
       raise RuntimeError
     return result
 
   def evaluate(self, expression):
+    return box(self.eval(expression))
+
+  def eval(self, expression):
     result = None
     assert isinstance(expression, protocall_pb2.Expression), type(expression)
     if expression.HasField("atom"):
       if expression.atom.literal.HasField("array"):
-        for element in expression.atom.literal.array.element:
-          e = protocall_pb2.Expression()
-          e.atom.CopyFrom(self.evaluate(element))
-          element.CopyFrom(e)
-        result = expression.atom
+        result = [symbol_value(self.eval(element)) for element in expression.atom.literal.array.element]
       else:
         result = self.handle_atom(expression.atom)
     elif expression.HasField("call"):
       result = self.invoke(expression.call)
     elif expression.HasField("arithmetic_operator"):
-      print "evaluate arithmetic operator"
-      print "left before=", expression.arithmetic_operator.left
-      print "right before=", expression.arithmetic_operator.right
-      left = self.evaluate(expression.arithmetic_operator.left)
-      right = self.evaluate(expression.arithmetic_operator.right)
-      print "left=", left
-      print "right=", right
-      r = arithmetic_operators[expression.arithmetic_operator.operator](left, right)
-      result = protocall_pb2.Atom()
-      result.literal.CopyFrom(r)
+      left = self.eval(expression.arithmetic_operator.left)
+      right = self.eval(expression.arithmetic_operator.right)
+      result = arithmetic_operators[expression.arithmetic_operator.operator](left, right)
     elif expression.HasField("comparison_operator"):
-      left = self.evaluate(expression.comparison_operator.left)
-      right = self.evaluate(expression.comparison_operator.right)
-      r = comparison_operators[expression.comparison_operator.operator](left, right)
-      result = protocall_pb2.Atom()
-      result.literal.CopyFrom(r)
+      left = self.eval(expression.comparison_operator.left)
+      right = self.eval(expression.comparison_operator.right)
+      result = comparison_operators[expression.comparison_operator.operator](left, right)
     else:
       raise RuntimeError
-      import pdb; pdb.set_trace()
-      print "expression:", expression
     return result
 
   def invoke(self, call):
-    # For now, only support fields with a single component
-    assert (len(call.field.component) == 1)
+    if len(call.field.component) != 1:
+      name = ".".join([component.name for component in call.field.component])
+      args = [(arg.identifier.name, symbol_value(self.eval(arg.expression))) for arg in call.argument]
+      return self.call_service(name, args)
     name = call.field.component[0].name
     if name in self.subrs:
       function = self.subrs[name]
-      result = function(self, call.argument, self.symbols)
+      return function(self, call.argument, self.symbols)
     elif name in self.builtins or name in self.udfs:
-      if name in self.builtins:
-        function = self.builtins[name]
-      elif name in self.udfs:
-        function = self.udfs[name]
-      else:
-        raise RuntimeError
-      args = [ (arg.identifier.name, self.evaluate(arg.expression)) for arg in call.argument ]
-      self.symbols.push_frame()
-      for arg in args:
-        f = protocall_pb2.Field()
-        f.component.add().name = arg[0]
-        self.symbols.add_local_symbol(f, arg[1])
-      if type(function) == types.FunctionType:
-        result = function(args, self.symbols)
-      elif isinstance(function, protocall_pb2.Block):
-        result = self.execute(function)
-      self.symbols.pop_frame()
+      args = [ (arg.identifier.name, self.eval(arg.expression)) for arg in call.argument ]
+      return self.call_function(name, args)
     else:
       raise KeyError, name
 
+  def call_function(self, name, args):
+    if self.profiler is None:
+      if self.cache is not None and name in self.cache:
+        return self.cache.call(name, args, self.run_function)
+      return self.run_function(name, args)
+    start = clock()
+    try:
+      if self.cache is not None and name in self.cache:
+        return self.cache.call(name, args, self.run_function)
+      return self.run_function(name, args)
+    finally:
+      self.profiler.call(name, name in self.builtins, clock() - start)
+
+  def call_service(self, name, args):
+    if self.services is None or name not in self.services:
+      raise KeyError, name
+    if self.cache is not None and name in self.cache:
+      return self.cache.call(name, args, self.services.call)
+    return self.services.call(name, args)
+
+  def run_function(self, name, args):
+    if name in self.builtins:
+      function = self.builtins[name]
+    elif name in self.udfs:
+      function = self.udfs[name]
+    else:
+      raise KeyError, name
+    if self.engine == COMPILED and isinstance(function, protocall_pb2.Block):
+      return self.compile_function(function)(self, args)
+    self.symbols.push_frame(dict(args))
+    if type(function) == types.FunctionType:
+      result = function(args, self.symbols)
+    elif isinstance(function, protocall_pb2.Block):
+      result = self.run_block(function)
+      self.returning = False
+    self.symbols.pop_frame()
     return result
 
   def assignment(self, a):
-    print "assignment:", a
-    e = self.evaluate(a.assignment.expression)
-    if isinstance(e, protocall_pb2.Expression):
-      e = e.atom
-    if isinstance(e, protocall_pb2.Atom):
-      if e.HasField("literal"):
-        if e.literal.HasField("integer"):
-          v = e.literal.integer.value
-        elif e.literal.HasField("string"):
-          v = e.literal.string.value
-        elif e.literal.HasField("array"):
-          v = e.literal.array
-        elif e.literal.HasField("proto"):
-          v = e
-        else:
-          raise RuntimeError
-      else:
-        raise RuntimeError
-    else:
-      raise RuntimeError
+    v = symbol_value(self.eval(a.assignment.expression))
     self.symbols.add_local_symbol(a.assignment.field, v)
     return v
 
   def array_assignment(self, a):
-    e = self.evaluate(a.array_assignment.expression)
+    e = symbol_value(self.eval(a.array_assignment.expression))
     n = self.symbols.lookup(a.array_assignment.array_ref.field)
-    x = a.array_assignment.array_ref.index.value
-    n.element[a.array_assignment.array_ref.index.value].atom.CopyFrom(e)
-    self.symbols.add_local_symbol(a.array_assignment.array_ref.field, e)
+    n[a.array_assignment.array_ref.index.value] = e
     return e